@@ -1,15 +1,16 @@
 from django.contrib import admin
 from .models import Purchase, PurchaseVendor, PurchaseInvoice, Product, PurchaseProduct, Payment
 from .models import SalesInvoice, SalesProduct, SalesPayment, Customer, Product, Expense, Damages, SalesLot, Packaging_Invoice
-from django.shortcuts import redirect, render  # Add render
+from .models import CREDIT_STATUSES, DailyRollup, ImportJob
+from django.shortcuts import get_object_or_404, redirect, render  # Add render
 from django.urls import reverse
 from django.urls import path, re_path
-from django.utils.html import format_html
+from django.utils.html import format_html, format_html_join
 from django.http import JsonResponse
 from django.db import models
-from django.http import HttpResponse
+from django.http import FileResponse, HttpResponse, StreamingHttpResponse
 from django.contrib.admin import SimpleListFilter
-from django.db.models import Sum, Count, F, DecimalField, OuterRef, Subquery
+from django.db.models import Sum, Count, F, DecimalField, OuterRef, Subquery, Value
 from django.db.models.functions import Coalesce
 from django import forms
 from django.contrib.admin.views.main import ChangeList
@@ -17,12 +18,10 @@ from django.utils import timezone
 from datetime import timedelta
 import json
 from django.db.models import Q
-from django.db.models.functions import ExtractMonth
+from django.db.models.functions import ExtractMonth, TruncMonth
 import requests
 from django.contrib import messages
-import csv
 from django.utils.encoding import smart_str
-import io
 from django.core.exceptions import ValidationError
 from django.contrib.auth.models import User, Group
 from django.contrib.auth.admin import UserAdmin, GroupAdmin
@@ -32,7 +31,14 @@ from import_export.admin import ImportExportModelAdmin
 from import_export.results import RowResult
 
 # Import our CSV import/export functionality
-from .admin_csv import SalesInvoiceCSVMixin, PurchaseInvoiceCSVMixin
+from .admin_csv import CSVExporter, SalesInvoiceCSVMixin, PurchaseInvoiceCSVMixin
+from notifications.signals import low_inventory_notification
+from .utils import current_tenant_id, tenant_cache_key
+from . import imports, pdf_batch, pdf_cache
+from django.core.cache import cache
+
+# Lot availability shown while typing may lag behind by this many seconds
+LOT_AUTOCOMPLETE_CACHE_SECONDS = 30
 
 admin.site.site_header = "Star Mango Supplies Korutla"   # Header displayed at the top of the admin
 admin.site.site_title = "Star Mango Supplies Korutla"     # Title tag for the admin pages
@@ -165,16 +171,80 @@ class PurchaseInvoiceResource(resources.ModelResource):
             
         return super().skip_row(instance, original, row, import_validation_errors)
 
+# Filter invoices on an annotated total, see PurchaseInvoiceAdmin/SalesInvoiceAdmin.get_queryset
+class InvoiceTotalFilter(SimpleListFilter):
+    title = 'Invoice Total'
+    parameter_name = 'invoice_total'
+    field = None
+    ranges = (
+        ('under_10k', 'Under ₹10,000', None, 10000),
+        ('10k_50k', '₹10,000 - ₹50,000', 10000, 50000),
+        ('over_50k', 'Over ₹50,000', 50000, None),
+    )
+
+    def lookups(self, request, model_admin):
+        return [(value, label) for value, label, _, _ in self.ranges]
+
+    def queryset(self, request, queryset):
+        for value, _, low, high in self.ranges:
+            if self.value() == value:
+                if low is not None:
+                    queryset = queryset.filter(**{f'{self.field}__gte': low})
+                if high is not None:
+                    queryset = queryset.filter(**{f'{self.field}__lt': high})
+        return queryset
+
+
+class PurchaseInvoiceTotalFilter(InvoiceTotalFilter):
+    field = 'annotated_net_total_after_cash_cutting'
+
+
+class SalesInvoiceTotalFilter(InvoiceTotalFilter):
+    field = 'annotated_net_total_after_packaging'
+
+
+class BatchPrintMixin:
+    """Admin actions printing the selected invoices as one ZIP or one merged PDF (see Accounts/pdf_batch.py)"""
+    pdf_kind = None
+    pdf_date_field = None
+
+    def _rendered_pdfs(self, queryset):
+        invoice_ids = list(queryset.order_by(self.pdf_date_field, 'pk').values_list('pk', flat=True))
+        # In this process: a request never forks workers (see Accounts/pdf_batch.py)
+        return pdf_batch.render(self.pdf_kind, invoice_ids)
+
+    def print_as_zip(self, request, queryset):
+        response = StreamingHttpResponse(
+            pdf_batch.stream_zip(self._rendered_pdfs(queryset)), content_type='application/zip'
+        )
+        filename = f"{self.pdf_kind}_invoices_{timezone.now().strftime('%Y-%m-%d')}.zip"
+        response['Content-Disposition'] = f'attachment; filename="{filename}"'
+        return response
+    print_as_zip.short_description = "Print selected invoices as a ZIP of PDFs"
+
+    def print_as_merged_pdf(self, request, queryset):
+        filename = f"{self.pdf_kind}_invoices_{timezone.now().strftime('%Y-%m-%d')}.pdf"
+        return FileResponse(
+            pdf_batch.merged_pdf(self._rendered_pdfs(queryset)),
+            content_type='application/pdf',
+            filename=filename,
+        )
+    print_as_merged_pdf.short_description = "Print selected invoices as one PDF"
+
+
 # Admin for PurchaseInvoice
-class PurchaseInvoiceAdmin(PurchaseInvoiceCSVMixin, ImportExportModelAdmin):
+class PurchaseInvoiceAdmin(BatchPrintMixin, PurchaseInvoiceCSVMixin, ImportExportModelAdmin):
     resource_class = PurchaseInvoiceResource
     model = PurchaseInvoice
     list_display = ('invoice_number','lot_number', 'vendor_name', 'net_total_after_cash_cutting', 'paid_amount', 'due_amount_display', 'payment_status', 'date', 'print_invoice')
     readonly_fields = ('invoice_number', 'lot_number','net_total', 'net_total_after_cash_cutting', 'paid_amount_display', 'due_amount_display', 'payment_status')
     search_fields = ('invoice_number','lot_number', 'vendor__name')
-    list_filter = ('date', 'vendor')
+    list_filter = ('date', 'payment_status', PurchaseInvoiceTotalFilter, 'vendor')
+    list_select_related = ('vendor',)
     autocomplete_fields = ['vendor']
-    actions = ['export_as_csv']
+    actions = ['export_as_csv', 'print_as_zip', 'print_as_merged_pdf']
+    pdf_kind = pdf_cache.PURCHASE_INVOICE
+    pdf_date_field = 'date'
 
     # Removing Media class to stop loading JavaScript
     # class Media:
@@ -185,13 +255,24 @@ class PurchaseInvoiceAdmin(PurchaseInvoiceCSVMixin, ImportExportModelAdmin):
         # Always show both product and payment inlines
         return [PurchaseProductInline, PaymentInline]
 
+    def get_queryset(self, request):
+        # Derived totals as annotations and payments in one query, instead of per row
+        return super().get_queryset(request).with_stored_totals().prefetch_related('payments')
+
     def vendor_name(self, obj):
         return obj.vendor.name
     vendor_name.short_description = "Vendor"
+    vendor_name.admin_order_field = 'vendor__name'
+
+    def net_total_after_cash_cutting(self, obj):
+        return obj.net_total_after_cash_cutting
+    net_total_after_cash_cutting.short_description = "Net total after cash cutting"
+    net_total_after_cash_cutting.admin_order_field = 'annotated_net_total_after_cash_cutting'
 
     def net_total_display(self, obj):
         return f"₹{obj.net_total:.2f}"
     net_total_display.short_description = "Net Total"
+    net_total_display.admin_order_field = 'net_total'
 
     def paid_amount_display(self, obj):
         payments = obj.payments.all()
@@ -199,19 +280,15 @@ class PurchaseInvoiceAdmin(PurchaseInvoiceCSVMixin, ImportExportModelAdmin):
         total_paid = f"<b>Total Paid:</b> ₹{obj.paid_amount:.2f}"
         return format_html(f"{details}<br/>{total_paid}")
     paid_amount_display.short_description = "Paid Amount"
+    paid_amount_display.admin_order_field = 'paid_amount'
 
     def due_amount_display(self, obj):
         return format_html(f"<b style='color: #dc3545;'>₹{obj.due_amount:.2f}</b>")
     due_amount_display.short_description = "Due Amount"
+    due_amount_display.admin_order_field = 'due_amount'
 
     def payment_status(self, obj):
-        if obj.due_amount == 0:
-            status = "Paid"
-        elif obj.paid_amount == 0:
-            status = "Unpaid"
-        else:
-            status = "Partial"
-
+        status = obj.payment_status
         colors = {
             'Paid': '#28a745',
             'Unpaid': '#dc3545',
@@ -219,40 +296,36 @@ class PurchaseInvoiceAdmin(PurchaseInvoiceCSVMixin, ImportExportModelAdmin):
         }
         return format_html(f"<b style='color: {colors.get(status, '#000')};'>{status}</b>")
     payment_status.short_description = "Payment Status"
+    payment_status.admin_order_field = 'payment_status'
 
     def print_invoice(self, obj):
         url = reverse('generate_invoice_pdf', args=[obj.id])
         return format_html('<a class="button" href="{}" target="_blank">Print Invoice</a>', url)
     print_invoice.short_description = "Print Invoice"
 
-    def save_model(self, request, obj, form, change):
-        """Override save_model to ensure calculations are performed properly"""
-        super().save_model(request, obj, form, change)
-        # After saving, update the net_total once more to ensure it's correct
-        if obj.pk:
-            calculated_total = sum(product.total for product in obj.purchase_products.all())
-            if obj.net_total != calculated_total:
-                # Use update to avoid triggering another full save
-                PurchaseInvoice.objects.filter(pk=obj.pk).update(net_total=calculated_total)
-
-    def save_formset(self, request, form, formset, change):
-        """Override save_formset to ensure all formsets are saved"""
-        # Always save all formsets, whether creating new or editing
-        super().save_formset(request, form, formset, change)
-        # After saving formsets, make sure the parent object's calculations are updated
-        obj = form.instance
-        if obj.pk:
-            calculated_total = sum(product.total for product in obj.purchase_products.all())
-            if obj.net_total != calculated_total:
-                # Use update to avoid triggering another full save
-                PurchaseInvoice.objects.filter(pk=obj.pk).update(net_total=calculated_total)
-
     def response_change(self, request, obj):
         if "_print_without_payments" in request.POST:
             url = reverse('generate_invoice_pdf', args=[obj.id]) + "?hide_payments=1"
             return redirect(url)
         return super().response_change(request, obj)
 
+    def save_formset(self, request, form, formset, change):
+        if formset.model is not PurchaseProduct:
+            return super().save_formset(request, form, formset, change)
+        # Write all product lines in one pass instead of one save() per line
+        formset.save(commit=False)
+        deleted = {line.pk for line in formset.deleted_objects}
+        lines = [
+            line_form.instance for line_form in formset.initial_forms
+            if line_form.instance.pk not in deleted
+        ] + formset.new_objects
+        form.instance.set_lines(lines)
+        # The bulk writes send no post_save, so the entered lines are checked for low inventory here
+        touched = [(line, True) for line in formset.new_objects]
+        touched += [(line, False) for line, _ in formset.changed_objects]
+        for line, created in touched:
+            low_inventory_notification(sender=PurchaseProduct, instance=line, created=created)
+
     def get_urls(self):
         from django.urls import path, re_path
         urls = super().get_urls()
@@ -264,54 +337,41 @@ class PurchaseInvoiceAdmin(PurchaseInvoiceCSVMixin, ImportExportModelAdmin):
         return custom_urls + urls
 
     def autocomplete(self, request):
-        query = request.GET.get('q', '')
-        lots = PurchaseInvoice.objects.filter(lot_number__icontains=query)[:10]
-        results = []
-        for lot in lots:
-            products = lot.get_product_quantities()
-            product_info = ", ".join([f"{k}: {v}" for k, v in products.items()])
-            results.append({
-                'id': lot.id,
-                'text': f"{lot.lot_number} - Available: {product_info}",
-            })
+        query = request.GET.get('q', '').strip()
+        # The match ignores case, so queries differing only in case share a cache entry
+        key = tenant_cache_key('lot-autocomplete', current_tenant_id(request), query.upper())
+        results = cache.get(key)
+        if results is None:
+            # Anywhere in the lot number, so "12" finds "LOT-12"
+            lots = PurchaseInvoice.objects.filter(lot_number__icontains=query).order_by('-date', '-id')[:10]
+            lots = list(lots.values_list('id', 'lot_number'))
+            quantities = PurchaseInvoice.objects.filter(pk__in=[lot_id for lot_id, _ in lots]).product_quantities()
+            results = []
+            for lot_id, lot_number in lots:
+                products = quantities.get(lot_id, {})
+                product_info = ", ".join([f"{k}: {v}" for k, v in products.items()])
+                results.append({
+                    'id': lot_id,
+                    'text': f"{lot_number} - Available: {product_info}",
+                })
+            cache.set(key, results, LOT_AUTOCOMPLETE_CACHE_SECONDS)
         return JsonResponse({'results': results})
 
     def export_as_csv(self, request, queryset):
         """Export selected invoices as CSV"""
-        if not queryset:
+        if not queryset.exists():
             self.message_user(request, "No invoices selected for export", level=messages.WARNING)
             return None
-            
-        response = HttpResponse(content_type='text/csv')
+
         filename = f"purchase_invoices_{timezone.now().strftime('%Y-%m-%d')}.csv"
-        response['Content-Disposition'] = f'attachment; filename="{filename}"'
-        
-        writer = csv.writer(response)
-        # Write header row
-        writer.writerow([
-            'Invoice Number', 
-            'Lot Number',
-            'Vendor',
-            'Date',
-            'Net Total',
-            'Paid Amount',
-            'Due Amount'
+        headers = ['Invoice Number', 'Lot Number', 'Vendor', 'Date', 'Net Total', 'Paid Amount', 'Due Amount']
+        # Streamed from the stored totals, a chunk of rows at a time
+        rows = CSVExporter.rows(queryset, [
+            'invoice_number', 'lot_number', 'vendor__name', 'date', 'net_total', 'paid_amount', 'due_amount',
         ])
-        
-        # Write data rows
-        for invoice in queryset:
-            writer.writerow([
-                invoice.invoice_number,
-                invoice.lot_number,
-                invoice.vendor.name,
-                invoice.date.strftime('%Y-%m-%d'),
-                invoice.net_total,
-                invoice.paid_amount,
-                invoice.due_amount
-            ])
-        
+
         self.message_user(request, f"Successfully exported {queryset.count()} invoices")
-        return response
+        return CSVExporter.response(filename, headers, rows)
     export_as_csv.short_description = "Export selected invoices as CSV"
     
     def import_csv(self, request):
@@ -323,78 +383,7 @@ class PurchaseInvoiceAdmin(PurchaseInvoiceCSVMixin, ImportExportModelAdmin):
                 messages.error(request, 'File is not a CSV')
                 return redirect('..')
                 
-            # Process CSV file
-            decoded_file = csv_file.read().decode('utf-8')
-            io_string = io.StringIO(decoded_file)
-            reader = csv.reader(io_string)
-            
-            # Skip header row
-            next(reader, None)
-            
-            success_count = 0
-            error_count = 0
-            error_messages = []
-            
-            for row in reader:
-                try:
-                    if len(row) < 5:  # Check minimum number of required fields
-                        raise ValidationError("Row has insufficient data")
-                        
-                    invoice_number = row[0]
-                    lot_number = row[1]
-                    vendor_name = row[2]
-                    date_str = row[3]
-                    net_total = float(row[4])
-                    
-                    # Get or create vendor
-                    vendor, created = PurchaseVendor.objects.get_or_create(name=vendor_name)
-                    
-                    # Check if invoice already exists
-                    if PurchaseInvoice.objects.filter(invoice_number=invoice_number).exists():
-                        # Update existing invoice
-                        invoice = PurchaseInvoice.objects.get(invoice_number=invoice_number)
-                        invoice.lot_number = lot_number
-                        invoice.vendor = vendor
-                        invoice.date = timezone.datetime.strptime(date_str, '%Y-%m-%d').date()
-                        invoice.net_total = net_total
-                        invoice.save()
-                    else:
-                        # Create new invoice
-                        invoice = PurchaseInvoice.objects.create(
-                            invoice_number=invoice_number,
-                            lot_number=lot_number,
-                            vendor=vendor,
-                            date=timezone.datetime.strptime(date_str, '%Y-%m-%d').date(),
-                            net_total=net_total
-                        )
-                    
-                    # Process payments if provided
-                    if len(row) > 5 and row[5]:
-                        paid_amount = float(row[5])
-                        if paid_amount > 0:
-                            Payment.objects.create(
-                                invoice=invoice,
-                                amount=paid_amount,
-                                date=timezone.now()
-                            )
-                            
-                    success_count += 1
-                    
-                except Exception as e:
-                    error_count += 1
-                    error_messages.append(f"Error in row {error_count + success_count}: {str(e)}")
-            
-            # Show results
-            if success_count:
-                messages.success(request, f"Successfully imported {success_count} invoices.")
-            if error_count:
-                messages.error(request, f"Failed to import {error_count} invoices. See details below.")
-                for msg in error_messages[:10]:  # Show first 10 errors
-                    messages.error(request, msg)
-                if len(error_messages) > 10:
-                    messages.error(request, f"... and {len(error_messages) - 10} more errors.")
-                    
-            return redirect('..')
+            return self.queue_import(request, csv_file, imports.PurchaseInvoiceExportFormat.name)
             
         # If GET request, show upload form
         return render(request, 'admin/import_csv.html', {
@@ -483,42 +472,11 @@ class CreditStatusFilter(SimpleListFilter):
     parameter_name = 'credit_status_filter'
 
     def lookups(self, request, model_admin):
-        return (
-            ('over_limit', 'Over Limit'),
-            ('near_limit', 'Near Limit'),
-            ('within_limit', 'Within Limit'),
-            ('no_limit', 'No Limit Set'),
-        )
+        return CREDIT_STATUSES
 
     def queryset(self, request, queryset):
-        if self.value() == 'over_limit':
-            # Find customers where their total_due > credit_limit (and credit_limit > 0)
-            over_limit_customers = []
-            for customer in queryset.filter(credit_limit__gt=0):
-                if customer.total_due > customer.credit_limit:
-                    over_limit_customers.append(customer.id)
-            return queryset.filter(id__in=over_limit_customers)
-            
-        elif self.value() == 'near_limit':
-            # Find customers where total_due is 80-100% of credit_limit
-            near_limit_customers = []
-            for customer in queryset.filter(credit_limit__gt=0):
-                if customer.total_due >= (customer.credit_limit * 0.8) and customer.total_due <= customer.credit_limit:
-                    near_limit_customers.append(customer.id)
-            return queryset.filter(id__in=near_limit_customers)
-            
-        elif self.value() == 'within_limit':
-            # Find customers where total_due < 80% of credit_limit
-            within_limit_customers = []
-            for customer in queryset.filter(credit_limit__gt=0):
-                if customer.total_due < (customer.credit_limit * 0.8):
-                    within_limit_customers.append(customer.id)
-            return queryset.filter(id__in=within_limit_customers)
-            
-        elif self.value() == 'no_limit':
-            # Customers with no specific credit limit (0 or null)
-            return queryset.filter(credit_limit=0)
-            
+        if self.value() in dict(CREDIT_STATUSES):
+            return queryset.with_credit_status(self.value())
         return queryset
 
 class SalesInvoiceResource(resources.ModelResource):
@@ -624,7 +582,7 @@ class SalesInvoiceResource(resources.ModelResource):
             # Don't fail the import for product errors
 
 # Admin for SalesInvoice
-class SalesInvoiceAdmin(SalesInvoiceCSVMixin, ImportExportModelAdmin):
+class SalesInvoiceAdmin(BatchPrintMixin, SalesInvoiceCSVMixin, ImportExportModelAdmin):
     resource_class = SalesInvoiceResource
     list_display = (
         'invoice_number',
@@ -650,7 +608,9 @@ class SalesInvoiceAdmin(SalesInvoiceCSVMixin, ImportExportModelAdmin):
         'due_amount',
         'payment_status'
     )
-    actions = ['export_as_csv']
+    actions = ['export_as_csv', 'print_as_zip', 'print_as_merged_pdf']
+    pdf_kind = pdf_cache.SALES_INVOICE
+    pdf_date_field = 'invoice_date'
 
     # Simple procedural fields layout rearranged
     fields = [
@@ -681,11 +641,27 @@ class SalesInvoiceAdmin(SalesInvoiceCSVMixin, ImportExportModelAdmin):
         return [SalesLotInline, SalesProductInline, SalesPaymentInline]  # Show all inlines for new
 
     search_fields = ('invoice_number', 'vendor__name', )
-    list_filter = ('invoice_date',)
+    list_filter = ('invoice_date', 'payment_status', SalesInvoiceTotalFilter)
+    list_select_related = ('vendor',)
+
+    def get_queryset(self, request):
+        # Derived totals as annotations and payments in one query, instead of per row
+        return super().get_queryset(request).with_stored_totals().prefetch_related('payments')
 
     def vendor_name(self, obj):
         return obj.vendor.name
     vendor_name.short_description = "Customer"
+    vendor_name.admin_order_field = 'vendor__name'
+
+    def net_total_after_commission(self, obj):
+        return obj.net_total_after_commission
+    net_total_after_commission.short_description = "Net total after commission"
+    net_total_after_commission.admin_order_field = 'annotated_net_total_after_commission'
+
+    def net_total_after_packaging(self, obj):
+        return obj.net_total_after_packaging
+    net_total_after_packaging.short_description = "Net total after packaging"
+    net_total_after_packaging.admin_order_field = 'annotated_net_total_after_packaging'
 
     def paid_amount_display(self, obj):
         payments = obj.payments.all()
@@ -693,13 +669,15 @@ class SalesInvoiceAdmin(SalesInvoiceCSVMixin, ImportExportModelAdmin):
         total_paid = f"<b>Total Paid:</b> ₹{obj.paid_amount:.2f}"
         return format_html(f"{details}<br/>{total_paid}")
     paid_amount_display.short_description = "Paid Amount"
+    paid_amount_display.admin_order_field = 'paid_amount'
 
     def due_amount_display(self, obj):
         return format_html(f"<b style='color: #dc3545;'>₹{obj.due_amount:.2f}</b>")
     due_amount_display.short_description = "Due Amount"
+    due_amount_display.admin_order_field = 'due_amount'
 
     def payment_status(self, obj):
-        status = obj.payment_status()
+        status = obj.payment_status
         colors = {
             'Paid': '#28a745',
             'Unpaid': '#dc3545',
@@ -707,6 +685,7 @@ class SalesInvoiceAdmin(SalesInvoiceCSVMixin, ImportExportModelAdmin):
         }
         return format_html(f"<b style='color: {colors.get(status, '#000')};'>{status}</b>")
     payment_status.short_description = "Payment Status"
+    payment_status.admin_order_field = 'payment_status'
 
     def print_invoice(self, obj):
         url = reverse('generate_sales_invoice_pdf', args=[obj.id])
@@ -747,51 +726,33 @@ class SalesInvoiceAdmin(SalesInvoiceCSVMixin, ImportExportModelAdmin):
     def packaging_total_display(self, obj):
         return f"₹{obj.packaging_total:.2f}"
     packaging_total_display.short_description = "Total packaging cost"
+    packaging_total_display.admin_order_field = 'annotated_packaging_total'
 
     def purchased_crates_total_display(self, obj):
         return f"₹{obj.purchased_crates_total:.2f}"
     purchased_crates_total_display.short_description = "Purchased crates total"
+    purchased_crates_total_display.admin_order_field = 'annotated_purchased_crates_total'
 
     def export_as_csv(self, request, queryset):
         """Export selected invoices as CSV"""
-        if not queryset:
+        if not queryset.exists():
             self.message_user(request, "No invoices selected for export", level=messages.WARNING)
             return None
-            
-        response = HttpResponse(content_type='text/csv')
+
         filename = f"sales_invoices_{timezone.now().strftime('%Y-%m-%d')}.csv"
-        response['Content-Disposition'] = f'attachment; filename="{filename}"'
-        
-        writer = csv.writer(response)
-        # Write header row
-        writer.writerow([
-            'Invoice Number', 
-            'Customer',
-            'Date',
-            'Net Total',
-            'Packaging Total',
-            'Purchased Crates Total',
-            'Net Total After Packaging',
-            'Paid Amount',
-            'Due Amount'
+        headers = [
+            'Invoice Number', 'Customer', 'Date', 'Net Total', 'Packaging Total',
+            'Purchased Crates Total', 'Net Total After Packaging', 'Paid Amount', 'Due Amount',
+        ]
+        # Streamed from the stored totals, a chunk of rows at a time
+        rows = CSVExporter.rows(queryset.with_stored_totals(), [
+            'invoice_number', 'vendor__name', 'invoice_date', 'annotated_net_total_after_commission',
+            'annotated_packaging_total', 'annotated_purchased_crates_total',
+            'annotated_net_total_after_packaging', 'paid_amount', 'due_amount',
         ])
-        
-        # Write data rows
-        for invoice in queryset:
-            writer.writerow([
-                invoice.invoice_number,
-                invoice.vendor.name,
-                invoice.invoice_date.strftime('%Y-%m-%d'),
-                invoice.net_total_after_commission,
-                invoice.packaging_total,
-                invoice.purchased_crates_total,
-                invoice.net_total_after_packaging,
-                invoice.paid_amount,
-                invoice.due_amount
-            ])
-            
+
         self.message_user(request, f"Successfully exported {queryset.count()} invoices")
-        return response
+        return CSVExporter.response(filename, headers, rows)
     export_as_csv.short_description = "Export selected invoices as CSV"
     
     def get_urls(self):
@@ -812,73 +773,7 @@ class SalesInvoiceAdmin(SalesInvoiceCSVMixin, ImportExportModelAdmin):
                 messages.error(request, 'File is not a CSV')
                 return redirect('..')
                 
-            # Process CSV file
-            decoded_file = csv_file.read().decode('utf-8')
-            io_string = io.StringIO(decoded_file)
-            reader = csv.reader(io_string)
-            
-            # Skip header row
-            next(reader, None)
-            
-            success_count = 0
-            error_count = 0
-            error_messages = []
-            
-            for row in reader:
-                try:
-                    if len(row) < 5:  # Check minimum number of required fields
-                        raise ValidationError("Row has insufficient data")
-                        
-                    invoice_number = row[0]
-                    customer_name = row[1]
-                    date_str = row[2]
-                    net_total = float(row[3])
-                    
-                    # Get or create customer
-                    customer, created = Customer.objects.get_or_create(name=customer_name)
-                    
-                    # Check if invoice already exists
-                    if SalesInvoice.objects.filter(invoice_number=invoice_number).exists():
-                        # Update existing invoice
-                        invoice = SalesInvoice.objects.get(invoice_number=invoice_number)
-                        invoice.vendor = customer
-                        invoice.invoice_date = timezone.datetime.strptime(date_str, '%Y-%m-%d').date()
-                        invoice.save()
-                    else:
-                        # Create new invoice with minimal data
-                        invoice = SalesInvoice.objects.create(
-                            invoice_number=invoice_number,
-                            vendor=customer,
-                            invoice_date=timezone.datetime.strptime(date_str, '%Y-%m-%d').date()
-                        )
-                    
-                    # Process payments if provided
-                    if len(row) > 7 and row[7]:
-                        paid_amount = float(row[7])
-                        if paid_amount > 0:
-                            SalesPayment.objects.create(
-                                invoice=invoice,
-                                amount=paid_amount,
-                                date=timezone.now()
-                            )
-                            
-                    success_count += 1
-                    
-                except Exception as e:
-                    error_count += 1
-                    error_messages.append(f"Error in row {error_count + success_count}: {str(e)}")
-            
-            # Show results
-            if success_count:
-                messages.success(request, f"Successfully imported {success_count} invoices.")
-            if error_count:
-                messages.error(request, f"Failed to import {error_count} invoices. See details below.")
-                for msg in error_messages[:10]:  # Show first 10 errors
-                    messages.error(request, msg)
-                if len(error_messages) > 10:
-                    messages.error(request, f"... and {len(error_messages) - 10} more errors.")
-                    
-            return redirect('..')
+            return self.queue_import(request, csv_file, imports.SalesInvoiceExportFormat.name)
             
         # If GET request, show upload form
         return render(request, 'admin/import_csv.html', {
@@ -946,32 +841,19 @@ class CustomerAdmin(ImportExportModelAdmin):
     actions = ['update_credit_limit', 'send_credit_status_notification']
     list_per_page = 50
     
+    def get_queryset(self, request):
+        return super().get_queryset(request).with_credit()
+
     def get_ordering(self, request):
-        if request.GET.get('sort_by_due'):
-            # This is a UI-triggered sort by total_due
-            customers = Customer.objects.all()
-            # Sort the queryset by total_due in memory
-            sorted_customers = sorted(customers, key=lambda x: x.total_due, reverse=True)
-            # Extract the IDs in order
-            customer_ids = [customer.id for customer in sorted_customers]
-            # Build case when ordering
-            when_list = []
-            for pos, id in enumerate(customer_ids):
-                when_list.append(f"WHEN id={id} THEN {pos}")
-            
-            if when_list:
-                ordering = [models.expressions.RawSQL(
-                    f"CASE {' '.join(when_list)} ELSE 9999 END", 
-                    []
-                )]
-                return ordering
         return ['name']  # Default ordering by name
     
     def changelist_view(self, request, extra_context=None):
         extra_context = extra_context or {}
+        # Sorts on the total_due column, which orders by the annotated total due
+        due_column = self.list_display.index('total_due') + 1
         extra_context['sort_options'] = [
             {'label': 'Sort by Name (Default)', 'url': '.'},
-            {'label': 'Sort by Total Due', 'url': f"{request.path}?sort_by_due=1"}
+            {'label': 'Sort by Total Due', 'url': f"{request.path}?o=-{due_column}"}
         ]
         return super().changelist_view(request, extra_context=extra_context)
     
@@ -984,11 +866,13 @@ class CustomerAdmin(ImportExportModelAdmin):
         else:
             return format_html('<span style="color: green;">{}</span>', status)
     credit_status.short_description = "Credit Status"
+    credit_status.admin_order_field = 'annotated_credit_utilization'
     
     def total_due(self, obj):
         # Fix the formatting issue - stringify the value first
         return format_html('₹{}', '{:.2f}'.format(float(obj.total_due)))
     total_due.short_description = "Total Due"
+    total_due.admin_order_field = 'annotated_total_due'
     
     def view_invoices(self, obj):
         url = reverse('admin:Accounts_salesinvoice_changelist') + f'?vendor__id__exact={obj.id}'
@@ -1114,9 +998,17 @@ class packagingsAdmin(admin.ModelAdmin):
     list_filter = ('no_of_crates',)
     search_fields = ('no_of_crates', 'cost_per_crate')
 
+    def get_queryset(self, request):
+        # The total as an annotation, to sort the changelist by it
+        money = DecimalField(max_digits=12, decimal_places=2)
+        return super().get_queryset(request).annotate(
+            annotated_packaging_total=Coalesce(F('no_of_crates') * F('cost_per_crate'), Value(0), output_field=money),
+        )
+
     def packaging_total_display(self, obj):
         return f"₹{obj.packaging_total:.2f}"
     packaging_total_display.short_description = "Total packaging cost"
+    packaging_total_display.admin_order_field = 'annotated_packaging_total'
 
     def print_packaging_invoice(self, obj):
         url = reverse('generate_packaging_pdf', args=[obj.id])
@@ -1137,6 +1029,53 @@ class PurchaseVendorAdmin(ImportExportModelAdmin):
     list_display = ('name', 'contact_number', 'area')
     search_fields = ('name', 'contact_number', 'area')
 
+# Background CSV imports, see Accounts/import_jobs.py
+class ImportJobAdmin(admin.ModelAdmin):
+    list_display = ('file_name', 'format', 'status', 'rows_done', 'success_count', 'error_count',
+                    'created_by', 'created_at', 'finished_at')
+    list_filter = ('status', 'format')
+    search_fields = ('file_name',)
+    fields = ('file_name', 'format', 'status', 'rows_done', 'success_count', 'error_count', 'created_count',
+              'updated_count', 'unchanged_count', 'failure', 'error_list', 'created_by', 'created_at', 'started_at', 'finished_at')
+    readonly_fields = fields
+    actions = ['resume_jobs']
+    change_form_template = 'admin/Accounts/importjob/change_form.html'
+
+    def has_add_permission(self, request):
+        # Jobs are created by the CSV import pages
+        return False
+
+    def get_urls(self):
+        return [
+            path('<int:pk>/progress/', self.admin_site.admin_view(self.progress_view),
+                 name='Accounts_importjob_progress'),
+        ] + super().get_urls()
+
+    def progress_view(self, request, pk):
+        """Progress of a job, polled by its change page while it runs"""
+        job = get_object_or_404(self.get_queryset(request), pk=pk)
+        return JsonResponse({
+            'status': job.status,
+            'rows_done': job.rows_done,
+            'success_count': job.success_count,
+            'error_count': job.error_count,
+            'unchanged_count': job.unchanged_count,
+            'failure': job.failure,
+        })
+
+    def error_list(self, obj):
+        if not obj.error_messages:
+            return '-'
+        return format_html('<ul>{}</ul>', format_html_join('', '<li>{}</li>', ((message,) for message in obj.error_messages)))
+    error_list.short_description = "Errors (first 100)"
+
+    def resume_jobs(self, request, queryset):
+        """Queue failed jobs again; they continue after their last committed chunk"""
+        resumed = queryset.filter(status=ImportJob.FAILED).update(status=ImportJob.QUEUED, failure='', finished_at=None)
+        self.message_user(request, f"{resumed} failed jobs queued again")
+    resume_jobs.short_description = "Resume selected failed jobs"
+
+
 # Registering Vendor models
 admin.site.register(PurchaseVendor, PurchaseVendorAdmin)
 # Registering Purchase models
@@ -1160,6 +1099,7 @@ admin.site.register(Expense, ExpenseAdmin)
 admin.site.register(Damages, DamagesAdmin)
 admin.site.register(SalesLot) # Simple registration for now
 admin.site.register(Packaging_Invoice, packagingsAdmin)
+admin.site.register(ImportJob, ImportJobAdmin)
 
 # Instead of trying to register a view directly, create separate URL patterns 
 # that will be included in the admin site
@@ -1179,28 +1119,22 @@ def credit_dashboard_view(request):
         return redirect('admin:login')
     
     # Calculate summary statistics
-    customers = Customer.objects.all()
-    
-    # Total customers and credit limits
-    total_customers = customers.count()
-    total_credit_limit = customers.aggregate(Sum('credit_limit'))['credit_limit__sum'] or 0
-    
-    # Calculate customers over limit
-    over_limit_customers = []
-    near_limit_customers = []
-    for customer in customers:
-        if customer.credit_limit > 0:  # Only check customers with credit limits
-            try:
-                if customer.total_due > customer.credit_limit:
-                    over_limit_customers.append(customer.id)
-                elif customer.total_due >= (customer.credit_limit * 0.8) and customer.total_due <= customer.credit_limit:
-                    near_limit_customers.append(customer.id)
-            except Exception:
-                # Skip if there's an error calculating
-                pass
+    customers = Customer.objects.with_credit()
     
-    over_limit_count = len(over_limit_customers)
-    near_limit_count = len(near_limit_customers)
+    # Customer counts, credit limits and dues in one query
+    labels = dict(CREDIT_STATUSES)
+    summary = customers.aggregate(
+        total_customers=Count('pk'),
+        total_credit_limit=Sum('credit_limit'),
+        total_due=Sum('annotated_total_due'),
+        over_limit_count=Count('pk', filter=Q(annotated_credit_status=labels['over_limit'])),
+        near_limit_count=Count('pk', filter=Q(annotated_credit_status=labels['near_limit'])),
+    )
+    total_customers = summary['total_customers']
+    total_credit_limit = summary['total_credit_limit'] or 0
+    over_limit_count = summary['over_limit_count']
+    near_limit_count = summary['near_limit_count']
+    total_due = float(summary['total_due'] or 0)
     
     # Total sales, purchases, and outstanding amounts - handle errors gracefully
     try:
@@ -1212,20 +1146,9 @@ def credit_dashboard_view(request):
         total_purchases = PurchaseProduct.objects.aggregate(Sum('total'))['total__sum'] or 0
     except:
         total_purchases = 0
-        
-    # Calculate total due safely
-    total_due = 0
-    for customer in customers:
-        try:
-            total_due += float(customer.total_due)
-        except:
-            pass
     
     # Get top customers by outstanding amount
-    try:
-        top_customers = sorted(customers, key=lambda x: float(x.total_due if x.total_due else 0), reverse=True)[:10]
-    except:
-        top_customers = []
+    top_customers = customers.order_by('-annotated_total_due', 'name')[:10]
     
     context = {
         'total_customers': total_customers,
@@ -1250,25 +1173,17 @@ def credit_report_view(request):
         return redirect('admin:login')
         
     # Get all customers sorted by total due amount
-    customers = Customer.objects.all()
-    sorted_customers = sorted(customers, key=lambda x: x.total_due, reverse=True)
+    customers = Customer.objects.with_credit().order_by('-annotated_total_due', 'name')
     
     # Group customers by credit status
-    over_limit = []
-    near_limit = []
-    within_limit = []
-    no_limit = []
-    
-    for customer in sorted_customers:
-        status = customer.credit_status
-        if status == "Over Limit":
-            over_limit.append(customer)
-        elif status == "Near Limit":
-            near_limit.append(customer)
-        elif status == "Within Limit":
-            within_limit.append(customer)
-        else:
-            no_limit.append(customer)
+    labels = dict(CREDIT_STATUSES)
+    groups = {label: [] for label in labels.values()}
+    for customer in customers:
+        groups[customer.credit_status].append(customer)
+    over_limit = groups[labels['over_limit']]
+    near_limit = groups[labels['near_limit']]
+    within_limit = groups[labels['within_limit']]
+    no_limit = groups[labels['no_limit']]
     
     # Calculate statistics
     total_over_limit = sum(float(customer.total_due) for customer in over_limit)
@@ -1323,50 +1238,31 @@ class AdminSite(admin.AdminSite):
         prev_month_end = current_month_start - timedelta(days=1)
         prev_month_start = prev_month_end.replace(day=1)
         
-        # Get monthly data for past 6 months
-        months = []
-        monthly_sales = []
-        monthly_purchases = []
-        
-        for i in range(5, -1, -1):
-            month_date = today.replace(day=1) - timedelta(days=i*30)
-            month_name = month_date.strftime('%b')
-            months.append(month_name)
-            
-            # Monthly sales - use SalesProduct instead of SalesInvoice
-            month_sales = SalesProduct.objects.filter(
-                invoice__invoice_date__year=month_date.year, 
-                invoice__invoice_date__month=month_date.month
-            ).aggregate(total=Sum('total'))
-            
-            # Monthly purchases
-            month_purchases = PurchaseProduct.objects.filter(
-                invoice__date__year=month_date.year, 
-                invoice__date__month=month_date.month
-            ).aggregate(total=Sum('total'))
-            
-            monthly_sales.append(float(month_sales['total'] or 0))
-            monthly_purchases.append(float(month_purchases['total'] or 0))
-        
-        # Get sales data
-        current_month_sales = SalesProduct.objects.filter(
-            invoice__invoice_date__gte=current_month_start
-        ).aggregate(total=Sum('total'))
-        
-        prev_month_sales = SalesProduct.objects.filter(
-            invoice__invoice_date__gte=prev_month_start,
-            invoice__invoice_date__lt=current_month_start
-        ).aggregate(total=Sum('total'))
-        
-        # Get purchase data
-        current_month_purchases = PurchaseProduct.objects.filter(
-            invoice__date__gte=current_month_start
-        ).aggregate(total=Sum('total'))
-        
-        prev_month_purchases = PurchaseProduct.objects.filter(
-            invoice__date__gte=prev_month_start,
-            invoice__date__lt=current_month_start
-        ).aggregate(total=Sum('total'))
+        # Monthly sales and purchases for the past 6 months from the daily rollups
+        month_starts = [current_month_start]
+        for i in range(5):
+            month_starts.insert(0, (month_starts[0] - timedelta(days=1)).replace(day=1))
+        monthly_totals = {
+            row['month']: row
+            for row in DailyRollup.objects.filter(date__gte=month_starts[0])
+            .annotate(month=TruncMonth('date'))
+            .values('month')
+            .annotate(sales=Sum('revenue'), purchases=Sum('cost'))
+            .order_by()
+        }
+
+        def month_total(month_start, figure):
+            return {'total': (monthly_totals.get(month_start) or {}).get(figure)}
+
+        months = [month_start.strftime('%b') for month_start in month_starts]
+        monthly_sales = [float(month_total(month_start, 'sales')['total'] or 0) for month_start in month_starts]
+        monthly_purchases = [float(month_total(month_start, 'purchases')['total'] or 0) for month_start in month_starts]
+
+        # Get sales and purchase data
+        current_month_sales = month_total(current_month_start, 'sales')
+        prev_month_sales = month_total(prev_month_start, 'sales')
+        current_month_purchases = month_total(current_month_start, 'purchases')
+        prev_month_purchases = month_total(prev_month_start, 'purchases')
         
         # Calculate profit/loss
         total_sales = float(current_month_sales['total'] or 0)
@@ -1390,38 +1286,30 @@ class AdminSite(admin.AdminSite):
             profit_percent_change = ((profit_loss - prev_month_profit) / abs(prev_month_profit or 1)) * 100
         
         # Get customer data and credit status
-        customers = Customer.objects.all()
+        customers = Customer.objects.with_credit()
+        labels = dict(CREDIT_STATUSES)
+        credit = customers.aggregate(
+            total_due=Sum('annotated_total_due'),
+            **{
+                status: Count('pk', filter=Q(annotated_credit_status=label))
+                for status, label in CREDIT_STATUSES
+            }
+        )
         
         # Calculate total due
-        total_due = sum(float(customer.total_due) for customer in customers)
+        total_due = float(credit['total_due'] or 0)
         
         # Get credit status distribution
-        over_limit = 0
-        near_limit = 0
-        within_limit = 0
-        no_limit = 0
-        
-        for customer in customers:
-            status = customer.credit_status
-            if status == "Over Limit":
-                over_limit += 1
-            elif status == "Near Limit":
-                near_limit += 1
-            elif status == "Within Limit":
-                within_limit += 1
-            else:
-                no_limit += 1
-        
-        credit_status_data = [over_limit, near_limit, within_limit, no_limit]
+        credit_status_data = [credit[status] for status, _ in CREDIT_STATUSES]
         
         # Top customers by outstanding amount
-        top_customers = sorted(customers, key=lambda x: float(x.total_due), reverse=True)[:5]
+        top_customers = customers.order_by('-annotated_total_due', 'name')[:5]
         top_customer_names = [customer.name for customer in top_customers]
         top_customer_dues = [float(customer.total_due) for customer in top_customers]
         
         # Product sales distribution - get total sales by product
-        sales_products = SalesProduct.objects.values('product__name').annotate(
-            total_sales=Sum('total')
+        sales_products = DailyRollup.objects.filter(product__isnull=False).values('product__name').annotate(
+            total_sales=Sum('revenue')
         ).order_by('-total_sales')[:5]
         
         product_names = [item['product__name'] for item in sales_products]
@@ -1474,6 +1362,7 @@ admin.site.register(Expense, ExpenseAdmin)
 admin.site.register(Damages, DamagesAdmin)
 admin.site.register(SalesLot)
 admin.site.register(Packaging_Invoice, packagingsAdmin)
+admin.site.register(ImportJob, ImportJobAdmin)
 
 # Re-register auth models
 admin.site.register(User, UserAdmin)
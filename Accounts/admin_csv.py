@@ -5,13 +5,13 @@ from decimal import Decimal
 from django import forms
 from django.contrib import admin, messages
 from django.core.exceptions import ValidationError
-from django.db import transaction
-from django.http import HttpResponse
+from django.http import StreamingHttpResponse
 from django.shortcuts import render, redirect
 from django.utils import timezone
 from django.urls import path
 
-from .models import SalesInvoice, PurchaseInvoice, Customer, PurchaseVendor, SalesPayment, Payment
+from . import import_jobs, imports
+from .utils import user_tenant_id
 
 
 class CSVImportForm(forms.Form):
@@ -20,520 +20,138 @@ class CSVImportForm(forms.Form):
         label='CSV File',
         help_text='Please upload a CSV file with the required headers.'
     )
+    import_format_class = None
 
     def clean_csv_file(self):
         csv_file = self.cleaned_data['csv_file']
         if not csv_file.name.endswith('.csv'):
             raise ValidationError('File must be a CSV document')
+        if self.import_format_class is None:
+            return csv_file
+
+        # Only the header line is read here; the rows are streamed by the importer
+        try:
+            headers = imports.read_headers(csv_file)
+        except UnicodeDecodeError:
+            raise ValidationError('File must be UTF-8 encoded')
+        missing_headers = self.import_format_class(headers).missing_headers()
+        if missing_headers:
+            raise ValidationError(f"CSV is missing required headers: {', '.join(missing_headers)}")
         return csv_file
 
 
 class SalesInvoiceCSVImportForm(CSVImportForm):
     """Form for SalesInvoice CSV import with specific validations"""
-    
-    def clean_csv_file(self):
-        csv_file = super().clean_csv_file()
-        
-        # Read first line to check headers
-        csv_data = csv_file.read().decode('utf-8')
-        csv_file.seek(0)  # Reset file pointer
-        
-        reader = csv.reader(io.StringIO(csv_data))
-        headers = next(reader, None)
-        
-        required_headers = ['invoice_number', 'invoice_date', 'vendor_id']
-        missing_headers = [h for h in required_headers if h not in headers]
-        
-        if missing_headers:
-            raise ValidationError(f"CSV is missing required headers: {', '.join(missing_headers)}")
-            
-        return csv_file
+    import_format_class = imports.SalesInvoiceCSVFormat
 
 
 class PurchaseInvoiceCSVImportForm(CSVImportForm):
     """Form for PurchaseInvoice CSV import with specific validations"""
-    
-    def clean_csv_file(self):
-        csv_file = super().clean_csv_file()
-        
-        # Read first line to check headers
-        csv_data = csv_file.read().decode('utf-8')
-        csv_file.seek(0)  # Reset file pointer
-        
-        reader = csv.reader(io.StringIO(csv_data))
-        headers = next(reader, None)
-        
-        required_headers = ['invoice_number', 'lot_number', 'date', 'vendor_id']
-        missing_headers = [h for h in required_headers if h not in headers]
-        
-        if missing_headers:
-            raise ValidationError(f"CSV is missing required headers: {', '.join(missing_headers)}")
-            
-        return csv_file
+    import_format_class = imports.PurchaseInvoiceCSVFormat
 
 
-class SalesInvoiceCSVImporter:
-    """Handles importing SalesInvoice data from CSV"""
-    
-    @staticmethod
-    def get_field_mapping():
-        """Returns a mapping of CSV headers to model fields"""
-        return {
-            'id': 'id',
-            'invoice_number': 'invoice_number',
-            'invoice_date': 'invoice_date',
-            'vehicle_number': 'vehicle_number',
-            'gross_vehicle_weight': 'gross_vehicle_weight',
-            'reference': 'reference',
-            'no_of_crates': 'no_of_crates',
-            'cost_per_crate': 'cost_per_crate',
-            'purchased_crates_quantity': 'purchased_crates_quantity',
-            'purchased_crates_unit_price': 'purchased_crates_unit_price',
-            'vendor_id': 'vendor_id',
-        }
-    
-    @staticmethod
-    def process_row(row, headers):
-        """
-        Process a single row from the CSV
-        Returns a tuple: (data_dict, errors)
-        """
-        data = {}
-        errors = []
-        mapping = SalesInvoiceCSVImporter.get_field_mapping()
-        
-        # Process each field in the row
-        for i, value in enumerate(row):
-            if i >= len(headers):
-                break
-                
-            field_name = headers[i]
-            if field_name not in mapping:
-                continue  # Skip unmapped fields
-                
-            model_field = mapping[field_name]
-            
-            # Special handling for different field types
-            if field_name == 'invoice_number':
-                if not value.strip():
-                    errors.append("Invoice number cannot be empty")
-                data[model_field] = value.strip()
-                
-            elif field_name == 'invoice_date':
-                try:
-                    date_value = datetime.strptime(value, '%Y-%m-%d').date() if value else timezone.now().date()
-                    data[model_field] = date_value
-                except ValueError:
-                    errors.append(f"Invalid date format for {field_name}: {value}")
-                    
-            elif field_name == 'vendor_id':
-                try:
-                    vendor_id = int(value) if value else None
-                    if vendor_id:
-                        try:
-                            Customer.objects.get(pk=vendor_id)
-                            data[model_field] = vendor_id
-                        except Customer.DoesNotExist:
-                            errors.append(f"Customer with ID {vendor_id} does not exist")
-                    else:
-                        errors.append("Customer ID is required")
-                except ValueError:
-                    errors.append(f"Invalid customer ID: {value}")
-                    
-            elif field_name in ['gross_vehicle_weight', 'no_of_crates', 'cost_per_crate', 
-                              'purchased_crates_quantity', 'purchased_crates_unit_price']:
-                try:
-                    decimal_value = Decimal(value) if value else Decimal('0')
-                    data[model_field] = decimal_value
-                except:
-                    errors.append(f"Invalid number for {field_name}: {value}")
-            else:
-                # For text fields, just use the value as is
-                data[model_field] = value.strip() if value else None
-                
-        return data, errors
-    
-    @staticmethod
-    def import_data(csv_file):
+class CSVImporter:
+    """Imports invoices from an uploaded CSV with the pipeline in Accounts/imports.py"""
+    import_format_class = None
+
+    @classmethod
+    def import_data(cls, csv_file, tenant_id):
         """
-        Import data from a CSV file
+        Import data from a CSV file into a tenant (see utils.user_tenant_id)
         Returns a tuple: (success_count, error_count, error_messages)
         """
-        csv_data = csv_file.read().decode('utf-8')
-        reader = csv.reader(io.StringIO(csv_data))
-        headers = [h.lower() for h in next(reader)]
-        
-        success_count = 0
-        error_count = 0
-        error_messages = []
-        
-        for i, row in enumerate(reader, start=1):
-            if not any(cell.strip() for cell in row):
-                continue  # Skip empty rows
-                
-            # Process the row data and check for errors
-            data, row_errors = SalesInvoiceCSVImporter.process_row(row, headers)
-            
-            if row_errors:
-                error_count += 1
-                error_messages.append(f"Row {i}: {'; '.join(row_errors)}")
-                continue
-                
-            # Check if the invoice already exists
-            invoice_number = data.get('invoice_number')
-            existing = SalesInvoice.objects.filter(invoice_number=invoice_number).first()
-            
-            try:
-                with transaction.atomic():
-                    if existing:
-                        # Update existing invoice
-                        vendor_id = data.pop('vendor_id')
-                        for field, value in data.items():
-                            if field != 'invoice_number' and hasattr(existing, field):
-                                setattr(existing, field, value)
-                        
-                        existing.vendor = Customer.objects.get(pk=vendor_id)
-                        existing.save()
-                    else:
-                        # Create new invoice
-                        vendor_id = data.pop('vendor_id')
-                        vendor = Customer.objects.get(pk=vendor_id)
-                        
-                        # Remove 'id' if present as it's auto-generated
-                        if 'id' in data:
-                            data.pop('id')
-                            
-                        # Create the invoice
-                        SalesInvoice.objects.create(
-                            vendor=vendor,
-                            **data
-                        )
-                
-                success_count += 1
-            except Exception as e:
-                error_count += 1
-                error_messages.append(f"Row {i}: Error saving invoice - {str(e)}")
-                
-        return success_count, error_count, error_messages
-
-
-class PurchaseInvoiceCSVImporter:
+        reader = imports.read_rows(csv_file)
+        import_format = cls.import_format_class(next(reader, []))
+        return imports.run(import_format, reader, tenant_id).as_tuple()
+
+
+class SalesInvoiceCSVImporter(CSVImporter):
+    """Handles importing SalesInvoice data from CSV"""
+    import_format_class = imports.SalesInvoiceCSVFormat
+
+
+class PurchaseInvoiceCSVImporter(CSVImporter):
     """Handles importing PurchaseInvoice data from CSV"""
-    
+    import_format_class = imports.PurchaseInvoiceCSVFormat
+
+
+class CSVExporter:
+    """
+    Base class for exporting model data to CSV.
+
+    Rows are read with values_list() in chunks of ``chunk_size`` through
+    iterator() and written to a StreamingHttpResponse as they come, so an
+    export holds one chunk in memory and runs a fixed number of queries
+    however many rows it has.
+    """
+    chunk_size = 2000
+
     @staticmethod
-    def get_field_mapping():
-        """Returns a mapping of CSV headers to model fields"""
-        return {
-            'id': 'id',
-            'invoice_number': 'invoice_number',
-            'lot_number': 'lot_number',
-            'date': 'date',
-            'net_total': 'net_total',
-            'payment_issuer_name': 'payment_issuer_name',
-            'vendor_id': 'vendor_id',
-            'status': 'status',
-            'status_notes': 'status_notes',
-            'product_name': 'product_name',  # For product details
-            'quantity': 'quantity',          # For product details
-            'price': 'price',                # For product details
-            'damage': 'damage',              # For product details
-            'discount': 'discount',          # For product details
-            'rotten': 'rotten',              # For product details
-            'loading_unloading': 'loading_unloading', # For product details
-            'paid_amount': 'paid_amount',    # For payment details
-        }
-    
+    def format_value(value):
+        if value is None:
+            return ''
+        # Amounts are stored with two decimals; computed ones come back with more on some databases
+        if isinstance(value, Decimal):
+            return value.quantize(Decimal('0.01'))
+        # Format dates
+        if isinstance(value, datetime) or hasattr(value, 'strftime'):
+            return value.strftime('%Y-%m-%d')
+        return value
+
     @staticmethod
-    def process_row(row, headers):
+    def rows(queryset, lookups):
         """
-        Process a single row from the CSV
-        Returns a tuple: (data_dict, errors, product_data, payment_data)
+        Yield one list per object with the values of ``lookups`` (field names,
+        ``related__field`` paths or annotations); a None lookup gives ''.
         """
-        data = {}
-        errors = []
-        product_data = None
-        payment_data = None
-        mapping = PurchaseInvoiceCSVImporter.get_field_mapping()
-        
-        # Check if this is a product row (has product details)
-        has_product = any(h in headers for h in ['product_name', 'quantity', 'price'])
-        
-        # Process each field in the row
-        for i, value in enumerate(row):
-            if i >= len(headers):
-                break
-                
-            field_name = headers[i]
-            if field_name not in mapping:
-                continue  # Skip unmapped fields
-                
-            model_field = mapping[field_name]
-            
-            # Special handling for different field types
-            if field_name == 'invoice_number':
-                if not value.strip():
-                    errors.append("Invoice number cannot be empty")
-                data[model_field] = value.strip()
-                
-            elif field_name == 'lot_number':
-                if not value.strip():
-                    errors.append("Lot number cannot be empty")
-                data[model_field] = value.strip()
-                
-            elif field_name == 'date':
-                try:
-                    date_value = datetime.strptime(value, '%Y-%m-%d').date() if value else timezone.now().date()
-                    data[model_field] = date_value
-                except ValueError:
-                    errors.append(f"Invalid date format for {field_name}: {value}")
-                    
-            elif field_name == 'vendor_id':
-                try:
-                    vendor_id = int(value) if value else None
-                    if vendor_id:
-                        try:
-                            PurchaseVendor.objects.get(pk=vendor_id)
-                            data[model_field] = vendor_id
-                        except PurchaseVendor.DoesNotExist:
-                            # Create vendor if it doesn't exist
-                            payment_issuer_name = row[headers.index('payment_issuer_name')] if 'payment_issuer_name' in headers else f"Vendor {vendor_id}"
-                            PurchaseVendor.objects.create(
-                                id=vendor_id,
-                                name=payment_issuer_name,
-                                contact_number="",
-                                area=""
-                            )
-                            data[model_field] = vendor_id
-                    else:
-                        errors.append("Vendor ID is required")
-                except ValueError:
-                    errors.append(f"Invalid vendor ID: {value}")
-                    
-            elif field_name in ['net_total', 'price', 'quantity', 'damage', 'discount', 'rotten', 'loading_unloading', 'paid_amount']:
-                try:
-                    decimal_value = Decimal(value) if value and value.strip() else Decimal('0')
-                    if field_name == 'net_total':
-                        data[model_field] = decimal_value
-                    elif field_name == 'paid_amount':
-                        # Store payment data separately
-                        if decimal_value > 0:
-                            payment_data = {
-                                'amount': decimal_value,
-                                'date': data.get('date', timezone.now().date()),
-                                'payment_mode': 'cash'
-                            }
-                    elif has_product:
-                        # Store product data separately
-                        if product_data is None:
-                            product_data = {}
-                        product_data[field_name] = decimal_value
-                except:
-                    errors.append(f"Invalid number for {field_name}: {value}")
-            
-            elif field_name == 'product_name' and value.strip():
-                # Product row
-                if product_data is None:
-                    product_data = {}
-                product_data['product_name'] = value.strip()
-            else:
-                # For text fields, just use the value as is
-                data[model_field] = value.strip() if value else None
-                
-        return data, errors, product_data, payment_data
-    
+        present = [lookup for lookup in lookups if lookup]
+        # values_list() has no use for prefetched relations
+        values = queryset.prefetch_related(None).values_list(*present).iterator(chunk_size=CSVExporter.chunk_size)
+        for row in values:
+            row = iter(row)
+            yield [next(row) if lookup else '' for lookup in lookups]
+
     @staticmethod
-    def import_data(csv_file):
-        """
-        Import data from a CSV file
-        Returns a tuple: (success_count, error_count, error_messages)
-        """
-        from Accounts.models import Product, PurchaseProduct
-        
-        csv_data = csv_file.read().decode('utf-8')
-        reader = csv.reader(io.StringIO(csv_data))
-        headers = [h.lower() for h in next(reader)]
-        
-        success_count = 0
-        error_count = 0
-        error_messages = []
-        
-        # Track current invoice to handle multi-row product entries
-        current_invoice = None
-        
-        for i, row in enumerate(reader, start=1):
-            if not any(cell.strip() for cell in row):
-                continue  # Skip empty rows
-                
-            # Process the row data and check for errors
-            data, row_errors, product_data, payment_data = PurchaseInvoiceCSVImporter.process_row(row, headers)
-            
-            if row_errors:
-                error_count += 1
-                error_messages.append(f"Row {i}: {'; '.join(row_errors)}")
-                continue
-            
-            # Determine if this is a new invoice or a product row for existing invoice
-            if 'invoice_number' in data and data['invoice_number']:
-                # This is a new invoice row
-                invoice_number = data['invoice_number']
-                
-                try:
-                    with transaction.atomic():
-                        # Check if invoice exists
-                        existing = PurchaseInvoice.objects.filter(invoice_number=invoice_number).first()
-                        
-                        if existing:
-                            # Update existing invoice
-                            vendor_id = data.pop('vendor_id')
-                            for field, value in data.items():
-                                if field != 'invoice_number' and hasattr(existing, field):
-                                    setattr(existing, field, value)
-                            
-                            existing.vendor = PurchaseVendor.objects.get(pk=vendor_id)
-                            existing.save()
-                            current_invoice = existing
-                        else:
-                            # Create new invoice
-                            vendor_id = data.pop('vendor_id')
-                            vendor = PurchaseVendor.objects.get(pk=vendor_id)
-                            
-                            # Remove 'id' if present as it's auto-generated
-                            if 'id' in data:
-                                data.pop('id')
-                                
-                            # Create the invoice with manual invoice and lot numbers
-                            invoice = PurchaseInvoice(
-                                vendor=vendor,
-                                **data
-                            )
-                            invoice.save(update_fields=list(data.keys()) + ['vendor'])
-                            current_invoice = invoice
-                        
-                        # Add product if product data is present
-                        if product_data and 'product_name' in product_data and current_invoice:
-                            with transaction.atomic():
-                                # Find or create product
-                                product_name = product_data['product_name']
-                                product, _ = Product.objects.get_or_create(name=product_name)
-                                
-                                # Get the values with defaults
-                                quantity = product_data.get('quantity', Decimal('0'))
-                                price = product_data.get('price', Decimal('0'))
-                                damage = product_data.get('damage', Decimal('0'))
-                                discount = product_data.get('discount', Decimal('0'))
-                                rotten = product_data.get('rotten', Decimal('0'))
-                                loading_unloading = product_data.get('loading_unloading', Decimal('0'))
-                                
-                                # Create the product entry
-                                PurchaseProduct.objects.create(
-                                    invoice=current_invoice,
-                                    product=product,
-                                    quantity=quantity,
-                                    price=price,
-                                    damage=damage,
-                                    discount=discount,
-                                    rotten=rotten,
-                                    loading_unloading=loading_unloading,
-                                )
-                                
-                                # Refresh the invoice to update calculated fields
-                                current_invoice.refresh_from_db()
-                        
-                        # Add payment if payment data is present
-                        if payment_data and current_invoice:
-                            with transaction.atomic():
-                                Payment.objects.create(
-                                    invoice=current_invoice,
-                                    amount=payment_data['amount'],
-                                    date=payment_data['date'],
-                                    payment_mode=payment_data['payment_mode']
-                                )
-                        
-                        success_count += 1
-                except Exception as e:
-                    error_count += 1
-                    error_messages.append(f"Row {i}: Error saving invoice - {str(e)}")
-            
-            # If this is only a product row without invoice number
-            elif product_data and 'product_name' in product_data and current_invoice:
-                try:
-                    with transaction.atomic():
-                        # Find or create product
-                        product_name = product_data['product_name']
-                        product, _ = Product.objects.get_or_create(name=product_name)
-                        
-                        # Get the values with defaults
-                        quantity = product_data.get('quantity', Decimal('0'))
-                        price = product_data.get('price', Decimal('0'))
-                        damage = product_data.get('damage', Decimal('0'))
-                        discount = product_data.get('discount', Decimal('0'))
-                        rotten = product_data.get('rotten', Decimal('0'))
-                        loading_unloading = product_data.get('loading_unloading', Decimal('0'))
-                        
-                        # Create the product entry
-                        PurchaseProduct.objects.create(
-                            invoice=current_invoice,
-                            product=product,
-                            quantity=quantity,
-                            price=price,
-                            damage=damage,
-                            discount=discount,
-                            rotten=rotten,
-                            loading_unloading=loading_unloading,
-                        )
-                        
-                        # Refresh the invoice to update calculated fields
-                        current_invoice.refresh_from_db()
-                        
-                        success_count += 1
-                except Exception as e:
-                    error_count += 1
-                    error_messages.append(f"Row {i}: Error adding product - {str(e)}")
-                
-        return success_count, error_count, error_messages
+    def stream(headers, rows):
+        """Yield the CSV text of the header row and rows, a chunk of rows at a time"""
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        writer.writerow(headers)
+        for count, row in enumerate(rows, start=1):
+            writer.writerow([CSVExporter.format_value(value) for value in row])
+            if count % CSVExporter.chunk_size == 0:
+                yield buffer.getvalue()
+                buffer.seek(0)
+                buffer.truncate()
+        yield buffer.getvalue()
 
+    @staticmethod
+    def response(filename, headers, rows):
+        """StreamingHttpResponse sending the rows as a CSV attachment"""
+        response = StreamingHttpResponse(CSVExporter.stream(headers, rows), content_type='text/csv')
+        response['Content-Disposition'] = f'attachment; filename="{filename}"'
+        return response
 
-class CSVExporter:
-    """Base class for exporting model data to CSV"""
-    
     @staticmethod
     def export_queryset(queryset, field_names, header_names=None):
         """
         Export a queryset to CSV
-        Returns an HttpResponse with CSV content
+        Returns a StreamingHttpResponse with CSV content
         """
-        response = HttpResponse(content_type='text/csv')
         timestamp = timezone.now().strftime('%Y-%m-%d_%H-%M-%S')
-        
+
         # Use the model name for the filename
-        model_name = queryset.model._meta.model_name
-        response['Content-Disposition'] = f'attachment; filename="{model_name}_{timestamp}.csv"'
-        
-        writer = csv.writer(response)
-        
-        # Write header row
-        headers = header_names or field_names
-        writer.writerow(headers)
-        
-        # Write data rows
-        for obj in queryset:
-            row = []
-            for field in field_names:
-                if field == 'vendor_id' and hasattr(obj, 'vendor'):
-                    row.append(obj.vendor.id)
-                elif field == 'vendor':
-                    row.append(obj.vendor.name if obj.vendor else '')
-                elif hasattr(obj, field):
-                    value = getattr(obj, field)
-                    # Format dates
-                    if isinstance(value, datetime) or hasattr(value, 'strftime'):
-                        value = value.strftime('%Y-%m-%d')
-                    row.append(value)
-                else:
-                    row.append('')
-            writer.writerow(row)
-            
-        return response
+        opts = queryset.model._meta
+        filename = f"{opts.model_name}_{timestamp}.csv"
+
+        # 'vendor' exports the party's name; names that are not fields are left empty
+        columns = {field.name for field in opts.concrete_fields} | {field.attname for field in opts.concrete_fields}
+        columns |= set(queryset.query.annotations)
+        lookups = [
+            'vendor__name' if field == 'vendor' else field if field in columns else None
+            for field in field_names
+        ]
+        return CSVExporter.response(filename, header_names or field_names, CSVExporter.rows(queryset, lookups))
 
 
 class SalesInvoiceCSVExporter(CSVExporter):
@@ -567,12 +185,12 @@ class PurchaseInvoiceCSVExporter(CSVExporter):
         """Export a PurchaseInvoice queryset to CSV"""
         field_names = [
             'id', 'invoice_number', 'lot_number', 'date', 'net_total',
-            'payment_issuer_name', 'vendor_id', 'status', 'status_notes'
+            'payment_issuer_name', 'vendor_id', 'paid_amount', 'due_amount', 'payment_status'
         ]
         
         header_names = [
             'ID', 'Invoice Number', 'Lot Number', 'Date', 'Net Total',
-            'Payment Issuer Name', 'Vendor ID', 'Status', 'Status Notes'
+            'Payment Issuer Name', 'Vendor ID', 'Paid Amount', 'Due Amount', 'Payment Status'
         ]
         
         return CSVExporter.export_queryset(queryset, field_names, header_names)
@@ -609,27 +227,25 @@ class CSVImportExportMixin:
         """Override this method to control import permissions"""
         return request.user.is_staff
     
+    def queue_import(self, request, csv_file, format_name):
+        """Queue a background import of an upload and redirect to the job's progress page"""
+        tenant_id = user_tenant_id(request)
+        if tenant_id is None:
+            self.message_user(request, "Your user has no tenant to import into", messages.ERROR)
+            return redirect(f'admin:{self.model._meta.app_label}_{self.model._meta.model_name}_changelist')
+
+        # Imported a chunk at a time by the run_import_jobs command
+        job = import_jobs.enqueue(csv_file, format_name, tenant_id, request.user)
+        self.message_user(request, f"{job.file_name} is queued for import", messages.SUCCESS)
+        return redirect('admin:Accounts_importjob_change', job.pk)
+
     def import_csv(self, request):
         """View for importing CSV data"""
         if request.method == 'POST':
             form = self.csv_import_form_class(request.POST, request.FILES)
             if form.is_valid():
                 csv_file = request.FILES['csv_file']
-                
-                # Use the importer class to process the CSV data
-                success_count, error_count, error_messages = self.csv_importer_class.import_data(csv_file)
-                
-                # Show results
-                if success_count:
-                    self.message_user(request, f"Successfully imported {success_count} records", messages.SUCCESS)
-                if error_count:
-                    self.message_user(request, f"Failed to import {error_count} records", messages.ERROR)
-                    for msg in error_messages[:10]:  # Show first 10 errors
-                        self.message_user(request, msg, messages.ERROR)
-                    if len(error_messages) > 10:
-                        self.message_user(request, f"... and {len(error_messages) - 10} more errors", messages.ERROR)
-                
-                return redirect(f'admin:{self.model._meta.app_label}_{self.model._meta.model_name}_changelist')
+                return self.queue_import(request, csv_file, self.csv_importer_class.import_format_class.name)
         else:
             form = self.csv_import_form_class()
         
@@ -647,7 +263,7 @@ class CSVImportExportMixin:
     
     def export_as_csv(self, request, queryset):
         """Admin action to export selected records as CSV"""
-        if not queryset:
+        if not queryset.exists():
             self.message_user(request, "No records selected for export", level=messages.WARNING)
             return None
         
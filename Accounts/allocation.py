@@ -0,0 +1,107 @@
+"""
+Allocation of sold quantities to purchase lots.
+
+``allocate`` picks the lots of a product that still have quantity left in
+FIFO (oldest purchase first) or FEFO (earliest best-before first) order and
+records the usage as SalesLot rows. The chosen lots are locked with
+``select_for_update`` before their remaining quantity is re-read, so two
+counters selling from the same lot at the same time are served one after
+the other and a lot is never oversold.
+"""
+from decimal import Decimal
+
+from django.core.exceptions import ValidationError
+from django.db import transaction
+from django.db.models import Exists, F, OuterRef
+
+from . import dashboard, pdf_cache
+
+FIFO = 'fifo'
+FEFO = 'fefo'
+
+ORDERING = {
+    FIFO: ('date', 'pk'),
+    FEFO: (F('best_before').asc(nulls_last=True), 'date', 'pk'),
+}
+
+
+def _pk(value):
+    return getattr(value, 'pk', value)
+
+
+def available_lots(tenant, product, strategy=FIFO):
+    """Lots of the tenant containing the product with quantity left, in allocation order."""
+    from .models import PurchaseInvoice, PurchaseProduct
+
+    if strategy not in ORDERING:
+        raise ValueError(f"Unknown allocation strategy {strategy!r}")
+    has_product = PurchaseProduct.objects.filter(invoice=OuterRef('pk'), product_id=_pk(product))
+    return (
+        PurchaseInvoice.objects.filter(tenant_id=_pk(tenant))
+        .filter(Exists(has_product))
+        .with_financials()
+        .filter(annotated_available_quantity__gt=0)
+        .order_by(*ORDERING[strategy])
+    )
+
+
+def allocate(tenant, product, quantity, sales_invoice, strategy=FIFO):
+    """
+    Take ``quantity`` kg of ``product`` from the tenant's lots for a sales invoice.
+
+    Returns the SalesLot rows that were created or topped up. Raises
+    ValidationError, without writing anything, when the lots do not hold
+    enough quantity.
+    """
+    from .models import PurchaseInvoice, SalesLot
+
+    quantity = Decimal(quantity)
+    if quantity <= 0:
+        raise ValidationError("Quantity to allocate must be positive")
+    tenant_id = _pk(tenant)
+
+    with transaction.atomic():
+        # Lock the candidate lots, then read their remaining quantity again:
+        # anything allocated by a transaction we waited for is now visible.
+        lot_ids = list(available_lots(tenant_id, product, strategy).select_for_update().values_list('pk', flat=True))
+        remaining = dict(
+            PurchaseInvoice.objects.filter(pk__in=lot_ids)
+            .select_for_update()
+            .with_financials()
+            .values_list('pk', 'annotated_available_quantity')
+        )
+
+        plan = []
+        needed = quantity
+        for lot_id in lot_ids:
+            take = min(needed, Decimal(remaining.get(lot_id) or 0))
+            if take > 0:
+                plan.append((lot_id, take))
+                needed -= take
+            if not needed:
+                break
+        if needed:
+            raise ValidationError(f"Only {quantity - needed}kg available for this product")
+
+        existing = {
+            row.purchase_invoice_id: row
+            for row in SalesLot.objects.filter(
+                sales_invoice=sales_invoice, purchase_invoice_id__in=[lot_id for lot_id, _ in plan]
+            )
+        }
+        created, updated = [], []
+        for lot_id, take in plan:
+            row = existing.get(lot_id)
+            if row is not None:
+                row.quantity += take
+                updated.append(row)
+            else:
+                created.append(SalesLot(
+                    tenant_id=tenant_id, sales_invoice=sales_invoice, purchase_invoice_id=lot_id, quantity=take
+                ))
+        SalesLot.objects.bulk_update(updated, ['quantity'])
+        SalesLot.objects.bulk_create(created)
+        # Bulk writes send no save signals
+        dashboard.invalidate(tenant_id)
+        pdf_cache.invalidate(pdf_cache.SALES_INVOICE, _pk(sales_invoice))
+    return updated + created
@@ -0,0 +1,129 @@
+"""
+KPI snapshots for the dashboards.
+
+The figures are computed with database aggregates and cached per tenant.
+Every tenant has a version token in the cache which the save/delete
+signals in Accounts/signals.py replace with a new random one whenever one
+of the underlying rows changes. Snapshots are stored under the version
+they were computed for, so one new token makes all cached snapshots of
+the tenant stale at once. The token is set, not counted up with
+``cache.incr``: on FileBasedCache incr is a read and a separate write, so
+two concurrent bumps could write the same number, one of them changing
+nothing.
+
+The version only reaches every worker through a shared cache (see CACHES
+in settings.py); with a per-process cache, snapshots are kept for
+``LOCAL_SNAPSHOT_TIMEOUT`` only, as another worker's new token is never seen.
+Snapshots hold plain values, not model instances.
+"""
+from decimal import Decimal
+from uuid import uuid4
+
+from django.core.cache import cache, caches
+from django.core.cache.backends.locmem import LocMemCache
+from django.db import transaction
+from django.db.models import F, Sum, DecimalField
+
+from . import totals
+from .utils import tenant_cache_key
+
+SNAPSHOT_TIMEOUT = 60 * 60
+LOCAL_SNAPSHOT_TIMEOUT = 60
+TOP_DUES = 5
+RECENT_LOTS = 10
+
+MONEY = DecimalField(max_digits=14, decimal_places=2)
+
+
+def _version_key(tenant_id):
+    return tenant_cache_key('dashboard-version', tenant_id)
+
+
+def _fresh_version():
+    # Never used before, so no worker can hold a snapshot stored under it
+    return uuid4().hex
+
+
+def version(tenant_id):
+    return cache.get_or_set(_version_key(tenant_id), _fresh_version, None)
+
+
+def invalidate(tenant_id):
+    """Mark the tenant's snapshots, and the cross-tenant ones, stale once the transaction commits."""
+    def bump():
+        cache.set_many({key: _fresh_version() for key in {_version_key(tenant_id), _version_key(None)}}, None)
+    transaction.on_commit(bump)
+
+
+def _total(queryset, expression):
+    return queryset.aggregate(total=Sum(expression, output_field=MONEY))['total'] or Decimal('0')
+
+
+def _between(queryset, field, from_date, to_date):
+    if from_date:
+        queryset = queryset.filter(**{f'{field}__gte': from_date})
+    if to_date:
+        queryset = queryset.filter(**{f'{field}__lte': to_date})
+    return queryset
+
+
+def compute_snapshot(from_date=None, to_date=None):
+    """Dashboard figures of the current tenant from a handful of aggregate queries."""
+    from .models import Customer, Damages, Expense, Packaging_Invoice, PurchaseInvoice, PurchaseVendor, SalesInvoice
+
+    purchases = _between(PurchaseInvoice.objects.all(), 'date', from_date, to_date)
+    sales = _between(SalesInvoice.objects.all(), 'invoice_date', from_date, to_date).aggregate(
+        sales_net_total=Sum('net_total'),
+        sales_gross_weight=Sum('total_gross_weight'),
+        sales_final_total=Sum(F('net_total') + F('total_gross_weight') + totals.sales_extras_expression(), output_field=MONEY),
+    )
+
+    def top_dues(model):
+        parties = model.objects.filter(balance__total_due__gt=0).order_by('-balance__total_due')
+        return [{'name': name, 'due': due} for name, due in parties.values_list('name', 'balance__total_due')[:TOP_DUES]]
+
+    return {
+        'purchase_net_total': _total(purchases, 'net_total'),
+        'sales_net_total': sales['sales_net_total'] or Decimal('0'),
+        'sales_gross_weight': sales['sales_gross_weight'] or Decimal('0'),
+        'sales_final_total': sales['sales_final_total'] or Decimal('0'),
+        'total_expenses': _total(_between(Expense.objects.all(), 'date', from_date, to_date), 'amount'),
+        'total_damages': _total(_between(Damages.objects.all(), 'date', from_date, to_date), 'amount_loss'),
+        # Packaging_Invoice has no date, so it is never filtered
+        'total_packaging_cost': _total(Packaging_Invoice.objects.all(), F('no_of_crates') * F('cost_per_crate')),
+        'highest_due_customers': top_dues(Customer),
+        'highest_due_vendors': top_dues(PurchaseVendor),
+        'available_lots': _available_lots(),
+    }
+
+
+def _available_lots():
+    """The most recent lots with quantity left, with their product names."""
+    from .models import PurchaseInvoice, PurchaseProduct
+
+    lots = [
+        {'id': pk, 'lot_number': lot_number, 'available_quantity': available, 'net_total': net_total, 'products': []}
+        for pk, lot_number, available, net_total in PurchaseInvoice.objects.available().order_by('-date')
+        .values_list('pk', 'lot_number', 'annotated_available_quantity', 'net_total')[:RECENT_LOTS]
+    ]
+    by_id = {lot['id']: lot for lot in lots}
+    for invoice_id, name in PurchaseProduct.objects.filter(invoice_id__in=by_id).order_by('pk').values_list(
+        'invoice_id', 'product__name'
+    ):
+        by_id[invoice_id]['products'].append(name)
+    return lots
+
+
+def _timeout():
+    # Other processes never see a local cache's version bumps
+    return LOCAL_SNAPSHOT_TIMEOUT if isinstance(caches['default'], LocMemCache) else SNAPSHOT_TIMEOUT
+
+
+def snapshot(tenant_id, from_date=None, to_date=None):
+    """Cached compute_snapshot() for the tenant; recomputed after any underlying change."""
+    key = tenant_cache_key('dashboard', tenant_id, version(tenant_id), from_date, to_date)
+    data = cache.get(key)
+    if data is None:
+        data = compute_snapshot(from_date, to_date)
+        cache.set(key, data, _timeout())
+    return data
@@ -0,0 +1,202 @@
+"""
+CSV imports run in the background.
+
+An upload is stored with an ImportJob and imported by the run_import_jobs
+command through the chunked pipeline in Accounts/imports.py. Each chunk
+commits together with the job's row checkpoint and counts, so the admin
+shows the progress as it happens, and a job that was interrupted resumes
+after its last committed chunk instead of starting over. A running job
+whose heartbeat is older than ``STALE_AFTER`` is taken to be interrupted.
+When a job ends, the user who uploaded the file is notified.
+
+The heartbeat is also the worker's lease on the job: a claim sets it, and
+each checkpoint moves it on only if it is still the one this worker set.
+When a chunk outlasts ``STALE_AFTER`` and another worker claims the job
+meanwhile, the checkpoint fails and the chunk is rolled back, so its rows
+are imported once, by the worker that holds the job.
+"""
+import logging
+from datetime import timedelta
+
+from django.db import DatabaseError, transaction
+from django.db.models import Q
+from django.utils import timezone
+from django_multitenant.utils import get_current_tenant, set_current_tenant, unset_current_tenant
+
+from . import imports
+
+logger = logging.getLogger(__name__)
+
+STALE_AFTER = timedelta(minutes=10)
+
+
+class JobTakenOver(Exception):
+    """Another worker claimed the job while this one was importing a chunk."""
+
+
+def enqueue(uploaded_file, format_name, tenant_id, user=None):
+    """Store an upload and queue its import; returns the ImportJob."""
+    from .models import ImportJob
+
+    if format_name not in imports.FORMATS:
+        raise ValueError(f"Unknown import format {format_name!r}")
+    job = ImportJob(
+        tenant_id=tenant_id,
+        created_by=user if user is not None and user.is_authenticated else None,
+        file_name=uploaded_file.name,
+        format=format_name,
+    )
+    # Copied to storage chunk by chunk
+    job.file.save(uploaded_file.name, uploaded_file, save=False)
+    job.save()
+    return job
+
+
+def claim():
+    """Mark the oldest queued or interrupted job as running and return it, or None."""
+    from .models import ImportJob
+
+    now = timezone.now()
+    with transaction.atomic():
+        job = (
+            ImportJob._base_manager.select_for_update(skip_locked=True)
+            .filter(Q(status=ImportJob.QUEUED) | Q(status=ImportJob.RUNNING, heartbeat_at__lt=now - STALE_AFTER))
+            .order_by('pk')
+            .first()
+        )
+        if job is None:
+            return None
+        job.status = ImportJob.RUNNING
+        job.started_at = job.started_at or now
+        job.heartbeat_at = now
+        job.failure = ''
+        # No tenant is current yet, so the row is written without the tenant-aware save()
+        ImportJob._base_manager.filter(pk=job.pk).update(
+            status=job.status, started_at=job.started_at, heartbeat_at=job.heartbeat_at, failure=job.failure,
+        )
+    return job
+
+
+def _result(job):
+    result = imports.ImportResult()
+    result.success_count = job.success_count
+    result.error_count = job.error_count
+    result.error_messages = list(job.error_messages)
+    result.created = job.created_count
+    result.updated = job.updated_count
+    result.unchanged = job.unchanged_count
+    return result
+
+
+def process(job, chunk_size=imports.CHUNK_SIZE):
+    """
+    Import a claimed job from its checkpoint to the end of its file and
+    mark it done, or failed with the reason when an error stops it.
+    """
+    from .models import ImportJob
+
+    def checkpoint(rows_done, result):
+        heartbeat_at = timezone.now()
+        held = ImportJob._base_manager.filter(pk=job.pk, heartbeat_at=job.heartbeat_at).update(
+            rows_done=rows_done,
+            success_count=result.success_count,
+            error_count=result.error_count,
+            created_count=result.created,
+            updated_count=result.updated,
+            unchanged_count=result.unchanged,
+            error_messages=result.error_messages,
+            heartbeat_at=heartbeat_at,
+        )
+        # Raised inside the chunk's transaction, which rolls the chunk back
+        if not held:
+            raise JobTakenOver(f"Import job {job.pk} was claimed by another worker")
+        job.heartbeat_at = heartbeat_at
+
+    previous_tenant = get_current_tenant()
+    # The totals helpers read invoices through the tenant-filtered managers
+    set_current_tenant(job.tenant)
+    try:
+        with job.file.open('rb') as upload:
+            rows = imports.read_rows(upload)
+            import_format = imports.FORMATS[job.format](next(rows, []))
+            # Rows of the chunks committed before an interruption are not imported again
+            imports.run(
+                import_format, rows, job.tenant_id, chunk_size,
+                skip=job.rows_done, on_chunk=checkpoint, result=_result(job),
+            )
+    except JobTakenOver:
+        # The other worker imports the rest and ends the job
+        job.refresh_from_db()
+        logger.warning("Import job %s was claimed by another worker at row %s", job.pk, job.rows_done)
+    except Exception as error:
+        _finish(job, ImportJob.FAILED, str(error) or error.__class__.__name__)
+    else:
+        _finish(job, ImportJob.DONE)
+    finally:
+        if previous_tenant is None:
+            unset_current_tenant()
+        else:
+            set_current_tenant(previous_tenant)
+    return job
+
+
+def _finish(job, status, failure=''):
+    from .models import ImportJob
+
+    held = ImportJob._base_manager.filter(pk=job.pk, heartbeat_at=job.heartbeat_at).update(
+        status=status, failure=failure, finished_at=timezone.now(),
+    )
+    job.refresh_from_db()
+    if not held:
+        # Taken over; the worker that holds the job ends it
+        return
+    try:
+        notify(job)
+    except DatabaseError:
+        # The job's outcome is saved; a lost notification must not stop the worker
+        logger.exception("Could not notify the user of import job %s", job.pk)
+
+
+def notify(job):
+    """Tell the user who uploaded the file how its import ended."""
+    from asgiref.sync import async_to_sync
+    from channels.layers import get_channel_layer
+    from notifications.models import Notification
+
+    if job.created_by_id is None:
+        return
+    if job.status == job.FAILED:
+        level, title = 'error', 'Import failed'
+        message = f'{job.file_name} stopped after {job.rows_done} rows: {job.failure}'
+    else:
+        level = 'warning' if job.error_count else 'success'
+        title = 'Import finished'
+        message = (f'{job.file_name}: {job.success_count} rows imported, {job.unchanged_count} unchanged, '
+                   f'{job.error_count} rows with errors')
+    notification = Notification.objects.create(
+        tenant_id=job.tenant_id,
+        recipient_id=job.created_by_id,
+        notification_type='system',
+        level=level,
+        title=title,
+        message=message,
+        action_url=f'/admin/Accounts/importjob/{job.pk}/change/',
+    )
+
+    # Real-time delivery needs a configured channel layer
+    channel_layer = get_channel_layer()
+    if channel_layer is not None:
+        async_to_sync(channel_layer.group_send)(
+            f'user_{job.created_by_id}',
+            {
+                'type': 'notification_message',
+                'message': {
+                    'id': notification.id,
+                    'title': notification.title,
+                    'message': notification.message,
+                    'level': notification.level,
+                    'timestamp': notification.created_at.isoformat(),
+                    'url': notification.action_url,
+                },
+            },
+        )
@@ -0,0 +1,812 @@
+"""
+Bulk import of purchase and sales invoices from CSV rows.
+
+``run`` reads the rows in chunks of ``CHUNK_SIZE`` and takes each chunk
+through the same steps:
+
+1. parse: the import format turns every row into a ParsedRow without
+   touching the database, so chunks can be parsed by worker processes;
+2. preload: the parties, products and existing invoices the chunk names are
+   read with one query each;
+3. validate: rows naming an unknown party, a lot number taken by another
+   invoice or a value too long for its column are rejected;
+4. write: in one transaction, missing parties and products are created,
+   new invoices are inserted and existing ones updated, and the lines and
+   payments are inserted, all with bulk queries. The stored totals of each
+   touched invoice and the balances of their parties are then recomputed
+   once, and the dashboard, rollups and cached PDFs are invalidated.
+
+Rows of one invoice are grouped by invoice number; the last row's invoice
+fields win and each row's line and payment are added to the invoice. Bulk
+writes send no save signals, so imported rows raise no notifications.
+
+Every imported row is recorded (ImportedPurchaseRow, ImportedSalesRow) under
+its format, invoice and position among the invoice's rows in the file, with
+a fingerprint of its values and the line and payment it added. Importing the
+same file again is a no-op: the records of a chunk's invoices are read in
+one query before the preload, rows whose fingerprint matches are skipped and
+only new or changed rows are written. A changed row replaces the line and
+payment of its previous version instead of adding a second one. An invoice
+edited in the admin since its import is left alone as long as its rows do
+not change.
+
+Uploads are read with ``read_rows``, which decodes the file line by line
+as the rows are consumed, so memory stays bounded by the chunk size
+whatever the size of the file.
+"""
+import codecs
+import csv
+import hashlib
+import json
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from decimal import ROUND_HALF_UP, Decimal, InvalidOperation
+from itertools import islice
+
+from django.db import DatabaseError, connections, transaction
+from django.db.models import F, Max, Q
+from django.utils import timezone
+
+from . import dashboard, ledger, pdf_cache, pricing, rollups, sequences, totals
+
+PURCHASE = 'purchase'
+SALES = 'sales'
+
+CHUNK_SIZE = 1000
+# Error messages kept per import; error_count still counts every failed row
+MAX_ERROR_MESSAGES = 100
+
+LINE_FIELDS = ('quantity', 'price', 'damage', 'discount', 'rotten')
+
+# Excel saves UTF-8 CSVs with a byte order mark
+ENCODING = 'utf-8-sig'
+
+
+def _targets(kind):
+    from .models import (
+        Customer, Payment, PurchaseInvoice, PurchaseProduct, PurchaseVendor, SalesInvoice, SalesPayment,
+    )
+
+    if kind == SALES:
+        return SalesInvoice, Customer, SalesPayment, None, 'customer', 'invoice_date'
+    return PurchaseInvoice, PurchaseVendor, Payment, PurchaseProduct, 'vendor', 'date'
+
+
+def _row_model(kind):
+    from .models import ImportedPurchaseRow, ImportedSalesRow
+
+    return ImportedSalesRow if kind == SALES else ImportedPurchaseRow
+
+
+def read_headers(uploaded_file):
+    """Header row of an uploaded CSV, reading only its first line."""
+    uploaded_file.seek(0)
+    line = uploaded_file.readline()
+    uploaded_file.seek(0)
+    return next(csv.reader([line.decode(ENCODING)]), [])
+
+
+def read_rows(uploaded_file):
+    """csv.reader over an uploaded file, decoded line by line as rows are read."""
+    uploaded_file.seek(0)
+    return csv.reader(codecs.iterdecode(uploaded_file, ENCODING))
+
+
+class ParsedRow:
+    """The values one CSV row imports, or the errors that stop it."""
+
+    def __init__(self, number):
+        self.number = number
+        self.invoice_number = ''
+        self.fields = {}
+        # The party is found by id, or by name when there is no id
+        self.party_id = None
+        self.party_name = None
+        # {'product_name', 'quantity', 'price', 'damage', 'discount', 'rotten'}
+        self.line = None
+        # {'amount', 'date', 'payment_mode'}
+        self.payment = None
+        self.fingerprint = None
+        # Among the rows of its invoice in the file, from 1
+        self.position = None
+        # The record of the row's previous import, when its values changed since
+        self.replaces = None
+        self.errors = []
+
+
+class ImportFormat:
+    """
+    How the columns of one kind of file map onto invoices.
+
+    ``parse`` must not touch the database.
+    """
+    # Key of the format in FORMATS and ImportJob.format
+    name = None
+    kind = None
+    required_headers = ()
+    # Names of the columns by position, for files whose header row is ignored
+    columns = None
+    party_label = 'Vendor'
+    # Create the party a row names when it does not exist
+    create_parties = False
+
+    def __init__(self, headers):
+        self.headers = [header.strip().lower() for header in headers]
+
+    def missing_headers(self):
+        return [header for header in self.required_headers if header not in self.headers]
+
+    def values(self, row):
+        return dict(zip(self.columns or self.headers, row))
+
+    def parse(self, number, row):
+        raise NotImplementedError
+
+    def fingerprint(self, row):
+        """Hash of the values of a row, whatever the order or padding of its columns."""
+        values = sorted((column, value.strip()) for column, value in self.values(row).items() if value.strip())
+        payload = json.dumps([self.kind, values], separators=(',', ':'))
+        return hashlib.sha256(payload.encode()).hexdigest()
+
+
+def parse_text(value):
+    return value.strip() if value else None
+
+
+def parse_required(parsed, value, message):
+    value = (value or '').strip()
+    if not value:
+        parsed.errors.append(message)
+    return value
+
+
+def parse_date(parsed, field, value):
+    try:
+        return datetime.strptime(value, '%Y-%m-%d').date() if value else timezone.now().date()
+    except ValueError:
+        parsed.errors.append(f"Invalid date format for {field}: {value}")
+
+
+def parse_decimal(parsed, field, value):
+    try:
+        return Decimal(value) if value and value.strip() else Decimal('0')
+    except InvalidOperation:
+        parsed.errors.append(f"Invalid number for {field}: {value}")
+
+
+def parse_payment(parsed, value, day):
+    """The payment of a paid amount column, or None when nothing was paid."""
+    paid = parse_decimal(parsed, 'paid_amount', value)
+    if paid and paid > 0:
+        return {'amount': paid, 'date': day, 'payment_mode': 'cash'}
+    return None
+
+
+def parse_party_id(parsed, value, label):
+    try:
+        party_id = int(value) if value else None
+    except ValueError:
+        parsed.errors.append(f"Invalid {label.lower()} ID: {value}")
+        return None
+    if not party_id:
+        parsed.errors.append(f"{label} ID is required")
+    return party_id
+
+
+class SalesInvoiceCSVFormat(ImportFormat):
+    """The sales invoice CSV of the admin: one row per invoice."""
+    name = 'sales_csv'
+    kind = SALES
+    required_headers = ('invoice_number', 'invoice_date', 'vendor_id')
+    party_label = 'Customer'
+    decimal_fields = ('gross_vehicle_weight', 'no_of_crates', 'cost_per_crate',
+                      'purchased_crates_quantity', 'purchased_crates_unit_price')
+    text_fields = ('vehicle_number', 'reference')
+
+    def parse(self, number, row):
+        values = self.values(row)
+        parsed = ParsedRow(number)
+        parsed.invoice_number = parse_required(parsed, values.get('invoice_number'), "Invoice number cannot be empty")
+        if 'invoice_date' in values:
+            parsed.fields['invoice_date'] = parse_date(parsed, 'invoice_date', values['invoice_date'])
+        parsed.party_id = parse_party_id(parsed, values.get('vendor_id'), self.party_label)
+        for field in self.decimal_fields:
+            if field in values:
+                parsed.fields[field] = parse_decimal(parsed, field, values[field])
+        for field in self.text_fields:
+            if field in values:
+                parsed.fields[field] = parse_text(values[field])
+        return parsed
+
+
+class PurchaseInvoiceCSVFormat(ImportFormat):
+    """
+    The purchase invoice CSV of the admin: an invoice's rows share its
+    number and each may carry one line and one cash payment.
+    """
+    name = 'purchase_csv'
+    kind = PURCHASE
+    required_headers = ('invoice_number', 'lot_number', 'date', 'vendor_id')
+    create_parties = True
+
+    def parse(self, number, row):
+        values = self.values(row)
+        parsed = ParsedRow(number)
+        parsed.invoice_number = parse_required(parsed, values.get('invoice_number'), "Invoice number cannot be empty")
+        if 'lot_number' in values:
+            parsed.fields['lot_number'] = parse_required(parsed, values['lot_number'], "Lot number cannot be empty")
+        if 'date' in values:
+            parsed.fields['date'] = parse_date(parsed, 'date', values['date'])
+        if 'payment_issuer_name' in values:
+            parsed.fields['payment_issuer_name'] = parse_text(values['payment_issuer_name'])
+        parsed.party_id = parse_party_id(parsed, values.get('vendor_id'), self.party_label)
+        # Name of the vendor created for an unknown id
+        parsed.party_name = parse_text(values.get('payment_issuer_name')) or f"Vendor {parsed.party_id}"
+
+        # net_total is validated only: the stored totals are recomputed from the lines
+        if 'net_total' in values:
+            parse_decimal(parsed, 'net_total', values['net_total'])
+        product_name = parse_text(values.get('product_name'))
+        line = {field: parse_decimal(parsed, field, values[field]) for field in LINE_FIELDS if field in values}
+        # loading_unloading is priced from the line like every other line
+        if 'loading_unloading' in values:
+            parse_decimal(parsed, 'loading_unloading', values['loading_unloading'])
+        if product_name:
+            parsed.line = dict(line, product_name=product_name)
+        if 'paid_amount' in values:
+            parsed.payment = parse_payment(
+                parsed, values['paid_amount'], parsed.fields.get('date') or timezone.now().date()
+            )
+        return parsed
+
+
+class NamedPartyFormat(ImportFormat):
+    """
+    A file naming each invoice's party instead of giving its id: one row
+    per invoice and the party found or created by name. The stored totals
+    are recomputed from the lines, except that a purchase invoice without
+    lines keeps the file's net_total; the other total columns are ignored.
+    """
+    create_parties = True
+    party_column = None
+    date_field = None
+    text_fields = ()
+    decimal_fields = ()
+    # Columns every row needs
+    minimum_columns = 0
+
+    def parse(self, number, row):
+        parsed = ParsedRow(number)
+        if len(row) < self.minimum_columns:
+            parsed.errors.append("Row has insufficient data")
+            return parsed
+        values = self.values(row)
+        parsed.invoice_number = parse_required(parsed, values.get('invoice_number'), "Invoice number cannot be empty")
+        parsed.party_name = parse_required(
+            parsed, values.get(self.party_column), f"{self.party_label} name cannot be empty"
+        )
+        parsed.fields[self.date_field] = parse_date(parsed, self.date_field, (values.get(self.date_field) or '').strip())
+        net_total = parse_decimal(parsed, 'net_total', values.get('net_total'))
+        if self.kind == PURCHASE:
+            parsed.fields['net_total'] = net_total
+        lot_number = parse_text(values.get('lot_number'))
+        # New invoices without a lot number get the next one
+        if lot_number:
+            parsed.fields['lot_number'] = lot_number
+        for field in self.text_fields:
+            if field in values:
+                parsed.fields[field] = parse_text(values[field])
+        for field in self.decimal_fields:
+            if field in values:
+                parsed.fields[field] = parse_decimal(parsed, field, values[field])
+        # Payments are dated the day of the import
+        parsed.payment = parse_payment(parsed, values.get('paid_amount'), timezone.now().date())
+        return parsed
+
+
+class PurchaseInvoiceExportFormat(NamedPartyFormat):
+    """The admin's "Export selected invoices as CSV" layout, read by position"""
+    name = 'purchase_export'
+    kind = PURCHASE
+    columns = ('invoice_number', 'lot_number', 'vendor_name', 'date', 'net_total', 'paid_amount', 'due_amount')
+    minimum_columns = 5
+    party_column = 'vendor_name'
+    date_field = 'date'
+
+
+class SalesInvoiceExportFormat(NamedPartyFormat):
+    """The admin's "Export selected invoices as CSV" layout, read by position"""
+    name = 'sales_export'
+    kind = SALES
+    columns = ('invoice_number', 'customer_name', 'invoice_date', 'net_total', 'packaging_total',
+               'purchased_crates_total', 'net_total_after_packaging', 'paid_amount', 'due_amount')
+    minimum_columns = 5
+    party_label = 'Customer'
+    party_column = 'customer_name'
+    date_field = 'invoice_date'
+
+
+class PurchaseInvoiceNamedCSVFormat(NamedPartyFormat):
+    """The purchase CSV of the import_purchase_csv command, with vendors by name"""
+    name = 'purchase_named_csv'
+    kind = PURCHASE
+    required_headers = ('invoice_number', 'lot_number', 'vendor_name', 'date', 'net_total')
+    party_column = 'vendor_name'
+    date_field = 'date'
+
+
+class SalesInvoiceNamedCSVFormat(NamedPartyFormat):
+    """The sales CSV of the import_sales_csv command, with customers by name"""
+    name = 'sales_named_csv'
+    kind = SALES
+    required_headers = ('invoice_number', 'customer_name', 'invoice_date', 'net_total')
+    party_label = 'Customer'
+    party_column = 'customer_name'
+    date_field = 'invoice_date'
+    text_fields = ('vehicle_number', 'reference')
+    decimal_fields = ('gross_vehicle_weight',)
+
+
+# Formats an ImportJob can use
+FORMATS = {
+    import_format.name: import_format
+    for import_format in (PurchaseInvoiceCSVFormat, SalesInvoiceCSVFormat,
+                          PurchaseInvoiceExportFormat, SalesInvoiceExportFormat)
+}
+
+
+class ImportResult:
+    """Counts and error messages of an import."""
+
+    def __init__(self, max_messages=MAX_ERROR_MESSAGES):
+        self.success_count = 0
+        self.error_count = 0
+        self.error_messages = []
+        self.max_messages = max_messages
+        self.created = 0
+        self.updated = 0
+        # Rows an earlier import already imported as they are
+        self.unchanged = 0
+
+    def add_error(self, number, message):
+        self.error_count += 1
+        if len(self.error_messages) < self.max_messages:
+            self.error_messages.append(f"Row {number}: {message}")
+
+    def as_tuple(self):
+        return self.success_count, self.error_count, self.error_messages
+
+
+def _read_chunks(rows, chunk_size):
+    """Lists of up to ``chunk_size`` rows, each with the read error that ended the file there, if any."""
+    rows = iter(rows)
+    while True:
+        chunk = []
+        try:
+            chunk.extend(islice(rows, chunk_size))
+        except (UnicodeDecodeError, csv.Error) as error:
+            # The rows read before the unreadable one are still imported
+            yield chunk, f"Could not read the file - {error}"
+            return
+        if not chunk:
+            return
+        yield chunk, None
+
+
+def _parse_chunk(import_format, first_number, rows):
+    """ParsedRows of a chunk; runs in a worker process when parsing in parallel."""
+    parsed_rows = []
+    for offset, row in enumerate(rows):
+        if any(cell.strip() for cell in row):
+            parsed = import_format.parse(first_number + offset, row)
+            parsed.fingerprint = import_format.fingerprint(row)
+            parsed_rows.append(parsed)
+    return parsed_rows
+
+
+def _init_worker():
+    import django
+    from django.apps import apps
+
+    # Spawned workers start without Django
+    if not apps.ready:
+        django.setup()
+
+
+def _parsed_chunks(import_format, rows, chunk_size, first_row, workers):
+    """Yield ``(ParsedRows, rows read, read error)`` per chunk, parsed by ``workers`` processes."""
+    number = first_row
+    if workers <= 1:
+        for chunk, failure in _read_chunks(rows, chunk_size):
+            yield _parse_chunk(import_format, number, chunk), len(chunk), failure
+            number += len(chunk)
+        return
+
+    # Forked workers must not share this process's database connections
+    connections.close_all()
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker) as pool:
+        pending = deque()
+        for chunk, failure in _read_chunks(rows, chunk_size):
+            pending.append((pool.submit(_parse_chunk, import_format, number, chunk), len(chunk), failure))
+            number += len(chunk)
+            # Only a few chunks are parsed ahead of the one being written
+            if len(pending) > workers * 2:
+                future, read, failure = pending.popleft()
+                yield future.result(), read, failure
+        while pending:
+            future, read, failure = pending.popleft()
+            yield future.result(), read, failure
+
+
+def _number_rows(parsed_rows, positions):
+    """Set each row's position among the rows of its invoice, counted in ``positions``."""
+    for row in parsed_rows:
+        if row.invoice_number:
+            positions[row.invoice_number] = row.position = positions.get(row.invoice_number, 0) + 1
+
+
+def run(import_format, rows, tenant_id, chunk_size=CHUNK_SIZE, first_row=1, on_chunk=None, result=None,
+        workers=1, dry_run=False, skip=0):
+    """
+    Import the data rows of a file, header excluded, into a tenant and
+    return an ImportResult.
+
+    Rows are numbered from ``first_row`` in the error messages. Each chunk
+    is written in its own transaction, in which ``on_chunk(last row number,
+    result)`` is also called, so a checkpoint saved there is committed with
+    the chunk. Counts are added to ``result`` when one is given. With
+    ``workers`` above one the rows are parsed by that many processes; with
+    ``dry_run`` they are parsed and validated but nothing is written.
+
+    The first ``skip`` rows, imported before a job was interrupted, are
+    only read to count the rows of their invoices.
+    """
+    # The lookups and writes are scoped by tenant; without one they would create tenant-less invoices
+    if tenant_id is None:
+        raise ValueError("An import needs a tenant")
+    result = result or ImportResult()
+    rows = iter(rows)
+    # One entry per invoice number of the file
+    positions = {}
+    _number_rows(_parse_chunk(import_format, first_row, islice(rows, skip)), positions)
+    number = first_row + skip - 1
+    for parsed, read, failure in _parsed_chunks(import_format, rows, chunk_size, number + 1, workers):
+        number += read
+        _number_rows(parsed, positions)
+        with transaction.atomic():
+            import_rows(import_format, parsed, tenant_id, result, dry_run)
+            if failure is not None:
+                result.add_error(number + 1, failure)
+            if on_chunk:
+                on_chunk(number, result)
+    return result
+
+
+def import_rows(import_format, parsed_rows, tenant_id, result, dry_run=False):
+    """Validate and write one chunk of ParsedRows, adding their outcome to ``result``."""
+    rows = []
+    for row in parsed_rows:
+        if row.errors:
+            result.add_error(row.number, '; '.join(row.errors))
+        else:
+            rows.append(row)
+    rows = _changed(import_format, rows, tenant_id, result)
+    if not rows:
+        return
+
+    lookups = _preload(import_format.kind, rows, tenant_id)
+    rows = [row for row in rows if _validate(import_format, lookups, row, result)]
+    if not rows:
+        return
+    if dry_run:
+        numbers = {row.invoice_number for row in rows}
+        result.success_count += len(rows)
+        result.created += len(numbers - lookups.invoices.keys())
+        result.updated += len(numbers & lookups.invoices.keys())
+        return
+    try:
+        with transaction.atomic(), totals.deferred():
+            created, updated = _write(import_format, rows, tenant_id, lookups)
+    except DatabaseError as error:
+        # The whole chunk was rolled back
+        for row in rows:
+            result.add_error(row.number, f"Error saving invoice - {error}")
+        return
+    result.success_count += len(rows)
+    result.created += created
+    result.updated += updated
+
+
+def _changed(import_format, rows, tenant_id, result):
+    """The rows that are new or changed since their last import, counting the others as unchanged."""
+    imported = {
+        (record.invoice_number, record.position): record
+        for record in _row_model(import_format.kind)._base_manager.filter(
+            tenant_id=tenant_id, format=import_format.name,
+            invoice__invoice_number__in={row.invoice_number for row in rows},
+        ).annotate(invoice_number=F('invoice__invoice_number'))
+    }
+    changed = []
+    for row in rows:
+        record = imported.get((row.invoice_number, row.position))
+        if record is not None and record.fingerprint == row.fingerprint:
+            result.unchanged += 1
+        else:
+            row.replaces = record
+            changed.append(row)
+    return changed
+
+
+class _Lookups:
+    """What a chunk's rows refer to, read in one query per map."""
+
+    def __init__(self):
+        self.party_ids = set()
+        self.parties_by_name = {}
+        self.invoices = {}
+        self.lots = {}
+        self.products = {}
+        # Parties to create, by id (for ids named in the file) and by name
+        self.new_party_ids = {}
+        self.new_party_names = set()
+        # Purchase invoices: [net total, paid amount] as the chunk's accepted rows leave them
+        self.purchase_figures = {}
+        # Numbers of the purchase invoices that have or get lines, whose net total is their lines'
+        self.lined_invoices = set()
+        # Totals and amounts of the lines and payments that changed rows replace
+        self.replaced_lines = {}
+        self.replaced_payments = {}
+
+
+def _preload(kind, rows, tenant_id):
+    invoice_model, party_model, payment_model, line_model, _, _ = _targets(kind)
+    lookups = _Lookups()
+
+    party_ids = {row.party_id for row in rows if row.party_id}
+    party_names = {row.party_name for row in rows if row.party_name}
+    for pk, name in party_model._base_manager.filter(tenant_id=tenant_id).filter(
+        Q(pk__in=party_ids) | Q(name__in=party_names)
+    ).values_list('pk', 'name'):
+        lookups.party_ids.add(pk)
+        lookups.parties_by_name[name] = pk
+
+    numbers = {row.invoice_number for row in rows}
+    lookups.invoices = {
+        invoice.invoice_number: invoice
+        for invoice in invoice_model._base_manager.filter(tenant_id=tenant_id, invoice_number__in=numbers)
+    }
+
+    if line_model is not None:
+        lots = {row.fields['lot_number'] for row in rows if row.fields.get('lot_number')}
+        lookups.lots = dict(
+            invoice_model._base_manager.filter(tenant_id=tenant_id, lot_number__in=lots)
+            .values_list('lot_number', 'invoice_number')
+        )
+        lookups.lined_invoices = set(
+            line_model.objects.filter(invoice__in=lookups.invoices.values())
+            .values_list('invoice__invoice_number', flat=True).distinct()
+        )
+        names = {row.line['product_name'] for row in rows if row.line}
+        lookups.products = dict(
+            line_model.product.field.related_model._base_manager.filter(tenant_id=tenant_id, name__in=names)
+            .values_list('name', 'pk')
+        )
+        replaced = [row.replaces for row in rows if row.replaces is not None]
+        line_ids = [record.line_id for record in replaced if record.line_id]
+        if line_ids:
+            lookups.replaced_lines = dict(line_model.objects.filter(pk__in=line_ids).values_list('pk', 'total'))
+        payment_ids = [record.payment_id for record in replaced if record.payment_id]
+        if payment_ids:
+            lookups.replaced_payments = dict(
+                payment_model.objects.filter(pk__in=payment_ids).values_list('pk', 'amount')
+            )
+    return lookups
+
+
+def _too_long(model, fields):
+    for field, value in fields.items():
+        max_length = getattr(model._meta.get_field(field), 'max_length', None)
+        if isinstance(value, str) and max_length and len(value) > max_length:
+            yield f"Ensure {field} has at most {max_length} characters"
+
+
+def _validate(import_format, lookups, row, result):
+    invoice_model, party_model, _, _, _, _ = _targets(import_format.kind)
+    label = import_format.party_label
+    errors = list(_too_long(invoice_model, dict(row.fields, invoice_number=row.invoice_number)))
+
+    if row.party_id:
+        if row.party_id not in lookups.party_ids and row.party_id not in lookups.new_party_ids:
+            if not import_format.create_parties:
+                errors.append(f"{label} with ID {row.party_id} does not exist")
+            elif row.party_name in lookups.parties_by_name or row.party_name in lookups.new_party_ids.values():
+                errors.append(f"{label} name {row.party_name} is already used by another {label.lower()}")
+            else:
+                lookups.new_party_ids[row.party_id] = row.party_name
+    elif row.party_name not in lookups.parties_by_name:
+        if import_format.create_parties:
+            errors.extend(_too_long(party_model, {'name': row.party_name}))
+            lookups.new_party_names.add(row.party_name)
+        else:
+            errors.append(f"{label} {row.party_name} does not exist")
+
+    lot_number = row.fields.get('lot_number')
+    if lot_number:
+        owner = lookups.lots.setdefault(lot_number, row.invoice_number)
+        if owner != row.invoice_number:
+            errors.append(f"Lot number {lot_number} is already used by invoice {owner}")
+
+    # Payment.clean's limit, which bulk_create does not call
+    if import_format.kind == PURCHASE and not errors:
+        net_total, paid = _purchase_figures(lookups, row)
+        after_cash_cutting = _after_cash_cutting(net_total)
+        if row.payment and after_cash_cutting > Decimal('0.01') and paid > after_cash_cutting:
+            errors.append(f"Total payment cannot exceed the net total after 2% cash cutting: ₹{after_cash_cutting}.")
+        else:
+            lookups.purchase_figures[row.invoice_number] = [net_total, paid]
+            if row.line:
+                lookups.lined_invoices.add(row.invoice_number)
+
+    if errors:
+        result.add_error(row.number, '; '.join(errors))
+        return False
+    return True
+
+
+def _after_cash_cutting(net_total):
+    return (net_total - net_total * totals.CASH_CUTTING_RATE).quantize(Decimal('0.01'), rounding=ROUND_HALF_UP)
+
+
+def _purchase_figures(lookups, row):
+    """The net total and paid amount of the row's purchase invoice once the row is written."""
+    if row.invoice_number not in lookups.purchase_figures:
+        invoice = lookups.invoices.get(row.invoice_number)
+        lookups.purchase_figures[row.invoice_number] = (
+            [invoice.net_total, invoice.paid_amount] if invoice is not None else [Decimal('0'), Decimal('0')]
+        )
+    net_total, paid = lookups.purchase_figures[row.invoice_number]
+    # Without lines the invoice keeps the file's net total
+    if row.fields.get('net_total') is not None and not row.line and row.invoice_number not in lookups.lined_invoices:
+        net_total = row.fields['net_total']
+    if row.replaces is not None:
+        net_total -= lookups.replaced_lines.get(row.replaces.line_id, 0)
+        paid -= lookups.replaced_payments.get(row.replaces.payment_id, 0)
+    if row.line:
+        _, line_totals = pricing.price_purchase_lines(
+            *([row.line.get(field, Decimal('0'))] for field in LINE_FIELDS), [row.line['product_name']]
+        )
+        net_total += line_totals[0].quantize(Decimal('0.01'), rounding=ROUND_HALF_UP)
+    if row.payment:
+        paid += row.payment['amount'].quantize(Decimal('0.01'), rounding=ROUND_HALF_UP)
+    return net_total, paid
+
+
+def _write(import_format, rows, tenant_id, lookups):
+    """Write a validated chunk; returns the numbers of created and updated invoices."""
+    kind = import_format.kind
+    row_model = _row_model(kind)
+    invoice_model, party_model, payment_model, line_model, party_kind, date_field = _targets(kind)
+
+    # Parties
+    defaults = {'contact_number': '', 'area': ''} if party_kind == 'vendor' else {}
+    new_parties = [party_model(pk=pk, tenant_id=tenant_id, name=name, **defaults)
+                   for pk, name in lookups.new_party_ids.items()]
+    new_parties += [party_model(tenant_id=tenant_id, name=name, **defaults) for name in lookups.new_party_names]
+    for party in party_model.objects.bulk_create(new_parties):
+        lookups.parties_by_name[party.name] = party.pk
+    for row in rows:
+        if not row.party_id:
+            row.party_id = lookups.parties_by_name[row.party_name]
+
+    # Invoices
+    groups = {}
+    for row in rows:
+        groups.setdefault(row.invoice_number, []).append(row)
+    created, updated, updated_fields = [], [], {'vendor'}
+    parties, days = set(), set()
+    for number, group in groups.items():
+        fields = {}
+        for row in group:
+            fields.update(row.fields)
+        party_id = group[-1].party_id
+        invoice = lookups.invoices.get(number)
+        if invoice is None:
+            invoice = invoice_model(tenant_id=tenant_id, invoice_number=number, vendor_id=party_id, **fields)
+            created.append(invoice)
+        else:
+            parties.add(invoice.vendor_id)
+            days.add(getattr(invoice, date_field))
+            for field, value in fields.items():
+                setattr(invoice, field, value)
+            invoice.vendor_id = party_id
+            updated_fields.update(fields)
+            updated.append(invoice)
+        parties.add(party_id)
+        days.add(getattr(invoice, date_field))
+    if kind == PURCHASE:
+        unnumbered = [invoice for invoice in created if not invoice.lot_number]
+        for invoice, lot_number in zip(unnumbered, sequences.reserve_numbers(sequences.LOT, tenant_id, len(unnumbered))):
+            invoice.lot_number = lot_number
+    ledger.lock_balances(party_kind, parties)
+    invoice_model.objects.bulk_create(created)
+    if updated:
+        invoice_model.objects.bulk_update(updated, sorted(updated_fields))
+    invoice_ids = {invoice.invoice_number: invoice.pk for invoice in created + updated}
+    lookups.invoices.update((invoice.invoice_number, invoice) for invoice in created)
+
+    # The lines and payments of the previous versions of changed rows are replaced
+    replaced = [row.replaces for row in rows if row.replaces is not None]
+    replaced_lines = [record.line_id for record in replaced if getattr(record, 'line_id', None)]
+    serials, reused_serials = {}, {}
+    if line_model is not None:
+        # Read before the replaced lines go, so a new line never takes a replaced line's serial
+        serials = dict(
+            line_model.objects.filter(invoice_id__in=[invoice.pk for invoice in updated])
+            .values('invoice_id').annotate(last=Max('serial_number')).values_list('invoice_id', 'last')
+        )
+        reused_serials = dict(line_model.objects.filter(pk__in=replaced_lines).values_list('pk', 'serial_number'))
+    if replaced:
+        row_model._base_manager.filter(pk__in=[record.pk for record in replaced]).delete()
+        # Their delete signals mark the rollup days they leave
+        if replaced_lines:
+            line_model.objects.filter(pk__in=replaced_lines).delete()
+        payment_model.objects.filter(pk__in=[record.payment_id for record in replaced if record.payment_id]).delete()
+
+    # Lines, numbered after the invoice's existing ones unless they take a replaced line's place
+    line_rows = [row for row in rows if row.line]
+    lines = {}
+    if line_model is not None and line_rows:
+        product_model = line_model.product.field.related_model
+        missing = {row.line['product_name'] for row in line_rows} - lookups.products.keys()
+        if missing:
+            product_model.objects.bulk_create(
+                [product_model(tenant_id=tenant_id, name=name) for name in sorted(missing)], ignore_conflicts=True
+            )
+            lookups.products.update(
+                product_model._base_manager.filter(tenant_id=tenant_id, name__in=missing).values_list('name', 'pk')
+            )
+        for row in line_rows:
+            invoice_id = invoice_ids[row.invoice_number]
+            serial = reused_serials.get(getattr(row.replaces, 'line_id', None))
+            if serial is None:
+                serials[invoice_id] = serial = serials.get(invoice_id, 0) + 1
+            values = {field: row.line.get(field, Decimal('0')) for field in LINE_FIELDS}
+            lines[row] = line_model(
+                invoice_id=invoice_id, product_id=lookups.products[row.line['product_name']],
+                serial_number=serial, **values,
+            )
+        pricing.price_purchase_products(list(lines.values()), [row.line['product_name'] for row in line_rows])
+        line_model.objects.bulk_create(lines.values(), batch_size=500)
+
+    # Payments
+    payments = {row: payment_model(invoice_id=invoice_ids[row.invoice_number], **row.payment)
+                for row in rows if row.payment}
+    payment_model.objects.bulk_create(payments.values(), batch_size=500)
+    days.update(payment.date for payment in payments.values())
+
+    records = []
+    for row in rows:
+        record = row_model(
+            tenant_id=tenant_id, format=import_format.name, invoice_id=invoice_ids[row.invoice_number],
+            position=row.position, fingerprint=row.fingerprint, payment=payments.get(row),
+        )
+        if line_model is not None:
+            record.line = lines.get(row)
+        records.append(record)
+    row_model.objects.bulk_create(records, batch_size=500)
+
+    touched = invoice_model.objects.filter(pk__in=invoice_ids.values())
+    if kind == SALES:
+        totals.recompute_sales_invoices(touched)
+    else:
+        totals.recompute_purchase_invoices(touched)
+    ledger.refresh_balances(party_kind, parties)
+    # Bulk writes send no save signals
+    dashboard.invalidate(tenant_id)
+    for day in days:
+        rollups.mark_day(tenant_id, day)
+    pdf_kind = pdf_cache.SALES_INVOICE if kind == SALES else pdf_cache.PURCHASE_INVOICE
+    for invoice in updated:
+        pdf_cache.invalidate(pdf_kind, invoice.pk)
+    return len(created), len(updated)
@@ -0,0 +1,116 @@
+"""
+Running balances per customer and per vendor.
+
+CustomerBalance and VendorBalance hold the sum of the stored ``due_amount``
+of a party's invoices. The invoice totals helpers lock the party's balance
+row before changing an invoice and refresh it afterwards in the same
+transaction, so concurrent changes for one party are applied one after the
+other and the balance always matches its invoices.
+"""
+from decimal import Decimal
+
+from django.db.models import OuterRef, Subquery, Sum, Value, DecimalField
+from django.db.models.functions import Coalesce
+
+MONEY = DecimalField(max_digits=14, decimal_places=2)
+
+
+def _due_sum(invoice_model, party_field, outer_field):
+    dues = (
+        invoice_model.objects.filter(**{party_field: OuterRef(outer_field)})
+        .order_by()
+        .values(party_field)
+        .annotate(total=Sum('due_amount'))
+        .values('total')
+    )
+    return Coalesce(Subquery(dues, output_field=MONEY), Value(Decimal('0.00'), output_field=MONEY))
+
+
+def _targets(kind):
+    from .models import Customer, CustomerBalance, PurchaseInvoice, PurchaseVendor, SalesInvoice, VendorBalance
+
+    if kind == 'customer':
+        return CustomerBalance, Customer, SalesInvoice, 'customer'
+    return VendorBalance, PurchaseVendor, PurchaseInvoice, 'vendor'
+
+
+def _create_balances(kind, party_ids):
+    """Create the missing balance rows of the parties; a row created concurrently is left as it is."""
+    balance_model, party_model, _, party_field = _targets(kind)
+    missing = party_model._base_manager.filter(pk__in=party_ids, balance__isnull=True).values_list('pk', 'tenant_id')
+    balance_model.objects.bulk_create(
+        [balance_model(**{f'{party_field}_id': pk}, tenant_id=tenant_id) for pk, tenant_id in missing],
+        ignore_conflicts=True,
+    )
+
+
+def lock_balance(kind, party_id):
+    """Lock a party's balance row, creating it first if needed, until the end of the current transaction."""
+    lock_balances(kind, [party_id])
+
+
+def lock_balances(kind, party_ids):
+    """
+    Lock the balance rows of several parties, in id order, until the end of
+    the current transaction. Missing rows are created first, so a party's
+    first change is serialized like any other.
+    """
+    balance_model, _, _, party_field = _targets(kind)
+    party_ids = sorted({party_id for party_id in party_ids if party_id})
+    if not party_ids:
+        return
+    rows = (
+        balance_model._base_manager.select_for_update()
+        .filter(**{f'{party_field}_id__in': party_ids})
+        .order_by(f'{party_field}_id')
+        .values_list('pk')
+    )
+    if len(rows) < len(party_ids):
+        _create_balances(kind, party_ids)
+        list(rows.all())
+
+
+def refresh_balance(kind, party_id, create=True):
+    """Set a party's balance to the sum of its invoices' due amounts."""
+    balance_model, party_model, invoice_model, party_field = _targets(kind)
+    if not party_id:
+        return
+    due = _due_sum(invoice_model, 'vendor', f'{party_field}_id')
+    updated = balance_model.objects.filter(**{f'{party_field}_id': party_id}).update(total_due=due)
+    if not updated and create:
+        tenant_id = party_model.objects.filter(pk=party_id).values_list('tenant_id', flat=True).first()
+        if tenant_id is None:
+            return
+        balance_model.objects.get_or_create(**{f'{party_field}_id': party_id}, defaults={'tenant_id': tenant_id})
+        balance_model.objects.filter(**{f'{party_field}_id': party_id}).update(total_due=due)
+
+
+def refresh_balances(kind, party_ids):
+    """Create the missing balance rows of several parties and refresh them with one UPDATE."""
+    balance_model, _, invoice_model, party_field = _targets(kind)
+    party_ids = {party_id for party_id in party_ids if party_id}
+    if not party_ids:
+        return
+    _create_balances(kind, party_ids)
+    balance_model._base_manager.filter(**{f'{party_field}_id__in': party_ids}).update(
+        total_due=_due_sum(invoice_model, 'vendor', f'{party_field}_id')
+    )
+
+
+def rebuild_balances(tenant_id=None):
+    """Create missing balance rows and recompute every balance; returns the number of rows."""
+    count = 0
+    for kind in ('customer', 'vendor'):
+        balance_model, party_model, invoice_model, party_field = _targets(kind)
+        parties = party_model.objects.filter(balance__isnull=True)
+        if tenant_id:
+            parties = parties.filter(tenant_id=tenant_id)
+        balance_model.objects.bulk_create(
+            [balance_model(**{party_field: party}, tenant_id=party.tenant_id) for party in parties.iterator()],
+            batch_size=500,
+        )
+        balances = balance_model.objects.all()
+        if tenant_id:
+            balances = balances.filter(tenant_id=tenant_id)
+        count += balances.update(total_due=_due_sum(invoice_model, 'vendor', f'{party_field}_id'))
+    return count
@@ -0,0 +1,89 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django_multitenant.utils import set_current_tenant, unset_current_tenant
+from tenants.models import Tenant
+from Accounts import imports
+
+
+class ImportCSVCommand(BaseCommand):
+    """Shared options and reporting of the CSV import commands (see Accounts/imports.py)"""
+    # Tried in order; the first whose required headers are all present is used
+    import_formats = ()
+
+    def add_arguments(self, parser):
+        parser.add_argument('csv_file', type=str, help='Path to the CSV file')
+        parser.add_argument('--tenant', type=int, help='Id of the tenant to import into; default: the only tenant')
+        parser.add_argument('--batch-size', type=int, default=imports.CHUNK_SIZE,
+                            help='Rows written per transaction')
+        parser.add_argument('--workers', type=int, default=1,
+                            help='Processes parsing and checking the rows while earlier batches are written')
+        parser.add_argument('--dry-run', action='store_true',
+                            help='Parse and validate every row without writing anything')
+
+    def get_tenant(self, tenant_id):
+        if tenant_id is not None:
+            tenant = Tenant.objects.filter(pk=tenant_id).first()
+            if tenant is None:
+                raise CommandError(f"Tenant {tenant_id} does not exist")
+            return tenant
+        tenants = list(Tenant.objects.all()[:2])
+        if len(tenants) != 1:
+            raise CommandError("Pass --tenant with the id of the tenant to import into")
+        return tenants[0]
+
+    def get_format(self, header):
+        for import_format_class in self.import_formats:
+            import_format = import_format_class(header)
+            if not import_format.missing_headers():
+                return import_format
+        missing = self.import_formats[-1](header).missing_headers()
+        raise CommandError(f"CSV file is missing required headers: {', '.join(missing)}")
+
+    def handle(self, *args, **options):
+        for name in ('batch_size', 'workers'):
+            if options[name] < 1:
+                raise CommandError(f"--{name.replace('_', '-')} must be at least 1")
+        tenant = self.get_tenant(options['tenant'])
+        csv_file_path = options['csv_file']
+        try:
+            csv_file = open(csv_file_path, 'rb')
+        except FileNotFoundError:
+            raise CommandError(f"CSV file not found: {csv_file_path}")
+
+        def progress(rows_read, result):
+            self.stdout.write(f"{rows_read} rows read: {result.success_count} imported, {result.error_count} errors")
+
+        started = time.monotonic()
+        # The totals helpers read invoices through the tenant-filtered managers
+        set_current_tenant(tenant)
+        try:
+            with csv_file:
+                rows = imports.read_rows(csv_file)
+                try:
+                    header = next(rows, None)
+                except UnicodeDecodeError:
+                    raise CommandError("CSV file must be UTF-8 encoded")
+                if not header:
+                    raise CommandError("CSV file is empty")
+                import_format = self.get_format(header)
+                result = imports.run(
+                    import_format, rows, tenant.pk, options['batch_size'],
+                    on_chunk=progress if options['verbosity'] > 1 else None,
+                    workers=options['workers'], dry_run=options['dry_run'],
+                )
+        finally:
+            unset_current_tenant()
+        elapsed = time.monotonic() - started
+
+        for message in result.error_messages:
+            self.stderr.write(message)
+        if result.error_count > len(result.error_messages):
+            self.stderr.write(f"... and {result.error_count - len(result.error_messages)} more errors")
+        rows = result.success_count + result.unchanged + result.error_count
+        verb = "would be imported" if options['dry_run'] else "imported"
+        self.stdout.write(self.style.SUCCESS(
+            f"Import completed: {result.success_count} rows {verb} successfully, {result.error_count} errors, "
+            f"{result.unchanged} unchanged ({result.created} invoices created, {result.updated} updated) "
+            f"in {elapsed:.1f}s, {rows / elapsed if elapsed else 0:.0f} rows/s"
+        ))
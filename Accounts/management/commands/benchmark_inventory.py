@@ -0,0 +1,66 @@
+import time
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
+from django_multitenant.utils import set_current_tenant
+from tenants.models import Tenant
+from Accounts.models import Product, PurchaseInvoice, PurchaseProduct, PurchaseVendor
+
+
+class Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = (
+        'Times the inventory stock queries for a growing number of products. '
+        'The sample data is created inside a transaction that is rolled back.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--tenant', type=int, required=True, help='Tenant id to create the sample data for')
+        parser.add_argument('--sizes', type=int, nargs='+', default=[10, 100, 1000], help='Product counts to measure')
+        parser.add_argument('--lots', type=int, default=5, help='Lots per product')
+
+    def handle(self, *args, **options):
+        tenant = Tenant.objects.filter(pk=options['tenant']).first()
+        if tenant is None:
+            raise CommandError(f"Tenant {options['tenant']} does not exist")
+        set_current_tenant(tenant)
+
+        self.stdout.write(f"{'products':>9} {'queries':>8} {'ms':>9}  drilldown queries")
+        for size in options['sizes']:
+            try:
+                with transaction.atomic():
+                    self.measure(tenant, size, options['lots'])
+                    raise Rollback
+            except Rollback:
+                pass
+
+    def measure(self, tenant, size, lots):
+        vendor = PurchaseVendor.objects.create(tenant=tenant, name='Benchmark vendor', contact_number='', area='')
+        invoices = PurchaseInvoice.objects.bulk_create([
+            PurchaseInvoice(tenant=tenant, vendor=vendor, invoice_number=f'BENCH-{n}', lot_number=f'B{n}')
+            for n in range(lots)
+        ])
+        products = Product.objects.bulk_create([
+            Product(tenant=tenant, name=f'Benchmark product {n}') for n in range(size)
+        ])
+        PurchaseProduct.objects.bulk_create(
+            [
+                PurchaseProduct(invoice=invoice, product=product, quantity=Decimal('100'), price=Decimal('50'))
+                for product in products
+                for invoice in invoices
+            ],
+            batch_size=1000,
+        )
+
+        started = time.perf_counter()
+        with CaptureQueriesContext(connection) as queries:
+            list(Product.objects.filter(pk__in=[product.pk for product in products]).in_stock())
+        elapsed = (time.perf_counter() - started) * 1000
+        with CaptureQueriesContext(connection) as drilldown:
+            list(products[0].lots().filter(stock_available__gt=0).select_related('vendor'))
+        self.stdout.write(f"{size:>9} {len(queries):>8} {elapsed:>9.1f}  {len(drilldown)}")
@@ -0,0 +1,85 @@
+import time
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django_multitenant.utils import set_current_tenant
+from tenants.models import Tenant
+from Accounts import views
+from Accounts.models import (
+    Customer, Product, PurchaseInvoice, PurchaseProduct, PurchaseVendor, SalesInvoice, SalesProduct,
+)
+
+
+class Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = (
+        'Times the rendering of invoice PDFs, without the PDF cache. '
+        'The sample invoices are created inside a transaction that is rolled back.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--tenant', type=int, required=True, help='Tenant id to create the sample data for')
+        parser.add_argument('--invoices', type=int, default=20, help='Invoices of each kind to render')
+        parser.add_argument('--lines', type=int, default=10, help='Product lines per invoice')
+
+    def handle(self, *args, **options):
+        tenant = Tenant.objects.filter(pk=options['tenant']).first()
+        if tenant is None:
+            raise CommandError(f"Tenant {options['tenant']} does not exist")
+        if options['invoices'] < 1:
+            raise CommandError("--invoices must be at least 1")
+        set_current_tenant(tenant)
+
+        self.stdout.write(f"{'kind':<9} {'first ms':>9} {'ms/invoice':>11} {'KB/invoice':>11}")
+        try:
+            with transaction.atomic():
+                purchases, sales = self.create_invoices(tenant, options['invoices'], options['lines'])
+                self.measure('purchase', views.render_invoice_pdf, purchases)
+                self.measure('sales', views.render_sales_invoice_pdf, sales)
+                raise Rollback
+        except Rollback:
+            pass
+
+    def create_invoices(self, tenant, count, lines):
+        vendor = PurchaseVendor.objects.create(tenant=tenant, name='Benchmark vendor', contact_number='', area='')
+        customer = Customer.objects.create(tenant=tenant, name='Benchmark customer')
+        products = Product.objects.bulk_create([
+            Product(tenant=tenant, name=f'Benchmark product {n}') for n in range(lines)
+        ])
+        purchases = PurchaseInvoice.objects.bulk_create([
+            PurchaseInvoice(tenant=tenant, vendor=vendor, invoice_number=f'BENCH-P{n}', lot_number=f'B{n}')
+            for n in range(count)
+        ])
+        PurchaseProduct.objects.bulk_create([
+            PurchaseProduct(invoice=invoice, product=product, quantity=Decimal('100'), price=Decimal('50'))
+            for invoice in purchases
+            for product in products
+        ])
+        sales = SalesInvoice.objects.bulk_create([
+            SalesInvoice(tenant=tenant, vendor=customer, invoice_number=f'BENCH-S{n}') for n in range(count)
+        ])
+        SalesProduct.objects.bulk_create([
+            SalesProduct(
+                invoice=invoice, product=product, serial_number=serial, gross_weight=Decimal('100'),
+                net_weight=Decimal('100'), price=Decimal('60'), total=Decimal('6000'),
+            )
+            for invoice in sales
+            for serial, product in enumerate(products, start=1)
+        ])
+        return purchases, sales
+
+    def measure(self, kind, render, invoices):
+        timings, size = [], 0
+        for invoice in invoices:
+            started = time.perf_counter()
+            size += len(render(invoice, False))
+            timings.append((time.perf_counter() - started) * 1000)
+        # The first PDF also loads the fonts' glyphs and decodes the logo
+        rest = timings[1:] or timings
+        self.stdout.write(
+            f"{kind:<9} {timings[0]:>9.1f} {sum(rest) / len(rest):>11.1f} {size / len(invoices) / 1024:>11.1f}"
+        )
@@ -0,0 +1,26 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.utils.dateparse import parse_date
+from Accounts import rollups
+
+
+class Command(BaseCommand):
+    help = 'Rebuilds the daily rollups from the invoices, payments, expenses and damages'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--since', help='First day to rebuild (YYYY-MM-DD); default: all history')
+        parser.add_argument('--until', help='Last day to rebuild (YYYY-MM-DD); default: no limit')
+        parser.add_argument('--tenant', type=int, help='Only rebuild rollups of this tenant id')
+
+    def handle(self, *args, **options):
+        days = {}
+        for name in ('since', 'until'):
+            value = options[name]
+            try:
+                days[name] = parse_date(value) if value else None
+            except ValueError:
+                days[name] = None
+            if value and days[name] is None:
+                raise CommandError(f"--{name} must be a date in YYYY-MM-DD format")
+
+        rows = rollups.rebuild(options['tenant'], since=days['since'], until=days['until'])
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt {rows} daily rollup rows"))
@@ -0,0 +1,38 @@
+from django.core.management.base import BaseCommand, CommandError
+from Accounts.models import PurchaseInvoice, SalesInvoice
+from Accounts import ledger, totals
+
+
+class Command(BaseCommand):
+    help = 'Backfills or repairs the stored invoice totals columns and the customer/vendor balances'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--model', choices=['purchase', 'sales', 'all'], default='all',
+            help='Which invoices to recompute (default: all)'
+        )
+        parser.add_argument('--tenant', type=int, help='Only recompute invoices of this tenant id')
+        parser.add_argument('--batch-size', type=int, default=500, help='Invoices written per batch')
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        if batch_size < 1:
+            raise CommandError("--batch-size must be at least 1")
+
+        jobs = []
+        if options['model'] in ('purchase', 'all'):
+            jobs.append(('purchase', PurchaseInvoice, totals.recompute_purchase_invoices))
+        if options['model'] in ('sales', 'all'):
+            jobs.append(('sales', SalesInvoice, totals.recompute_sales_invoices))
+
+        for label, model, recompute in jobs:
+            queryset = model.objects.all()
+            if options['tenant']:
+                queryset = queryset.filter(tenant_id=options['tenant'])
+            changed = recompute(queryset, batch_size=batch_size)
+            self.stdout.write(self.style.SUCCESS(
+                f"Recomputed {label} invoice totals: {changed} of {queryset.count()} invoices updated"
+            ))
+
+        balances = ledger.rebuild_balances(options['tenant'])
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt {balances} customer and vendor balances"))
@@ -0,0 +1,64 @@
+import shutil
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils.dateparse import parse_date
+from Accounts import pdf_batch
+from Accounts.models import PurchaseInvoice, SalesInvoice
+
+# kind: (invoice model, date field)
+INVOICES = {
+    'purchase': (PurchaseInvoice, 'date'),
+    'sales': (SalesInvoice, 'invoice_date'),
+}
+
+
+class Command(BaseCommand):
+    help = 'Renders the PDFs of many invoices into one ZIP archive or one merged PDF'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--kind', choices=sorted(INVOICES), default='sales', help='Invoices to render')
+        parser.add_argument('--since', help='First invoice day (YYYY-MM-DD); default: all history')
+        parser.add_argument('--until', help='Last invoice day (YYYY-MM-DD); default: no limit')
+        parser.add_argument('--tenant', type=int, help='Only render invoices of this tenant id')
+        parser.add_argument('--ids', type=int, nargs='+', help='Only render these invoice ids')
+        parser.add_argument('--format', choices=['zip', 'pdf'], default='zip', help='One ZIP of PDFs or one merged PDF')
+        parser.add_argument('--output', required=True, help='File to write')
+        parser.add_argument('--workers', type=int, default=pdf_batch.DEFAULT_WORKERS, help='Rendering processes')
+        parser.add_argument('--hide-payments', action='store_true', help='Leave the payments off the PDFs')
+
+    def handle(self, *args, **options):
+        days = {}
+        for name in ('since', 'until'):
+            value = options[name]
+            try:
+                days[name] = parse_date(value) if value else None
+            except ValueError:
+                days[name] = None
+            if value and days[name] is None:
+                raise CommandError(f"--{name} must be a date in YYYY-MM-DD format")
+
+        model, date_field = INVOICES[options['kind']]
+        invoices = model._base_manager.all()
+        if options['tenant'] is not None:
+            invoices = invoices.filter(tenant_id=options['tenant'])
+        if options['ids']:
+            invoices = invoices.filter(pk__in=options['ids'])
+        if days['since']:
+            invoices = invoices.filter(**{f'{date_field}__gte': days['since']})
+        if days['until']:
+            invoices = invoices.filter(**{f'{date_field}__lte': days['until']})
+        invoice_ids = list(invoices.order_by(date_field, 'pk').values_list('pk', flat=True))
+        if not invoice_ids:
+            raise CommandError("No invoices match")
+
+        rendered = pdf_batch.render(
+            options['kind'], invoice_ids, hide_payments=options['hide_payments'], workers=options['workers']
+        )
+        with open(options['output'], 'wb') as output:
+            if options['format'] == 'zip':
+                for chunk in pdf_batch.stream_zip(rendered):
+                    output.write(chunk)
+            else:
+                with pdf_batch.merged_pdf(rendered) as merged:
+                    shutil.copyfileobj(merged, output)
+        self.stdout.write(self.style.SUCCESS(f"Wrote {len(invoice_ids)} invoices to {options['output']}"))
@@ -0,0 +1,39 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from Accounts import import_jobs, imports
+
+
+class Command(BaseCommand):
+    help = 'Imports the queued CSV uploads, resuming interrupted ones from their last committed chunk'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true', help='Exit when no job is left instead of waiting for more')
+        parser.add_argument('--sleep', type=float, default=5, help='Seconds to wait between checks for new jobs')
+        parser.add_argument('--chunk-size', type=int, default=imports.CHUNK_SIZE,
+                            help='Rows imported and committed per transaction')
+
+    def handle(self, *args, **options):
+        if options['chunk_size'] < 1:
+            raise CommandError("--chunk-size must be at least 1")
+
+        while True:
+            job = import_jobs.claim()
+            if job is None:
+                if options['once']:
+                    return
+                time.sleep(options['sleep'])
+                continue
+
+            resumed = f" from row {job.rows_done + 1}" if job.rows_done else ""
+            self.stdout.write(f"Importing {job.file_name} (job {job.pk}){resumed}")
+            import_jobs.process(job, options['chunk_size'])
+            if job.status == job.RUNNING:
+                self.stderr.write(f"Job {job.pk} was taken over by another worker after {job.rows_done} rows")
+            elif job.status == job.FAILED:
+                self.stderr.write(f"Job {job.pk} failed after {job.rows_done} rows: {job.failure}")
+            else:
+                self.stdout.write(self.style.SUCCESS(
+                    f"Job {job.pk}: {job.success_count} rows imported, {job.unchanged_count} unchanged, "
+                    f"{job.error_count} rows with errors"
+                ))
@@ -0,0 +1,125 @@
+# Generated by Django 5.1.7 on 2026-10-18 07:01
+
+from decimal import Decimal
+
+from django.db import migrations, models
+from django.db.models import Case, CharField, DecimalField, Exists, F, OuterRef, Subquery, Sum, Value, When
+from django.db.models.functions import Coalesce, Round
+from django.db.models.lookups import Exact
+
+MONEY = DecimalField(max_digits=12, decimal_places=2)
+ZERO = Value(Decimal('0.00'), output_field=MONEY)
+
+
+def _sum(model, field):
+    rows = model.objects.filter(invoice=OuterRef('pk')).order_by().values('invoice')
+    return Coalesce(Subquery(rows.annotate(total=Sum(field)).values('total'), output_field=MONEY), ZERO)
+
+
+def _status(due, paid):
+    return Case(
+        When(Exact(due, ZERO), then=Value("Paid")),
+        When(Exact(paid, ZERO), then=Value("Unpaid")),
+        default=Value("Partial"),
+        output_field=CharField(),
+    )
+
+
+def backfill_invoice_totals(apps, schema_editor):
+    """
+    Fill the new columns of the existing invoices from their lines and
+    payments, as Accounts/totals.py keeps them; they start at zero ("Paid").
+    """
+    PurchaseInvoice = apps.get_model('Accounts', 'PurchaseInvoice')
+    PurchaseProduct = apps.get_model('Accounts', 'PurchaseProduct')
+    Payment = apps.get_model('Accounts', 'Payment')
+    SalesInvoice = apps.get_model('Accounts', 'SalesInvoice')
+    SalesProduct = apps.get_model('Accounts', 'SalesProduct')
+    SalesPayment = apps.get_model('Accounts', 'SalesPayment')
+
+    # An invoice without lines keeps its net total
+    net = Case(
+        When(Exists(PurchaseProduct.objects.filter(invoice=OuterRef('pk'))), then=_sum(PurchaseProduct, 'total')),
+        default=F('net_total'),
+        output_field=MONEY,
+    )
+    paid = _sum(Payment, 'amount')
+    after_cash_cutting = Round(net - net * Value(Decimal('0.02')), 2, output_field=MONEY)
+    due = Round(after_cash_cutting - paid, 2, output_field=MONEY)
+    PurchaseInvoice.objects.update(
+        net_total=net,
+        total_quantity=_sum(PurchaseProduct, 'quantity'),
+        paid_amount=paid,
+        due_amount=due,
+        payment_status=_status(due, paid),
+    )
+
+    net = _sum(SalesProduct, 'total')
+    gross_weight = _sum(SalesProduct, 'gross_weight')
+    paid = _sum(SalesPayment, 'amount')
+    packaging = Coalesce(F('no_of_crates') * F('cost_per_crate'), ZERO, output_field=MONEY)
+    crates = Coalesce(Round(F('purchased_crates_quantity') * F('purchased_crates_unit_price'), 2), ZERO, output_field=MONEY)
+    due = Round(net + gross_weight + packaging + crates - paid, 2, output_field=MONEY)
+    SalesInvoice.objects.update(
+        net_total=net,
+        total_gross_weight=gross_weight,
+        paid_amount=paid,
+        due_amount=due,
+        payment_status=_status(due, paid),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('Accounts', '0010_alter_purchaseinvoice_tenant_and_more'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='purchaseinvoice',
+            name='due_amount',
+            field=models.DecimalField(decimal_places=2, default=0, editable=False, max_digits=12),
+        ),
+        migrations.AddField(
+            model_name='purchaseinvoice',
+            name='paid_amount',
+            field=models.DecimalField(decimal_places=2, default=0, editable=False, max_digits=12),
+        ),
+        migrations.AddField(
+            model_name='purchaseinvoice',
+            name='payment_status',
+            field=models.CharField(choices=[('Paid', 'Paid'), ('Unpaid', 'Unpaid'), ('Partial', 'Partial')], default='Paid', editable=False, max_length=10),
+        ),
+        migrations.AddField(
+            model_name='purchaseinvoice',
+            name='total_quantity',
+            field=models.DecimalField(decimal_places=2, default=0, editable=False, max_digits=12),
+        ),
+        migrations.AddField(
+            model_name='salesinvoice',
+            name='due_amount',
+            field=models.DecimalField(decimal_places=2, default=0, editable=False, max_digits=12),
+        ),
+        migrations.AddField(
+            model_name='salesinvoice',
+            name='net_total',
+            field=models.DecimalField(decimal_places=2, default=0, editable=False, max_digits=12),
+        ),
+        migrations.AddField(
+            model_name='salesinvoice',
+            name='paid_amount',
+            field=models.DecimalField(decimal_places=2, default=0, editable=False, max_digits=12),
+        ),
+        migrations.AddField(
+            model_name='salesinvoice',
+            name='payment_status',
+            field=models.CharField(choices=[('Paid', 'Paid'), ('Unpaid', 'Unpaid'), ('Partial', 'Partial')], default='Paid', editable=False, max_length=10),
+        ),
+        migrations.AddField(
+            model_name='salesinvoice',
+            name='total_gross_weight',
+            field=models.DecimalField(decimal_places=2, default=0, editable=False, max_digits=12),
+        ),
+        migrations.RunPython(backfill_invoice_totals, migrations.RunPython.noop, elidable=True),
+    ]
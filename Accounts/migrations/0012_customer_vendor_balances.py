@@ -0,0 +1,65 @@
+# Generated by Django 5.1.7 on 2026-10-18 07:04
+
+from decimal import Decimal
+
+import django.db.models.deletion
+import django_multitenant.mixins
+from django.db import migrations, models
+from django.db.models import OuterRef, Subquery, Sum, Value
+from django.db.models.functions import Coalesce
+
+
+def build_balances(apps, schema_editor):
+    """One balance per customer and vendor, the sum of their invoices' stored due amounts."""
+    money = models.DecimalField(max_digits=14, decimal_places=2)
+    for balance_name, party_name, invoice_name, party_field in (
+        ('CustomerBalance', 'Customer', 'SalesInvoice', 'customer'),
+        ('VendorBalance', 'PurchaseVendor', 'PurchaseInvoice', 'vendor'),
+    ):
+        balance_model = apps.get_model('Accounts', balance_name)
+        party_model = apps.get_model('Accounts', party_name)
+        invoice_model = apps.get_model('Accounts', invoice_name)
+        dues = (
+            invoice_model.objects.filter(vendor=OuterRef('pk')).order_by().values('vendor')
+            .annotate(total=Sum('due_amount')).values('total')
+        )
+        parties = party_model.objects.annotate(
+            due=Coalesce(Subquery(dues, output_field=money), Value(Decimal('0.00'), output_field=money))
+        )
+        balance_model.objects.bulk_create(
+            [balance_model(**{f'{party_field}_id': pk}, tenant_id=tenant_id, total_due=due)
+             for pk, tenant_id, due in parties.values_list('pk', 'tenant_id', 'due').iterator()],
+            batch_size=500,
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('Accounts', '0011_invoice_totals_columns'),
+        ('tenants', '0003_tenant_address_tenant_city_tenant_contact_email_and_more'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CustomerBalance',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('total_due', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('customer', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='balance', to='Accounts.customer')),
+                ('tenant', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='tenants.tenant')),
+            ],
+            bases=(django_multitenant.mixins.TenantModelMixin, models.Model),
+        ),
+        migrations.CreateModel(
+            name='VendorBalance',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('total_due', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('tenant', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='tenants.tenant')),
+                ('vendor', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='balance', to='Accounts.purchasevendor')),
+            ],
+            bases=(django_multitenant.mixins.TenantModelMixin, models.Model),
+        ),
+        migrations.RunPython(build_balances, migrations.RunPython.noop, elidable=True),
+    ]
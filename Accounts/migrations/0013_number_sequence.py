@@ -0,0 +1,28 @@
+# Generated by Django 5.1.7 on 2026-10-18 07:05
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('Accounts', '0012_customer_vendor_balances'),
+        ('tenants', '0003_tenant_address_tenant_city_tenant_contact_email_and_more'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='NumberSequence',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('series', models.CharField(max_length=30)),
+                ('year', models.PositiveIntegerField(default=0, help_text='0 for series that never restart')),
+                ('last_value', models.PositiveIntegerField(default=0)),
+                ('tenant', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, to='tenants.tenant')),
+            ],
+            options={
+                'unique_together': {('tenant', 'series', 'year')},
+            },
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.1.7 on 2026-10-18 07:10
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('Accounts', '0013_number_sequence'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='purchaseinvoice',
+            name='best_before',
+            field=models.DateField(blank=True, help_text='Used to sell the earliest expiring lots first', null=True),
+        ),
+    ]
@@ -0,0 +1,39 @@
+# Generated by Django 5.1.7 on 2026-10-18 07:14
+
+import django.db.models.deletion
+import django_multitenant.mixins
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('Accounts', '0014_purchaseinvoice_best_before'),
+        ('tenants', '0003_tenant_address_tenant_city_tenant_contact_email_and_more'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DailyRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField()),
+                ('purchased_quantity', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('sold_quantity', models.DecimalField(decimal_places=2, default=0, help_text='Net weight sold', max_digits=14)),
+                ('gross_weight', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('revenue', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('cost', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('payments_received', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('payments_made', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('expenses', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('damages', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('product', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, to='Accounts.product')),
+                ('tenant', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, to='tenants.tenant')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['tenant', 'date'], name='Accounts_da_tenant__8c5624_idx')],
+                'unique_together': {('tenant', 'date', 'product')},
+            },
+            bases=(django_multitenant.mixins.TenantModelMixin, models.Model),
+        ),
+    ]
@@ -0,0 +1,46 @@
+# Generated by Django 5.1.7 on 2026-10-18 07:49
+
+import django.db.models.deletion
+import django_multitenant.mixins
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('Accounts', '0015_daily_rollup'),
+        ('tenants', '0003_tenant_address_tenant_city_tenant_contact_email_and_more'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ImportJob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('file', models.FileField(upload_to='imports/')),
+                ('file_name', models.CharField(max_length=255)),
+                ('format', models.CharField(choices=[('purchase_csv', 'Purchase invoices CSV'), ('sales_csv', 'Sales invoices CSV'), ('purchase_export', 'Purchase invoices export'), ('sales_export', 'Sales invoices export')], max_length=20)),
+                ('status', models.CharField(choices=[('queued', 'Queued'), ('running', 'Running'), ('done', 'Done'), ('failed', 'Failed')], default='queued', max_length=10)),
+                ('rows_done', models.PositiveIntegerField(default=0)),
+                ('success_count', models.PositiveIntegerField(default=0)),
+                ('error_count', models.PositiveIntegerField(default=0)),
+                ('created_count', models.PositiveIntegerField(default=0)),
+                ('updated_count', models.PositiveIntegerField(default=0)),
+                ('error_messages', models.JSONField(blank=True, default=list)),
+                ('failure', models.TextField(blank=True, help_text='Why the job stopped, when it failed')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('started_at', models.DateTimeField(blank=True, null=True)),
+                ('finished_at', models.DateTimeField(blank=True, null=True)),
+                ('heartbeat_at', models.DateTimeField(blank=True, null=True)),
+                ('created_by', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to=settings.AUTH_USER_MODEL)),
+                ('tenant', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='tenants.tenant')),
+            ],
+            options={
+                'ordering': ['-created_at'],
+                'indexes': [models.Index(fields=['status', 'heartbeat_at'], name='Accounts_im_status_3a3b57_idx')],
+            },
+            bases=(django_multitenant.mixins.TenantModelMixin, models.Model),
+        ),
+    ]
@@ -0,0 +1,54 @@
+# Generated by Django 5.1.7 on 2026-10-18 07:57
+
+import django.db.models.deletion
+import django_multitenant.mixins
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('Accounts', '0016_importjob'),
+        ('tenants', '0003_tenant_address_tenant_city_tenant_contact_email_and_more'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='importjob',
+            name='unchanged_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.CreateModel(
+            name='ImportedPurchaseRow',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('format', models.CharField(max_length=20)),
+                ('position', models.PositiveIntegerField()),
+                ('fingerprint', models.CharField(max_length=64)),
+                ('invoice', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='imported_rows', to='Accounts.purchaseinvoice')),
+                ('line', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='Accounts.purchaseproduct')),
+                ('payment', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='Accounts.payment')),
+                ('tenant', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='tenants.tenant')),
+            ],
+            options={
+                'unique_together': {('invoice', 'format', 'position')},
+            },
+            bases=(django_multitenant.mixins.TenantModelMixin, models.Model),
+        ),
+        migrations.CreateModel(
+            name='ImportedSalesRow',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('format', models.CharField(max_length=20)),
+                ('position', models.PositiveIntegerField()),
+                ('fingerprint', models.CharField(max_length=64)),
+                ('invoice', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='imported_rows', to='Accounts.salesinvoice')),
+                ('payment', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='Accounts.salespayment')),
+                ('tenant', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='tenants.tenant')),
+            ],
+            options={
+                'unique_together': {('invoice', 'format', 'position')},
+            },
+            bases=(django_multitenant.mixins.TenantModelMixin, models.Model),
+        ),
+    ]
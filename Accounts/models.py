@@ -1,12 +1,18 @@
-from django.db import models
+import logging
+from django.db import models, transaction
 from datetime import date
 from decimal import Decimal, ROUND_HALF_UP
 from django.core.exceptions import ValidationError
-from django.db.models import Sum
+from django.db.models import Sum, F, Q, Exists, ExpressionWrapper, OuterRef, Subquery, Value, Case, When, DecimalField, FloatField, CharField
+from django.db.models.functions import Cast, Coalesce, NullIf, Round
 from django.contrib.auth.models import User
 from django_multitenant.mixins import TenantModelMixin
 from django_multitenant.models import TenantManagerMixin
+from django_multitenant.utils import get_current_tenant
 from tenants.models import Tenant
+from . import dashboard, ledger, pricing, rollups, sequences, totals
+
+logger = logging.getLogger(__name__)
 
 # Create tenant manager
 class TenantManager(TenantManagerMixin, models.Manager):
@@ -27,6 +33,15 @@ class PurchaseVendor(TenantModelMixin, models.Model):
     def __str__(self):
         return self.name
 
+    @property
+    def total_due(self):
+        """Total outstanding amount owed to this vendor, read from the balance ledger"""
+        try:
+            return self.balance.total_due
+        except VendorBalance.DoesNotExist:
+            # Balance row not created yet (see the recompute_invoice_totals command)
+            return self.invoices.aggregate(total=Sum('due_amount'))['total'] or Decimal('0.00')
+
 
 class Payment(models.Model):
     PAYMENT_METHOD_CHOICES = [
@@ -74,14 +89,141 @@ class Payment(models.Model):
                 f"Total payment cannot exceed the net total after 2% cash cutting: ₹{net_total_after_cash_cutting}."
             )
                 
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        totals.remember(self)
+
     def save(self, *args, **kwargs):
         self.clean()
-        super().save(*args, **kwargs)
+        with transaction.atomic():
+            previous = totals.previous_values(self)
+            super().save(*args, **kwargs)
+            totals.apply_change(self, previous)
 
     def __str__(self):
         return f"Payment of ₹{self.amount} for Invoice {self.invoice.invoice_number}"
 
 
+def lot_sales():
+    """
+    SalesLot rows annotated with ``sold_product_id``, the product the sold
+    quantity counts against: the product of the sales invoice's first line,
+    which SalesLot.clean checks the lot for.
+    """
+    first_product = SalesProduct.objects.filter(invoice_id=OuterRef('sales_invoice_id')).order_by('pk')
+    return SalesLot.objects.annotate(sold_product_id=Subquery(first_product.values('product_id')[:1]))
+
+
+def stock_annotations(lines, line_key, sales, sale_key):
+    """
+    Stock annotations from correlated PurchaseProduct and lot_sales() rows.
+
+    ``lines`` and ``sales`` are filtered on OuterRef and summed per
+    ``line_key`` and ``sale_key``. Returns the keyword arguments for two
+    annotate() calls: stock_purchased, stock_purchase_value and stock_sold,
+    then stock_available, stock_average_cost (quantity-weighted purchase
+    price) and stock_value (available quantity at that price).
+    """
+    money = DecimalField(max_digits=14, decimal_places=2)
+    zero = Value(Decimal('0.00'), output_field=money)
+
+    def total(rows, key, expression):
+        rows = rows.order_by().values(key).annotate(total=Sum(expression, output_field=money))
+        return Coalesce(Subquery(rows.values('total'), output_field=money), zero)
+
+    # SQLite divides whole numbers as integers, so divide as floats and cast back
+    average_cost = Coalesce(
+        Cast(Cast('stock_purchase_value', FloatField()) / NullIf(F('stock_purchased'), zero), money), zero
+    )
+    return (
+        {
+            'stock_purchased': total(lines, line_key, 'quantity'),
+            'stock_purchase_value': total(lines, line_key, F('quantity') * F('price')),
+            'stock_sold': total(sales, sale_key, 'quantity'),
+        },
+        {
+            'stock_available': ExpressionWrapper(F('stock_purchased') - F('stock_sold'), output_field=money),
+            'stock_average_cost': average_cost,
+            'stock_value': ExpressionWrapper((F('stock_purchased') - F('stock_sold')) * average_cost, output_field=money),
+        },
+    )
+
+
+class PurchaseInvoiceQuerySet(models.QuerySet):
+    def with_financials(self):
+        """
+        Annotate lot quantities and payment figures in a single query.
+
+        Values are stored as ``annotated_<name>`` so they can be used in
+        filter() and order_by(). available_quantity and
+        net_total_after_cash_cutting pick them up, and the recompute helpers
+        in Accounts/totals.py compare them with the stored totals columns.
+        """
+        money = DecimalField(max_digits=12, decimal_places=2)
+        zero = Value(Decimal('0.00'), output_field=money)
+
+        def child_sum(model, fk, field):
+            rows = model.objects.filter(**{fk: OuterRef('pk')}).order_by().values(fk)
+            return Coalesce(Subquery(rows.annotate(total=Sum(field)).values('total'), output_field=money), zero)
+
+        return self.with_stored_totals().annotate(
+            annotated_purchased_quantity=child_sum(PurchaseProduct, 'invoice', 'quantity'),
+            annotated_line_total=child_sum(PurchaseProduct, 'invoice', 'total'),
+            annotated_used_quantity=child_sum(SalesLot, 'purchase_invoice', 'quantity'),
+            annotated_paid_amount=child_sum(Payment, 'invoice', 'amount'),
+        ).annotate(
+            annotated_available_quantity=F('annotated_purchased_quantity') - F('annotated_used_quantity'),
+            annotated_due_amount=F('annotated_net_total_after_cash_cutting') - F('annotated_paid_amount'),
+        )
+
+    def with_stored_totals(self):
+        """Annotate net_total_after_cash_cutting from the stored net total, for sorting and filtering."""
+        money = DecimalField(max_digits=12, decimal_places=2)
+        return self.annotate(
+            annotated_net_total_after_cash_cutting=Round(
+                F('net_total') - F('net_total') * Value(Decimal('0.02')), 2, output_field=money
+            ),
+        )
+
+    def available(self):
+        """Lots that still have quantity left to sell."""
+        return self.with_financials().filter(annotated_available_quantity__gt=0)
+
+    def outstanding(self):
+        """Invoices with an amount still due to the vendor."""
+        return self.filter(due_amount__gt=0)
+
+    def product_quantities(self):
+        """
+        Remaining quantity per lot and product in two grouped queries.
+
+        Returns ``{lot_id: {product_name: remaining}}``. Quantity taken from a
+        lot through SalesLot rows counts against the product of the sales
+        invoice's first line, the product SalesLot.clean checks the lot for.
+        """
+        lot_ids = self.order_by().values('pk')
+        purchased = (
+            PurchaseProduct.objects.filter(invoice_id__in=lot_ids)
+            .order_by()
+            .values('invoice_id', 'product_id', 'product__name')
+            .annotate(total=Sum('quantity'))
+        )
+        sold = (
+            lot_sales().filter(purchase_invoice_id__in=lot_ids)
+            .order_by()
+            .values('purchase_invoice_id', 'sold_product_id')
+            .annotate(total=Sum('quantity'))
+        )
+        used = {(row['purchase_invoice_id'], row['sold_product_id']): row['total'] for row in sold}
+
+        quantities = {}
+        for row in purchased:
+            lot = quantities.setdefault(row['invoice_id'], {})
+            remaining = row['total'] - used.get((row['invoice_id'], row['product_id']), 0)
+            lot[row['product__name']] = lot.get(row['product__name'], 0) + remaining
+        return quantities
+
+
 class PurchaseInvoice(TenantModelMixin, models.Model):
     tenant = models.ForeignKey(Tenant, on_delete=models.CASCADE, null=True)
     tenant_id = 'tenant_id'
@@ -89,7 +231,13 @@ class PurchaseInvoice(TenantModelMixin, models.Model):
     lot_number = models.CharField(max_length=10, editable=False)
     date = models.DateField(default=date.today)
     vendor = models.ForeignKey('PurchaseVendor', on_delete=models.CASCADE, related_name='invoices')
+    best_before = models.DateField(blank=True, null=True, help_text="Used to sell the earliest expiring lots first")
     net_total = models.DecimalField(max_digits=12, decimal_places=2, default=0)
+    # Stored totals, kept up to date by the line item and payment hooks (see Accounts/totals.py)
+    total_quantity = models.DecimalField(max_digits=12, decimal_places=2, default=0, editable=False)
+    paid_amount = models.DecimalField(max_digits=12, decimal_places=2, default=0, editable=False)
+    due_amount = models.DecimalField(max_digits=12, decimal_places=2, default=0, editable=False)
+    payment_status = models.CharField(max_length=10, choices=totals.PAYMENT_STATUS_CHOICES, default='Paid', editable=False)
     payment_issuer_name = models.CharField(
         max_length=100,
         choices=[('Abdul Rafi', 'Abdul Rafi'), ('Sadiq', 'Sadiq')],
@@ -97,7 +245,7 @@ class PurchaseInvoice(TenantModelMixin, models.Model):
         null=True
     )
     
-    objects = TenantManager()
+    objects = TenantManager.from_queryset(PurchaseInvoiceQuerySet)()
     
     class Meta:
         verbose_name = "Lot"
@@ -105,50 +253,77 @@ class PurchaseInvoice(TenantModelMixin, models.Model):
         verbose_name_plural = "Purchase Invoices"  # Plural name
         unique_together = (('tenant', 'invoice_number'), ('tenant', 'lot_number'))
 
-    def save(self, *args, **kwargs):
-        # --- Generate invoice_number if not set (only for new objects) ---
-        if not self.invoice_number and self.pk is None:
-            last_invoice = PurchaseInvoice.objects.order_by("-id").first()
-            if last_invoice and last_invoice.invoice_number:
-                try:
-                    # Extract the last two digits and increment
-                    last_number = int(last_invoice.invoice_number[-2:])
-                except ValueError:
-                    last_number = 0
-                self.invoice_number = f"MS2025R{last_number + 1:02d}"
-            else:
-                self.invoice_number = "MS2025R01"  # Default starting number
-
-        # --- Generate lot_number if not set (only for new objects) ---
-        if not self.lot_number and self.pk is None:
-            last_lot = PurchaseInvoice.objects.order_by("-id").first()
-            if last_lot and last_lot.lot_number:
-                try:
-                    last_lot_number = int(last_lot.lot_number.split("-")[-1])
-                except ValueError:
-                    last_lot_number = 0
-                self.lot_number = f"LOT-{last_lot_number + 1:02d}"
-            else:
-                self.lot_number = "LOT-01"  # Default starting lot number
-
-        # Only update net_total if it's a new instance or update_fields excludes net_total
-        update_total = True
-        if 'update_fields' in kwargs and kwargs['update_fields'] is not None:
-            update_total = 'net_total' not in kwargs['update_fields']
-
-        # First save to ensure instance has a primary key
-        super().save(*args, **kwargs)
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # Store the original vendor so a change can be moved between vendor balances
+        self._loaded_vendor_id = self.__dict__.get('vendor_id')
 
-        # Update net_total if needed (not during a field-specific update that includes net_total)
-        if update_total and self.pk:
-            calculated_total = sum(product.total for product in self.purchase_products.all())
-            if self.net_total != calculated_total:
-                self.net_total = calculated_total
-                # Update only the net_total field without triggering full save again
-                type(self).objects.filter(pk=self.pk).update(net_total=calculated_total)
+    def save(self, *args, **kwargs):
+        # --- Generate invoice_number and lot_number if not set (only for new objects) ---
+        if self.pk is None:
+            tenant_id = self.tenant_id or getattr(get_current_tenant(), 'pk', None)
+            if not self.invoice_number:
+                self.invoice_number = sequences.next_number(
+                    sequences.PURCHASE_INVOICE, tenant_id, self.date.year
+                )
+            if not self.lot_number:
+                self.lot_number = sequences.next_number(sequences.LOT, tenant_id)
+
+        # The totals columns are maintained by the line item and payment hooks
+        totals.protect_stored_totals(self, totals.PURCHASE_TOTAL_FIELDS, kwargs)
+        previous_vendor_id = getattr(self, '_loaded_vendor_id', None)
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+            # Moving an invoice to another vendor moves its due amount with it
+            if previous_vendor_id and previous_vendor_id != self.vendor_id:
+                ledger.refresh_balance('vendor', previous_vendor_id)
+                ledger.refresh_balance('vendor', self.vendor_id)
+        self._loaded_vendor_id = self.vendor_id
+
+    LINE_FIELDS = ['product', 'serial_number', 'quantity', 'price', 'damage', 'discount', 'rotten',
+                   'total', 'loading_unloading']
+
+    def set_lines(self, lines):
+        """
+        Replace the invoice's line items in one pass.
 
+        ``lines`` are PurchaseProduct instances or dicts of their fields in
+        display order; existing lines left out are deleted. Totals are
+        computed in memory, rows are written with bulk_create/bulk_update,
+        serial numbers follow the given order and the invoice totals are
+        refreshed with a single UPDATE. Returns the saved lines.
+        """
+        lines = [line if isinstance(line, PurchaseProduct) else PurchaseProduct(**line) for line in lines]
+        product_names = dict(
+            Product._base_manager.filter(pk__in={line.product_id for line in lines}).values_list('pk', 'name')
+        )
+        for serial, line in enumerate(lines, start=1):
+            line.invoice = self
+            line.serial_number = serial
+        pricing.price_purchase_products(lines, [product_names.get(line.product_id, "") for line in lines])
+
+        existing = [line for line in lines if line.pk]
+        new = [line for line in lines if not line.pk]
+        with transaction.atomic(), totals.deferred():
+            deleted, _ = self.purchase_products.exclude(pk__in=[line.pk for line in existing]).delete()
+            PurchaseProduct.objects.bulk_update(existing, self.LINE_FIELDS, batch_size=500)
+            PurchaseProduct.objects.bulk_create(new, batch_size=500)
+            # An invoice that had no lines and still has none keeps its net total
+            if lines or deleted:
+                totals.refresh_purchase_invoice_lines(self.pk)
+            # Bulk writes send no save signals
+            dashboard.invalidate(self.tenant_id)
+            rollups.mark_day(self.tenant_id, self.date)
+        for line in lines:
+            totals.remember(line)
+        return lines
+
+    # Properties below use the values from PurchaseInvoice.objects.with_financials()
+    # when present and otherwise compute them from the related rows.
     @property
     def available_quantity(self):
+        if hasattr(self, 'annotated_available_quantity'):
+            return self.annotated_available_quantity
         # Existing purchased quantity
         total_purchased = sum(product.quantity for product in self.purchase_products.all())
         
@@ -159,17 +334,11 @@ class PurchaseInvoice(TenantModelMixin, models.Model):
 
     @property
     def net_total_after_cash_cutting(self):
+        if hasattr(self, 'annotated_net_total_after_cash_cutting'):
+            return self.annotated_net_total_after_cash_cutting
         # Calculate net total after deducting 2%
         return round(self.net_total - (self.net_total * Decimal('0.02')), 2)
 
-    @property
-    def paid_amount(self):
-        return round(sum(payment.amount for payment in self.payments.all()), 2)
-
-    @property
-    def due_amount(self):
-        return round(self.net_total_after_cash_cutting - self.paid_amount, 2)
-    
     #@property
     # def available_quantity(self):
     #     # Sum of quantities purchased from all products in this invoice.
@@ -187,15 +356,7 @@ class PurchaseInvoice(TenantModelMixin, models.Model):
         )
 
     def get_product_quantities(self):
-        products = {}
-        for purchase_product in self.purchase_products.all():
-            sold = SalesProduct.objects.filter(
-                invoice__lot=self,
-                product=purchase_product.product
-            ).aggregate(total=Sum('quantity'))['total'] or 0
-            available = purchase_product.quantity - sold
-            products[purchase_product.product.name] = available
-        return products
+        return PurchaseInvoice.objects.filter(pk=self.pk).product_quantities().get(self.pk, {})
 
 class Purchase(models.Model):
     invoice = models.OneToOneField(PurchaseInvoice, on_delete=models.CASCADE, related_name='purchase_invoice')
@@ -209,12 +370,29 @@ class Purchase(models.Model):
         return f"Purchase for Invoice {self.invoice.invoice_number}"
 
 
+class ProductQuerySet(models.QuerySet):
+    def with_stock(self):
+        """
+        Annotate purchased, sold and available quantity, average cost and
+        stock value of every product in one query (see stock_annotations).
+        """
+        first, second = stock_annotations(
+            PurchaseProduct.objects.filter(product=OuterRef('pk')), 'product',
+            lot_sales().filter(sold_product_id=OuterRef('pk')), 'sold_product_id',
+        )
+        return self.annotate(**first).annotate(**second)
+
+    def in_stock(self):
+        """Products with quantity left to sell."""
+        return self.with_stock().filter(stock_available__gt=0)
+
+
 class Product(TenantModelMixin, models.Model):
     tenant = models.ForeignKey(Tenant, on_delete=models.CASCADE)
     tenant_id = 'tenant_id'
     name = models.CharField(max_length=100)
     
-    objects = TenantManager()
+    objects = TenantManager.from_queryset(ProductQuerySet)()
     
     class Meta:
         unique_together = (('tenant', 'name'),)
@@ -222,6 +400,18 @@ class Product(TenantModelMixin, models.Model):
     def __str__(self):
         return self.name
 
+    def lots(self):
+        """
+        Lots holding this product, annotated with the product's stock in
+        each lot, the same figures with_stock() gives across all lots.
+        """
+        first, second = stock_annotations(
+            PurchaseProduct.objects.filter(invoice=OuterRef('pk'), product=self), 'invoice',
+            lot_sales().filter(purchase_invoice=OuterRef('pk'), sold_product_id=self.pk), 'purchase_invoice',
+        )
+        has_product = PurchaseProduct.objects.filter(invoice=OuterRef('pk'), product=self)
+        return PurchaseInvoice.objects.filter(Exists(has_product)).annotate(**first).annotate(**second)
+
 
 class PurchaseProduct(models.Model):
     invoice = models.ForeignKey(PurchaseInvoice, on_delete=models.CASCADE, related_name='purchase_products')
@@ -235,95 +425,131 @@ class PurchaseProduct(models.Model):
     total = models.DecimalField(max_digits=12, decimal_places=2, default=0)
     loading_unloading = models.DecimalField(max_digits=10, decimal_places=2, default=0)  # Add this
 
-    def save(self, *args, **kwargs):
-        print(f"--- Calculating PurchaseProduct --- ID: {self.pk}") # DEBUG
-        print(f"Input -> Qty: {self.quantity}, Price: {self.price}, Dmg: {self.damage}, Disc: {self.discount}, Rotten: {self.rotten}") # DEBUG
-    # Auto-generate serial_number if not set (only for new objects)
-        if not self.serial_number or self.serial_number == 0:
-            # Get all existing products for this invoice and renumber them in sequence
-            existing_products = PurchaseProduct.objects.filter(invoice=self.invoice).order_by('id')
-
-            # Determine the next serial number
-            if existing_products.exists():
-                # Find the highest existing serial number
-                max_serial = existing_products.aggregate(models.Max('serial_number'))['serial_number__max'] or 0
-                self.serial_number = max_serial + 1
-            else:
-                self.serial_number = 1  # Start from 1 for the first product in the invoice
-
-        # 1. Calculate physical quantity after damage and rotten
-        physical_quantity = self.quantity - self.damage - self.rotten
-        physical_quantity = max(physical_quantity, Decimal('0.00'))
-        print(f"Step 1 -> Physical Qty: {physical_quantity}") # DEBUG
-
-        # 2. Calculate the base price for the physical quantity
-        base_price_total = physical_quantity * self.price
-        print(f"Step 2 -> Base Price Total: {base_price_total}") # DEBUG
-
-        # 3. Calculate discount amount based on the base price
-        discount_amount = (base_price_total * self.discount) / 100
-        print(f"Step 3 -> Discount Amount: {discount_amount}") # DEBUG
-
-        # 4. Calculate price after discount
-        price_after_discount = base_price_total - discount_amount
-        print(f"Step 4 -> Price After Discount: {price_after_discount}") # DEBUG
-
-        # 5. Calculate loading/unloading cost based on Product Name
-        # Accessing product name requires the related object to be loaded
-        # Ensure product is loaded, handle potential DoesNotExist if needed (though FK implies it should exist)
-        try:
-            product_name = self.product.name
-        except Product.DoesNotExist:
-            product_name = "" # Should not happen with ForeignKey
-
-        if product_name == "Rotten":
-            # If Product Name is 'Rotten', loading/unloading cost is zero
-            print(f"Step 5 -> Product is '{product_name}', setting loading_unloading to 0") # DEBUG
-            self.loading_unloading = Decimal('0.00')
-        else:
-            # For all other products, calculate loading/unloading based on the *original* quantity
-            print(f"Step 5 -> Product is '{product_name}', calculating loading_unloading") # DEBUG
-            self.loading_unloading = Decimal(self.quantity) * Decimal('0.40')
-            print(f"Step 5 -> Final loading_unloading: {self.loading_unloading}") # DEBUG
-
-        # 6. Calculate final total: Price after discount - loading/unloading cost
-        self.total = price_after_discount - self.loading_unloading
-        print(f"Step 6 -> Final Total before min check: {self.total}") # DEBUG
-
-        # Ensure total is never zero or negative
-        if self.total <= 0:
-            self.total = Decimal('0.01')  # Set a minimum value
-            print(f"Step 7 -> Adjusted Total to minimum: {self.total}") # DEBUG
-        else:
-            print(f"Step 7 -> Final Total: {self.total}") # DEBUG
-
-        print("--- Calculation Finished --- ") # DEBUG
-
-        # Save the purchase product with calculated values
-        super().save(*args, **kwargs)
-
-        # Update the parent invoice's net_total by triggering a calculation
-        # But only if we're not in the middle of a bulk update or creation
-        if self.invoice and self.invoice.pk:
-            calculated_total = sum(product.total for product in self.invoice.purchase_products.all())
-            if self.invoice.net_total != calculated_total:
-                # Use direct update to avoid recursive saves
-                PurchaseInvoice.objects.filter(pk=self.invoice.pk).update(net_total=calculated_total)
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        totals.remember(self)
+
+    def calculate_total(self, product_name=None):
+        """Set loading_unloading and total from the quantities, price and discount."""
+        if product_name is None:
+            try:
+                product_name = self.product.name
+            except Product.DoesNotExist:
+                product_name = "" # Should not happen with ForeignKey
+        pricing.price_purchase_products([self], [product_name])
+        logger.debug(
+            "PurchaseProduct %s: qty=%s price=%s damage=%s discount=%s rotten=%s -> loading/unloading=%s, total=%s",
+            self.pk, self.quantity, self.price, self.damage, self.discount, self.rotten,
+            self.loading_unloading, self.total,
+        )
 
-        # After saving, resequence all the serial numbers if needed
-        self.resequence_serial_numbers()
+    def save(self, *args, **kwargs):
+        # Auto-generate serial_number if not set (only for new objects)
+        appended = not self.serial_number
+        max_serial = None
+        if appended:
+            max_serial = PurchaseProduct.objects.filter(invoice=self.invoice).aggregate(
+                models.Max('serial_number')
+            )['serial_number__max'] or 0
+            self.serial_number = max_serial + 1
+
+        self.calculate_total()
+
+        # Save the purchase product with calculated values and move the
+        # invoice totals by the difference in the same transaction
+        with transaction.atomic():
+            previous = totals.previous_values(self)
+            super().save(*args, **kwargs)
+            # The first line replaces the net total of a line-less invoice
+            totals.apply_change(self, previous, refresh=max_serial == 0)
+
+        # A line appended after deletions may have left a gap in the numbering
+        if appended and self.serial_number > 1:
+            self.resequence_serial_numbers()
 
     def resequence_serial_numbers(self):
         """Ensure all products in the same invoice have sequential serial numbers"""
-        products = PurchaseProduct.objects.filter(invoice=self.invoice).order_by('id')
-        for i, product in enumerate(products, start=1):
-            if product.serial_number != i:
-                PurchaseProduct.objects.filter(pk=product.pk).update(serial_number=i)
+        resequence_purchase_lines(self.invoice_id)
 
     def __str__(self):
         return f"{self.serial_number}. {self.product.name} in Invoice {self.invoice.invoice_number}"
 
 
+def resequence_purchase_lines(invoice_id):
+    """Number an invoice's lines 1..N in id order, writing only the ones that changed."""
+    lines = PurchaseProduct.objects.filter(invoice_id=invoice_id).order_by('id').only('id', 'serial_number')
+    changed = []
+    for serial, line in enumerate(lines, start=1):
+        if line.serial_number != serial:
+            line.serial_number = serial
+            changed.append(line)
+    if changed:
+        PurchaseProduct.objects.bulk_update(changed, ['serial_number'])
+
+
+class SalesInvoiceQuerySet(models.QuerySet):
+    def with_totals(self):
+        """
+        Annotate every invoice total, computed from the lines and payments,
+        in a single query.
+
+        Each value is stored as ``annotated_<name>``. The derived properties
+        on SalesInvoice pick them up, and the recompute helpers in
+        Accounts/totals.py compare them with the stored totals columns.
+        """
+        money = DecimalField(max_digits=12, decimal_places=2)
+        zero = Value(Decimal('0.00'), output_field=money)
+
+        def line_sum(field):
+            lines = SalesProduct.objects.filter(invoice=OuterRef('pk')).order_by().values('invoice')
+            return Coalesce(Subquery(lines.annotate(total=Sum(field)).values('total'), output_field=money), zero)
+
+        payments = SalesPayment.objects.filter(invoice=OuterRef('pk')).order_by().values('invoice')
+        paid = Coalesce(Subquery(payments.annotate(total=Sum('amount')).values('total'), output_field=money), zero)
+
+        return self.annotate(
+            annotated_total_gross_weight=line_sum('gross_weight'),
+            annotated_net_total=line_sum('total'),
+            annotated_paid_amount=paid,
+        )._with_final_totals(
+            F('annotated_net_total') + F('annotated_total_gross_weight'),
+        ).annotate(
+            annotated_due_amount=F('annotated_net_total_after_packaging') - F('annotated_paid_amount'),
+        ).annotate(
+            annotated_payment_status=Case(
+                When(annotated_due_amount=0, then=Value("Paid")),
+                When(annotated_paid_amount=0, then=Value("Unpaid")),
+                default=Value("Partial"),
+                output_field=CharField(),
+            ),
+        )
+
+
+    def with_stored_totals(self):
+        """
+        Annotate the derived totals (after commission, packaging, crates and
+        the final total) from the stored columns, for sorting and filtering.
+        """
+        return self._with_final_totals(F('net_total') + F('total_gross_weight'))
+
+    def _with_final_totals(self, after_commission):
+        money = DecimalField(max_digits=12, decimal_places=2)
+        zero = Value(Decimal('0.00'), output_field=money)
+        return self.annotate(
+            annotated_packaging_total=Coalesce(F('no_of_crates') * F('cost_per_crate'), zero, output_field=money),
+            annotated_purchased_crates_total=Coalesce(
+                Round(F('purchased_crates_quantity') * F('purchased_crates_unit_price'), 2), zero, output_field=money
+            ),
+            annotated_net_total_after_commission=ExpressionWrapper(after_commission, output_field=money),
+        ).annotate(
+            annotated_net_total_after_packaging=(
+                F('annotated_net_total_after_commission')
+                + F('annotated_packaging_total')
+                + F('annotated_purchased_crates_total')
+            ),
+        )
+
+
 class SalesInvoice(TenantModelMixin, models.Model):
     tenant = models.ForeignKey(Tenant, on_delete=models.CASCADE)
     tenant_id = 'tenant_id'
@@ -368,50 +594,71 @@ class SalesInvoice(TenantModelMixin, models.Model):
                                                   verbose_name="No of Purchased Crates")
     purchased_crates_unit_price = models.DecimalField(max_digits=10, decimal_places=2, default=0, blank=True, null=True,
                                                     verbose_name="Purchased price per crate (₹)")
+
+    # Stored totals, kept up to date by the line item and payment hooks (see Accounts/totals.py)
+    net_total = models.DecimalField(max_digits=12, decimal_places=2, default=0, editable=False)
+    total_gross_weight = models.DecimalField(max_digits=12, decimal_places=2, default=0, editable=False)
+    paid_amount = models.DecimalField(max_digits=12, decimal_places=2, default=0, editable=False)
+    due_amount = models.DecimalField(max_digits=12, decimal_places=2, default=0, editable=False)
+    payment_status = models.CharField(max_length=10, choices=totals.PAYMENT_STATUS_CHOICES, default='Paid', editable=False)
     
-    objects = TenantManager()
+    objects = TenantManager.from_queryset(SalesInvoiceQuerySet)()
     
     class Meta:
         unique_together = (('tenant', 'invoice_number'),)
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # The customer and charges the due amount and customer balance include
+        totals.remember(self)
     
     def save(self, *args, **kwargs):
         # Auto-generate invoice number if not set.
         if not self.invoice_number and self.pk is None:
-            last_invoice = SalesInvoice.objects.order_by("-id").first()
-            if last_invoice and last_invoice.invoice_number:
-                try:
-                    last_number = int(last_invoice.invoice_number[-2:])
-                except ValueError:
-                    last_number = 0
-                self.invoice_number = f"SA2025S{last_number + 1:02d}"
-            else:
-                self.invoice_number = "SA2025S01"
-        super().save(*args, **kwargs)
-    
-    # Computed properties for totals:
-    @property
-    def total_gross_weight(self):
-        """Sum of gross weights of all sales products."""
-        total = self.sales_products.aggregate(total=models.Sum('gross_weight'))['total'] or Decimal('0.00')
-        return total
-    
-    @property
-    def net_total(self):
-        """Sum of all line item totals."""
-        total = self.sales_products.aggregate(total=models.Sum('total'))['total'] or Decimal('0.00')
-        return total
+            self.invoice_number = sequences.next_number(
+                sequences.SALES_INVOICE,
+                self.tenant_id or getattr(get_current_tenant(), 'pk', None),
+                self.invoice_date.year,
+            )
+
+        # The totals columns are maintained by the line item and payment hooks;
+        # packaging and crate charges live on the invoice row, so when they or
+        # the customer change, refresh the due amount and status after saving.
+        totals.protect_stored_totals(self, totals.SALES_TOTAL_FIELDS, kwargs)
+        previous = totals.previous_values(self)
+        if previous is None:
+            changed = any(getattr(self, field) for field in totals.SALES_CHARGE_FIELDS)
+        else:
+            changed = any(previous[field] != getattr(self, field) for field in previous)
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+            if changed:
+                totals.apply_sales_invoice_delta(self.pk)
+                # Moving an invoice to another customer moves its due amount with it
+                if previous and previous['vendor_id'] != self.vendor_id:
+                    ledger.refresh_balance('customer', previous['vendor_id'])
+        totals.remember(self)
+        if changed:
+            self.refresh_from_db(fields=['due_amount', 'payment_status'])
     
+    # Computed properties for totals, derived from the stored columns.
+    # When the instance comes from SalesInvoice.objects.with_totals() the
+    # annotated values (recomputed from lines and payments) are used instead.
     @property
     def net_total_after_commission(self):
         """
         Net Total After Commission = Net Total + Total Gross Weight
         (For example, commission might be structured as a fixed addition per kg.)
         """
+        if hasattr(self, 'annotated_net_total_after_commission'):
+            return self.annotated_net_total_after_commission
         return self.net_total + self.total_gross_weight
     
     @property
     def packaging_total(self):
         """Total packaging cost = no of crates * packaging cost per crate."""
+        if hasattr(self, 'annotated_packaging_total'):
+            return self.annotated_packaging_total
         # Check if both no_of_crates and cost_per_crate are not None
         if self.no_of_crates is not None and self.cost_per_crate is not None:
             # Return the total cost by multiplying no_of_crates and cost_per_crate
@@ -422,6 +669,8 @@ class SalesInvoice(TenantModelMixin, models.Model):
     @property
     def purchased_crates_total(self):
         """Calculated Purchased crates total = No of Purchased Crates * Purchased price per crate."""
+        if hasattr(self, 'annotated_purchased_crates_total'):
+            return self.annotated_purchased_crates_total
         if self.purchased_crates_quantity is not None and self.purchased_crates_unit_price is not None:
             return (Decimal(self.purchased_crates_quantity) * self.purchased_crates_unit_price).quantize(Decimal('0.01'), rounding=ROUND_HALF_UP)
         return Decimal('0.00') # Return 0 if quantity or price is missing
@@ -431,27 +680,11 @@ class SalesInvoice(TenantModelMixin, models.Model):
         """
         Final invoice total = Net Total After Commission + Total packaging cost + Purchased crates total.
         """
+        if hasattr(self, 'annotated_net_total_after_packaging'):
+            return self.annotated_net_total_after_packaging
         # Ensure this still ADDS the calculated purchased_crates_total
         return self.net_total_after_commission + self.packaging_total + self.purchased_crates_total
     
-    @property
-    def paid_amount(self):
-        """Sum of all related payments"""
-        return self.payments.aggregate(total=Sum('amount'))['total'] or Decimal('0.00')
-
-    @property
-    def due_amount(self):
-        """Remaining balance"""
-        return self.net_total_after_packaging - self.paid_amount
-
-    def payment_status(self):
-        """Payment status indicator"""
-        if self.due_amount == 0:
-            return "Paid"
-        elif self.paid_amount == 0:
-            return "Unpaid"
-        return "Partial"
-
     def __str__(self):
         return f"Sales Invoice {self.invoice_number} for {self.vendor}"
 
@@ -476,6 +709,10 @@ class SalesProduct(models.Model):
     price = models.DecimalField(max_digits=10, decimal_places=2, default=0)
     total = models.DecimalField(max_digits=12, decimal_places=2, blank=True, null=True,
                                 help_text="Total = Net Weight * Price")
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        totals.remember(self)
     
     def save(self, *args, **kwargs):
         # Auto-generate serial_number if not set.
@@ -483,13 +720,13 @@ class SalesProduct(models.Model):
             last_item = SalesProduct.objects.filter(invoice=self.invoice).order_by('-serial_number').first()
             self.serial_number = last_item.serial_number + 1 if last_item else 1
         
-        # Calculate net_weight:
-        # net_weight = gross_weight - (gross_weight * discount/100) - rotten
-        self.net_weight = self.gross_weight - ((self.gross_weight * self.discount) / Decimal('100.00')) - self.rotten
-        # Calculate total:
-        self.total = (self.net_weight * self.price)
+        # net_weight = gross_weight - (gross_weight * discount/100) - rotten; total = net_weight * price
+        pricing.price_sales_products([self])
         
-        super().save(*args, **kwargs)
+        with transaction.atomic():
+            previous = totals.previous_values(self)
+            super().save(*args, **kwargs)
+            totals.apply_change(self, previous)
     
     def __str__(self):
         return f"{self.serial_number}. {self.product.name} in Invoice {self.invoice.invoice_number}"
@@ -526,10 +763,73 @@ class SalesPayment(models.Model):
         null=True,
         verbose_name="Payment Attachment"
     )
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        totals.remember(self)
+
+    def save(self, *args, **kwargs):
+        with transaction.atomic():
+            previous = totals.previous_values(self)
+            super().save(*args, **kwargs)
+            totals.apply_change(self, previous)
     
     def __str__(self):
         return f"Payment of ₹{self.amount} for Sales Invoice {self.invoice.invoice_number}"
     
+# Credit status filter values and the labels Customer.credit_status returns
+CREDIT_STATUSES = (
+    ('over_limit', 'Over Limit'),
+    ('near_limit', 'Near Limit'),
+    ('within_limit', 'Within Limit'),
+    ('no_limit', 'No Limit Set'),
+)
+NEAR_LIMIT_RATIO = Decimal('0.8')
+
+
+class CustomerQuerySet(models.QuerySet):
+    def with_credit(self):
+        """
+        Annotate total due, credit utilization (percent of the limit, None
+        without a limit) and credit status as SQL expressions.
+
+        Values are stored as ``annotated_<name>`` so they can be used in
+        filter() and order_by(); total_due, credit_utilization and
+        credit_status pick them up.
+        """
+        money = DecimalField(max_digits=14, decimal_places=2)
+        zero = Value(Decimal('0.00'), output_field=money)
+        # Customers without a balance row yet fall back to their invoices
+        invoice_due = (
+            SalesInvoice.objects.filter(vendor=OuterRef('pk')).order_by().values('vendor')
+            .annotate(total=Sum('due_amount')).values('total')
+        )
+        labels = dict(CREDIT_STATUSES)
+        has_limit = Q(credit_limit__gt=0)
+        return self.annotate(
+            annotated_total_due=Coalesce('balance__total_due', Subquery(invoice_due, output_field=money), zero),
+        ).annotate(
+            annotated_credit_utilization=Case(
+                When(has_limit, then=Cast(
+                    Cast('annotated_total_due', FloatField()) * 100 / F('credit_limit'), money
+                )),
+                default=None,
+                output_field=money,
+            ),
+            annotated_credit_status=Case(
+                When(~has_limit, then=Value(labels['no_limit'])),
+                When(annotated_total_due__gte=F('credit_limit'), then=Value(labels['over_limit'])),
+                When(annotated_total_due__gte=F('credit_limit') * NEAR_LIMIT_RATIO, then=Value(labels['near_limit'])),
+                default=Value(labels['within_limit']),
+                output_field=CharField(),
+            ),
+        )
+
+    def with_credit_status(self, status):
+        """Customers whose credit status is ``status``, one of the CREDIT_STATUSES values."""
+        return self.with_credit().filter(annotated_credit_status=dict(CREDIT_STATUSES)[status])
+
+
 class Customer(TenantModelMixin, models.Model):
     tenant = models.ForeignKey(Tenant, on_delete=models.CASCADE)
     tenant_id = 'tenant_id'
@@ -543,7 +843,7 @@ class Customer(TenantModelMixin, models.Model):
         help_text="Maximum credit limit allowed (0 means no specific limit)"
     )
     
-    objects = TenantManager()
+    objects = TenantManager.from_queryset(CustomerQuerySet)()
     
     class Meta:
         unique_together = (('tenant', 'name'),)
@@ -553,8 +853,14 @@ class Customer(TenantModelMixin, models.Model):
     
     @property
     def total_due(self):
-        """Calculate total outstanding balance for this customer"""
-        return sum(invoice.due_amount for invoice in self.sales_invoices.all())
+        """Total outstanding balance for this customer, read from the balance ledger"""
+        if hasattr(self, 'annotated_total_due'):
+            return self.annotated_total_due
+        try:
+            return self.balance.total_due
+        except CustomerBalance.DoesNotExist:
+            # Balance row not created yet (see the recompute_invoice_totals command)
+            return self.sales_invoices.aggregate(total=Sum('due_amount'))['total'] or Decimal('0.00')
         
     @property
     def is_over_credit_limit(self):
@@ -563,20 +869,56 @@ class Customer(TenantModelMixin, models.Model):
             return False
         return self.total_due > self.credit_limit
     
+    @property
+    def credit_utilization(self):
+        """Total due as a percentage of the credit limit, None without a limit"""
+        if hasattr(self, 'annotated_credit_utilization'):
+            return self.annotated_credit_utilization
+        if not self.credit_limit or self.credit_limit <= 0:
+            return None
+        return (self.total_due / self.credit_limit) * 100
+
     @property
     def credit_status(self):
         """Return credit status as a string"""
+        if hasattr(self, 'annotated_credit_status'):
+            return self.annotated_credit_status
+        labels = dict(CREDIT_STATUSES)
         if not self.credit_limit or self.credit_limit <= 0:
-            return "No Limit Set"
+            return labels['no_limit']
         
-        utilization = (self.total_due / self.credit_limit) * 100
-        
-        if utilization >= 100:
-            return "Over Limit"
-        elif utilization >= 80:
-            return "Near Limit"
+        if self.total_due >= self.credit_limit:
+            return labels['over_limit']
+        elif self.total_due >= self.credit_limit * NEAR_LIMIT_RATIO:
+            return labels['near_limit']
         else:
-            return "Within Limit"
+            return labels['within_limit']
+
+
+class CustomerBalance(TenantModelMixin, models.Model):
+    """Running outstanding balance of a customer, maintained by Accounts/ledger.py"""
+    tenant = models.ForeignKey(Tenant, on_delete=models.CASCADE)
+    tenant_id = 'tenant_id'
+    customer = models.OneToOneField(Customer, on_delete=models.CASCADE, related_name='balance')
+    total_due = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+
+    objects = TenantManager()
+
+    def __str__(self):
+        return f"{self.customer} - ₹{self.total_due}"
+
+
+class VendorBalance(TenantModelMixin, models.Model):
+    """Running outstanding balance owed to a vendor, maintained by Accounts/ledger.py"""
+    tenant = models.ForeignKey(Tenant, on_delete=models.CASCADE)
+    tenant_id = 'tenant_id'
+    vendor = models.OneToOneField(PurchaseVendor, on_delete=models.CASCADE, related_name='balance')
+    total_due = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+
+    objects = TenantManager()
+
+    def __str__(self):
+        return f"{self.vendor} - ₹{self.total_due}"
 
 class Expense(TenantModelMixin, models.Model):
     tenant = models.ForeignKey(Tenant, on_delete=models.CASCADE)
@@ -646,50 +988,36 @@ class SalesLot(TenantModelMixin, models.Model):
     
     def clean(self):
         super().clean()
-        
-        # Skip validation if we're editing an existing record and not changing the quantity
-        if self.pk and hasattr(self, '_loaded_quantity') and self.quantity == self._loaded_quantity:
-            return
-        
-        # Skip validation completely if purchase_invoice is not selected yet
-        if not self.purchase_invoice:
+
+        # Nothing to check until a lot and a quantity are chosen, or when an
+        # existing record keeps its quantity
+        if not self.purchase_invoice_id or self.quantity is None:
             return
-            
-        # Skip quantity validation if not provided yet
-        if self.quantity is None:
+        if self.pk and self.quantity == getattr(self, '_loaded_quantity', None):
             return
 
-        # Check available quantity - only for new records or edited quantities
-        if self.purchase_invoice.available_quantity is not None:
-            # For existing records being edited, account for the current allocation
-            if self.pk:
-                from django.db.models import F
-                # Get the original record from the database
-                original = type(self).objects.get(pk=self.pk)
-                # Only validate if the new quantity is greater than the original
-                if self.quantity > original.quantity + self.purchase_invoice.available_quantity:
-                    raise ValidationError(
-                        f"Only {original.quantity + self.purchase_invoice.available_quantity}kg available in {self.purchase_invoice.lot_number}"
-                    )
-            # For new records
-            elif self.quantity > self.purchase_invoice.available_quantity:
-                raise ValidationError(
-                    f"Only {self.purchase_invoice.available_quantity}kg available in {self.purchase_invoice.lot_number}"
-                )
+        # Remaining quantity of the lot in one query. An edited record's
+        # current allocation is counted as used, so it is added back.
+        lot_number, available = PurchaseInvoice.objects.filter(pk=self.purchase_invoice_id).with_financials(
+        ).values_list('lot_number', 'annotated_available_quantity').get()
+        if self.pk:
+            available += getattr(self, '_loaded_quantity', None) or 0
+        if self.quantity > available:
+            raise ValidationError(f"Only {available}kg available in {lot_number}")
 
         # Skip product check if SalesInvoice is unsaved (no primary key)
-        if not hasattr(self, 'sales_invoice') or not self.sales_invoice or not self.sales_invoice.pk:
-            return  # Skip validation until parent is saved
-
-        # Check product consistency (only after SalesInvoice is saved)
-        sales_products = self.sales_invoice.sales_products.all()
-        if sales_products.exists():
-            sales_product = sales_products.first().product
-            if not self.purchase_invoice.purchase_products.filter(product=sales_product).exists():
-                raise ValidationError(
-                    f"Lot {self.purchase_invoice.lot_number} doesn't contain {sales_product.name}"
-                )
-                
+        if not self.sales_invoice_id:
+            return
+
+        # The lot must contain the product of the sales invoice's first line
+        sales_product = SalesProduct.objects.filter(invoice_id=self.sales_invoice_id).order_by('pk').values_list(
+            'product_id', 'product__name'
+        ).first()
+        if sales_product and not PurchaseProduct.objects.filter(
+            invoice_id=self.purchase_invoice_id, product_id=sales_product[0]
+        ).exists():
+            raise ValidationError(f"Lot {lot_number} doesn't contain {sales_product[1]}")
+
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
         # Store the original quantity when the instance is loaded from the database
@@ -715,3 +1043,144 @@ class Packaging_Invoice(TenantModelMixin, models.Model):
         # Return 0.00 if either no_of_crates or cost_per_crate is None
         return Decimal('0.00')
 
+
+class NumberSequence(models.Model):
+    """Last number handed out per tenant, series and year (see Accounts/sequences.py)"""
+    tenant = models.ForeignKey(Tenant, on_delete=models.CASCADE, null=True, blank=True)
+    series = models.CharField(max_length=30)
+    year = models.PositiveIntegerField(default=0, help_text="0 for series that never restart")
+    last_value = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        unique_together = (('tenant', 'series', 'year'),)
+
+    def __str__(self):
+        return f"{self.series} {self.year or ''} - {self.last_value}"
+
+
+class DailyRollup(TenantModelMixin, models.Model):
+    """Trading figures per tenant, day and product (see Accounts/rollups.py)"""
+    tenant = models.ForeignKey(Tenant, on_delete=models.CASCADE, null=True, blank=True)
+    tenant_id = 'tenant_id'
+    date = models.DateField()
+    # Empty for payments, expenses and damages, which are not tied to a product
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, null=True, blank=True)
+    purchased_quantity = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    sold_quantity = models.DecimalField(max_digits=14, decimal_places=2, default=0, help_text="Net weight sold")
+    gross_weight = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    revenue = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    cost = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    payments_received = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    payments_made = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    expenses = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    damages = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+
+    objects = TenantManager()
+
+    class Meta:
+        unique_together = ('tenant', 'date', 'product')
+        indexes = [models.Index(fields=['tenant', 'date'])]
+
+    def __str__(self):
+        return f"{self.date} - {self.product or 'General'}"
+
+
+class ImportJob(TenantModelMixin, models.Model):
+    """A CSV upload imported in chunks by the run_import_jobs command (see Accounts/import_jobs.py)"""
+    QUEUED = 'queued'
+    RUNNING = 'running'
+    DONE = 'done'
+    FAILED = 'failed'
+    STATUS_CHOICES = [
+        (QUEUED, 'Queued'),
+        (RUNNING, 'Running'),
+        (DONE, 'Done'),
+        (FAILED, 'Failed'),
+    ]
+    # Names of the import formats in Accounts/imports.py
+    FORMAT_CHOICES = [
+        ('purchase_csv', 'Purchase invoices CSV'),
+        ('sales_csv', 'Sales invoices CSV'),
+        ('purchase_export', 'Purchase invoices export'),
+        ('sales_export', 'Sales invoices export'),
+    ]
+
+    tenant = models.ForeignKey(Tenant, on_delete=models.CASCADE)
+    tenant_id = 'tenant_id'
+    created_by = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True)
+    file = models.FileField(upload_to='imports/')
+    file_name = models.CharField(max_length=255)
+    format = models.CharField(max_length=20, choices=FORMAT_CHOICES)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=QUEUED)
+    # Checkpoint: data rows whose chunk has been committed
+    rows_done = models.PositiveIntegerField(default=0)
+    success_count = models.PositiveIntegerField(default=0)
+    error_count = models.PositiveIntegerField(default=0)
+    created_count = models.PositiveIntegerField(default=0)
+    updated_count = models.PositiveIntegerField(default=0)
+    # Rows skipped because an earlier import already imported them as they are
+    unchanged_count = models.PositiveIntegerField(default=0)
+    error_messages = models.JSONField(default=list, blank=True)
+    failure = models.TextField(blank=True, help_text="Why the job stopped, when it failed")
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+    # Touched after every chunk; a running job that stops touching it is resumed by another worker.
+    # Also the lease of the worker running the job (see Accounts/import_jobs.py)
+    heartbeat_at = models.DateTimeField(null=True, blank=True)
+
+    objects = TenantManager()
+
+    class Meta:
+        ordering = ['-created_at']
+        indexes = [models.Index(fields=['status', 'heartbeat_at'])]
+
+    def __str__(self):
+        return f"{self.file_name} ({self.get_status_display()})"
+
+
+class ImportedPurchaseRow(TenantModelMixin, models.Model):
+    """
+    A CSV row imported into a purchase invoice (see Accounts/imports.py), keyed
+    on its format and its position among the invoice's rows in the file
+    """
+    tenant = models.ForeignKey(Tenant, on_delete=models.CASCADE)
+    tenant_id = 'tenant_id'
+    format = models.CharField(max_length=20)
+    invoice = models.ForeignKey(PurchaseInvoice, on_delete=models.CASCADE, related_name='imported_rows')
+    position = models.PositiveIntegerField()
+    # Hash of the row's values; a row imported again with another hash replaces its line and payment
+    fingerprint = models.CharField(max_length=64)
+    line = models.ForeignKey(PurchaseProduct, on_delete=models.SET_NULL, null=True, blank=True, related_name='+')
+    payment = models.ForeignKey(Payment, on_delete=models.SET_NULL, null=True, blank=True, related_name='+')
+
+    objects = TenantManager()
+
+    class Meta:
+        unique_together = (('invoice', 'format', 'position'),)
+
+    def __str__(self):
+        return f"{self.invoice_id} - {self.format} row {self.position}"
+
+
+class ImportedSalesRow(TenantModelMixin, models.Model):
+    """
+    A CSV row imported into a sales invoice (see Accounts/imports.py), keyed
+    on its format and its position among the invoice's rows in the file
+    """
+    tenant = models.ForeignKey(Tenant, on_delete=models.CASCADE)
+    tenant_id = 'tenant_id'
+    format = models.CharField(max_length=20)
+    invoice = models.ForeignKey(SalesInvoice, on_delete=models.CASCADE, related_name='imported_rows')
+    position = models.PositiveIntegerField()
+    # Hash of the row's values; a row imported again with another hash replaces its payment
+    fingerprint = models.CharField(max_length=64)
+    payment = models.ForeignKey(SalesPayment, on_delete=models.SET_NULL, null=True, blank=True, related_name='+')
+
+    objects = TenantManager()
+
+    class Meta:
+        unique_together = (('invoice', 'format', 'position'),)
+
+    def __str__(self):
+        return f"{self.invoice_id} - {self.format} row {self.position}"
@@ -0,0 +1,94 @@
+"""
+Bulk allocation of a customer's or vendor's payment over their invoices.
+
+``allocate_payment`` reads the due amounts of the party's outstanding
+invoices in one query, splits the amount over them oldest first, saves one
+payment per paid invoice and moves the invoice totals with one UPDATE. The
+payments are saved one by one rather than bulk inserted so that their
+post_save receivers, the payment notifications among them, run as for any
+other payment; a settlement pays only a handful of invoices. Everything runs
+in one transaction holding the party's balance lock (see Accounts/ledger.py),
+so two settlements for the same party are applied one after the other and
+never pay the same due amount twice.
+"""
+from datetime import date
+from decimal import Decimal, InvalidOperation
+
+from django.core.exceptions import ValidationError
+from django.db import transaction
+
+from . import ledger, totals
+
+CUSTOMER = 'customer'
+VENDOR = 'vendor'
+
+
+def _targets(party):
+    from .models import Customer, Payment, PurchaseInvoice, SalesInvoice, SalesPayment
+
+    if isinstance(party, Customer):
+        return CUSTOMER, SalesInvoice, SalesPayment, 'invoice_date'
+    return VENDOR, PurchaseInvoice, Payment, 'date'
+
+
+def allocate_payment(party, amount, invoice_ids=None, payment_date=None, payment_mode='cash'):
+    """
+    Pay ``amount`` towards the outstanding invoices of a customer or vendor.
+
+    Only the invoices in ``invoice_ids`` are paid when given. Invoices are
+    paid oldest first, each up to its due amount. Returns a report with the
+    created payments, one ``{'invoice_id', 'invoice_number', 'due', 'paid'}``
+    entry per paid invoice and the allocated and unallocated totals. Raises
+    ValidationError, without writing anything, for a non-positive amount,
+    an unknown payment mode or when no invoice is outstanding.
+    """
+    kind, invoice_model, payment_model, date_field = _targets(party)
+    try:
+        amount = Decimal(amount).quantize(Decimal('0.01'))
+    except (InvalidOperation, TypeError, ValueError):
+        raise ValidationError("Payment amount must be a number")
+    if amount <= 0:
+        raise ValidationError("Payment amount must be positive")
+    if payment_mode not in dict(payment_model.PAYMENT_METHOD_CHOICES):
+        raise ValidationError(f"Unknown payment method {payment_mode!r}")
+    payment_date = payment_date or date.today()
+
+    with transaction.atomic():
+        ledger.lock_balance(kind, party.pk)
+        invoices = invoice_model.objects.filter(vendor=party, due_amount__gt=0)
+        if invoice_ids is not None:
+            invoices = invoices.filter(pk__in=invoice_ids)
+        outstanding = list(
+            invoices.select_for_update()
+            .order_by(date_field, 'pk')
+            .values_list('pk', 'invoice_number', 'due_amount')
+        )
+        if not outstanding:
+            raise ValidationError("No outstanding invoices to pay")
+
+        allocations = []
+        remaining = amount
+        for invoice_id, invoice_number, due in outstanding:
+            paid = min(due, remaining)
+            allocations.append({'invoice_id': invoice_id, 'invoice_number': invoice_number, 'due': due, 'paid': paid})
+            remaining -= paid
+            if not remaining:
+                break
+
+        payments = []
+        # The invoice totals are moved once below, not by each payment
+        with totals.deferred():
+            for entry in allocations:
+                payment = payment_model(
+                    invoice_id=entry['invoice_id'], amount=entry['paid'], date=payment_date, payment_mode=payment_mode
+                )
+                payment.save()
+                payments.append(payment)
+        totals.apply_paid_amounts(kind, party.pk, {entry['invoice_id']: entry['paid'] for entry in allocations})
+
+    return {
+        'payments': payments,
+        'invoices': allocations,
+        'allocated': amount - remaining,
+        'unallocated': remaining,
+    }
@@ -0,0 +1,117 @@
+"""
+Rendering many invoice PDFs at once, as a ZIP archive or one merged PDF.
+
+The PDFs are rendered into the on-disk PDF cache (see Accounts/pdf_cache.py),
+so invoices printed before are not rendered again. The admin actions render
+in the web worker's own process; only the render_invoice_pdfs command uses
+a pool of worker processes, as forking a threaded server process mid-request
+can deadlock and the workers must not share its database connections. ``stream_zip`` yields the archive chunk by chunk as the
+PDFs come in, so only one chunk is held in memory at a time; ``merged_pdf``
+writes the merged document to a temporary file that is sent from disk.
+"""
+import os
+import tempfile
+import zipfile
+from concurrent.futures import ProcessPoolExecutor
+
+from django.db import connection, connections
+
+from . import pdf_cache
+
+# kind: (invoice model, name of the renderer in Accounts.views, file name prefix)
+KINDS = {
+    pdf_cache.PURCHASE_INVOICE: ('PurchaseInvoice', 'render_invoice_pdf', ''),
+    pdf_cache.SALES_INVOICE: ('SalesInvoice', 'render_sales_invoice_pdf', 'sales_invoice_'),
+}
+DEFAULT_WORKERS = min(4, os.cpu_count() or 1)
+CHUNK_SIZE = 64 * 1024
+
+
+def _render(task):
+    """Cached PDF of one invoice; runs in a worker process."""
+    from django.apps import apps
+    from . import views
+
+    kind, invoice_id, hide_payments = task
+    model_name, renderer, prefix = KINDS[kind]
+    # The ids were picked from a tenant-filtered queryset by the caller
+    invoice = apps.get_model('Accounts', model_name)._base_manager.get(pk=invoice_id)
+    path = pdf_cache.ensure(kind, invoice, hide_payments, getattr(views, renderer))
+    return f'{prefix}{invoice.invoice_number}.pdf', path
+
+
+def _init_worker():
+    import django
+    from django.apps import apps
+
+    # Spawned workers start without Django; forked ones open their own connections
+    if not apps.ready:
+        django.setup()
+
+
+def render(kind, invoice_ids, hide_payments=False, workers=1):
+    """
+    Yield ``(file name, path of the cached PDF)`` for each invoice, in the
+    order of ``invoice_ids``. Renders in this process unless ``workers`` is
+    above one, which only commands may ask for; inside a transaction the
+    workers could not see, still renders in this process.
+    """
+    if kind not in KINDS:
+        raise ValueError(f"Unknown invoice kind {kind!r}")
+    tasks = [(kind, invoice_id, bool(hide_payments)) for invoice_id in invoice_ids]
+    if workers <= 1 or len(tasks) <= 1 or connection.in_atomic_block:
+        yield from map(_render, tasks)
+        return
+    # Forked workers must not share this process's database connections
+    connections.close_all()
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker) as pool:
+        yield from pool.map(_render, tasks, chunksize=4)
+
+
+class _ChunkWriter:
+    """Unseekable file object that collects what zipfile writes until it is taken."""
+
+    def __init__(self):
+        self.chunks = []
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def take(self):
+        data, self.chunks = b''.join(self.chunks), []
+        return data
+
+
+def stream_zip(rendered):
+    """Yield a ZIP archive of the ``(file name, path)`` pairs from render() chunk by chunk."""
+    output = _ChunkWriter()
+    # PDFs are compressed already
+    with zipfile.ZipFile(output, 'w', compression=zipfile.ZIP_STORED) as archive:
+        for name, path in rendered:
+            with open(path, 'rb') as source, archive.open(name, 'w') as target:
+                while chunk := source.read(CHUNK_SIZE):
+                    target.write(chunk)
+                    yield output.take()
+    # The central directory is written when the archive is closed
+    yield output.take()
+
+
+def merged_pdf(rendered):
+    """
+    One PDF with the pages of every ``(file name, path)`` pair from render(),
+    as an open temporary file positioned at the start.
+    """
+    from pypdf import PdfWriter
+
+    writer = PdfWriter()
+    for name, path in rendered:
+        writer.append(path, outline_item=os.path.splitext(name)[0])
+    merged = tempfile.TemporaryFile()
+    writer.write(merged)
+    writer.close()
+    merged.seek(0)
+    return merged
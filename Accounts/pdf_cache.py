@@ -0,0 +1,149 @@
+"""
+On-disk cache of the generated invoice PDFs.
+
+A PDF is stored under a hash of everything it is drawn from: the invoice
+row, its party, lines, payments and lots, the tenant's logo, the hide_payments
+flag and ``LAYOUT_VERSION``. Any change to those rows gives a new hash,
+so a stale PDF is never served; the hash doubles as the ETag and the
+file's modification time as Last-Modified, so a browser that already has
+the current PDF gets a 304 without it being read or rendered. The save/delete
+signals in Accounts/signals.py remove the files of a changed invoice once
+the transaction commits.
+"""
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+
+from django.conf import settings
+from django.db import transaction
+from django.http import FileResponse
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, quote_etag
+
+# Bump when the layout of the generated PDFs changes
+LAYOUT_VERSION = 2
+
+PURCHASE_INVOICE = 'purchase'
+SALES_INVOICE = 'sales'
+PACKAGING_INVOICE = 'packaging'
+
+# kind: (invoice model, party field or None, related names of the lines, payments and lots)
+SOURCES = {
+    PURCHASE_INVOICE: ('PurchaseInvoice', 'vendor', ('purchase_products', 'payments')),
+    SALES_INVOICE: ('SalesInvoice', 'vendor', ('sales_products', 'payments', 'sales_lots')),
+    PACKAGING_INVOICE: ('Packaging_Invoice', None, ()),
+}
+
+
+def cache_dir():
+    return getattr(settings, 'INVOICE_PDF_CACHE_DIR', os.path.join(settings.BASE_DIR, 'pdf_cache'))
+
+
+def _invoice_dir(kind, invoice_id):
+    return os.path.join(cache_dir(), kind, str(invoice_id))
+
+
+# Values of related rows printed with a row: a line's product name, a sales lot's lot number
+PRINTED_RELATIONS = {'product': 'product__name', 'purchase_invoice': 'purchase_invoice__lot_number'}
+
+
+def _rows(queryset):
+    fields = [field.attname for field in queryset.model._meta.concrete_fields]
+    fields += [
+        PRINTED_RELATIONS[field.name] for field in queryset.model._meta.concrete_fields
+        if field.name in PRINTED_RELATIONS
+    ]
+    return [list(row) for row in queryset.order_by('pk').values_list(*fields)]
+
+
+def fingerprint(kind, invoice, hide_payments=False):
+    """Hash of the rows a PDF of the invoice is drawn from."""
+    from django.apps import apps
+    from .pdf_resources import tenant_logo_name
+
+    model_name, party_field, related = SOURCES[kind]
+    model = apps.get_model('Accounts', model_name)
+    parts = [LAYOUT_VERSION, kind, bool(hide_payments), _rows(model._base_manager.filter(pk=invoice.pk))]
+    if party_field:
+        party = model._meta.get_field(party_field).related_model
+        parts.append(_rows(party._base_manager.filter(pk=getattr(invoice, f'{party_field}_id'))))
+    for name in related:
+        parts.append(_rows(getattr(invoice, name).all()))
+    parts.append(tenant_logo_name(invoice.tenant_id))
+    payload = json.dumps(parts, default=str, separators=(',', ':'))
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+def _write(path, content):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    handle, temporary = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+    with os.fdopen(handle, 'wb') as output:
+        output.write(content)
+    # Readers see either no file or the complete one
+    os.replace(temporary, path)
+
+
+def _location(kind, invoice, hide_payments):
+    digest = fingerprint(kind, invoice, hide_payments)
+    variant = 'without-payments' if hide_payments else 'full'
+    return digest, os.path.join(_invoice_dir(kind, invoice.pk), f'{variant}-{digest}.pdf')
+
+
+def _store(path, content):
+    _write(path, content)
+    # Older renderings of this variant can never be served again
+    directory, current = os.path.split(path)
+    variant = current.rsplit('-', 1)[0]
+    for name in os.listdir(directory):
+        if name.rsplit('-', 1)[0] == variant and name != current and name.endswith('.pdf'):
+            try:
+                os.remove(os.path.join(directory, name))
+            except FileNotFoundError:
+                pass
+
+
+def ensure(kind, invoice, hide_payments, render):
+    """Path of the cached PDF of the invoice, rendering it first when it is not cached."""
+    hide_payments = bool(hide_payments)
+    _, path = _location(kind, invoice, hide_payments)
+    if not os.path.exists(path):
+        _store(path, render(invoice, hide_payments))
+    return path
+
+
+def serve(request, kind, invoice, hide_payments, render, filename):
+    """
+    Respond with the cached PDF of the invoice, rendering it with
+    ``render(invoice, hide_payments)`` (which returns the PDF bytes) when it
+    is not cached yet, or with a 304 when the client has the current one.
+    """
+    hide_payments = bool(hide_payments)
+    digest, path = _location(kind, invoice, hide_payments)
+    etag = quote_etag(digest)
+    cached = os.path.exists(path)
+    last_modified = int(os.path.getmtime(path)) if cached else None
+    # The ETag does not depend on the file, so a matching client never waits for a rendering
+    not_modified = get_conditional_response(request, etag=etag, last_modified=last_modified)
+    if not_modified is not None:
+        return not_modified
+
+    if not cached:
+        _store(path, render(invoice, hide_payments))
+        last_modified = int(os.path.getmtime(path))
+
+    response = FileResponse(open(path, 'rb'), content_type='application/pdf')
+    response['Content-Disposition'] = f'inline; filename="{filename}"'
+    response['ETag'] = etag
+    response['Last-Modified'] = http_date(last_modified)
+    # Reprints are checked against the server every time
+    response['Cache-Control'] = 'private, no-cache'
+    return response
+
+
+def invalidate(kind, invoice_id):
+    """Remove the cached PDFs of an invoice once the current transaction commits."""
+    if not invoice_id:
+        return
+    transaction.on_commit(lambda: shutil.rmtree(_invoice_dir(kind, invoice_id), ignore_errors=True))
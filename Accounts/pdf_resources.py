@@ -0,0 +1,281 @@
+"""
+Fonts, logos and styles shared by every PDF the project draws.
+
+Everything here is built once per process instead of once per PDF: the
+fonts are registered on import, the paragraph and table styles are module
+constants, and each logo is read and decoded the first time it is drawn
+and kept for the next PDFs. ``logo_image`` draws that shared ImageReader
+through ``canvas.drawImage``, which takes one; ReportLab's own Image
+flowable only takes a file. The invoice views, the expense and damage
+templates and analytics.reports all take their resources from here.
+"""
+import base64
+import mimetypes
+import os
+from io import BytesIO
+
+from django.conf import settings
+from django.contrib.staticfiles import finders
+from reportlab.lib import colors
+from reportlab.lib.styles import ParagraphStyle, getSampleStyleSheet
+from reportlab.lib.utils import ImageReader
+from reportlab.pdfbase import pdfmetrics
+from reportlab.pdfbase.ttfonts import TTFont
+from reportlab.platypus import Flowable, TableStyle
+
+FONT_DIR = os.path.join(os.path.dirname(__file__), 'Font')
+# name: file; the DejaVuSans names have always drawn the Noto files
+FONTS = {
+    'DejaVuSans': 'NotoSans.ttf',
+    'DejaVuSans-Bold': 'NotoSans-Bold.ttf',
+    'NotoSans': 'NotoSans.ttf',
+    'NotoSans-Bold': 'NotoSans-Bold.ttf',
+}
+DEFAULT_LOGO = 'LOGO.png'
+
+
+def register_fonts():
+    registered = set(pdfmetrics.getRegisteredFontNames())
+    for name, filename in FONTS.items():
+        if name not in registered:
+            pdfmetrics.registerFont(TTFont(name, os.path.join(FONT_DIR, filename)))
+
+
+register_fonts()
+
+
+def font_uri(name):
+    """file:// URI of a registered font, for the xhtml2pdf templates"""
+    return 'file://' + os.path.join(FONT_DIR, FONTS[name]).replace('\\', '/')
+
+
+SAMPLE_STYLES = getSampleStyleSheet()
+
+PARAGRAPH_STYLES = {
+    'invoice_title': ParagraphStyle(
+        'Title', parent=SAMPLE_STYLES['Title'], fontSize=16, alignment=1, textColor=colors.black,
+    ),
+    'footer': ParagraphStyle(
+        'Footer', parent=SAMPLE_STYLES['Normal'], fontSize=10, leading=12, textColor=colors.darkgrey,
+    ),
+}
+
+TABLE_STYLES = {
+    # Purchase invoice
+    'purchase_vendor': TableStyle([
+        ('GRID', (0, 0), (-1, -1), 0.5, colors.grey),
+        ('ALIGN', (0, 0), (-1, -1), 'LEFT'),
+        ('FONTNAME', (0, 0), (-1, -1), 'DejaVuSans'),
+        ('FONTSIZE', (0, 0), (-1, -1), 10),
+        ('BACKGROUND', (0, 0), (0, 2), colors.yellow),  # Name, Contact No, Area
+        ('BACKGROUND', (2, 0), (2, 2), colors.yellow),  # Date, Invoice No, Lot No
+        ('TEXTCOLOR', (0, 0), (-1, 0), colors.black),
+    ]),
+    'purchase_products': TableStyle([
+        ('GRID', (0, 0), (-1, -1), 0.5, colors.black),
+        ('BACKGROUND', (0, 0), (-1, 0), colors.yellow),
+        ('ALIGN', (0, 0), (-1, -1), 'CENTER'),
+        ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
+        ('FONTNAME', (0, 1), (-1, -1), 'DejaVuSans'),
+        ('FONTSIZE', (0, 0), (-1, -1), 8),
+        ('TEXTCOLOR', (0, 0), (-1, 0), colors.black),
+    ]),
+    'purchase_paid': TableStyle([
+        ('GRID', (0, 0), (-1, -1), 0.5, colors.grey),
+        ('ALIGN', (0, 0), (-1, -1), 'CENTER'),
+        ('FONTNAME', (0, 0), (-1, -1), 'DejaVuSans'),
+        ('BACKGROUND', (0, 0), (0, 0), colors.yellow),
+        ('FONTNAME', (0, -1), (-1, -1), 'DejaVuSans-Bold'),  # Total Paid row
+        ('TEXTCOLOR', (0, 0), (-1, 0), colors.black),
+        ('FONTSIZE', (0, 0), (-1, -1), 10),
+        ('FONTSIZE', (0, -1), (-1, -1), 12),
+    ]),
+    'purchase_payment_summary': TableStyle([
+        ('GRID', (0, 0), (-1, -1), 0.5, colors.grey),
+        ('ALIGN', (0, 0), (-1, -1), 'RIGHT'),
+        ('FONTNAME', (0, 0), (-1, -1), 'DejaVuSans'),
+        ('FONTNAME', (0, -1), (-1, -1), 'DejaVuSans-Bold'),
+        ('BACKGROUND', (0, 0), (-1, 0), colors.yellow),
+        ('TEXTCOLOR', (0, 0), (-1, 0), colors.black),
+        ('FONTSIZE', (0, 0), (-1, -1), 10),
+    ]),
+    # Sales invoice
+    'sales_logo': TableStyle([
+        ('VALIGN', (0, 0), (-1, -1), 'MIDDLE'),
+        ('LEFTPADDING', (0, 0), (-1, -1), 10),
+    ]),
+    'sales_header': TableStyle([
+        ('SPAN', (1, 5), (3, 5)),  # Lot numbers
+        ('SPAN', (1, 2), (3, 2)),  # Vendor name
+        ('ALIGN', (1, 5), (3, 5), 'LEFT'),
+        ('GRID', (0, 1), (-1, -1), 0.5, colors.grey),
+        ('FONTNAME', (2, 1), (3, -1), 'Helvetica-Bold'),
+        ('FONTNAME', (0, 1), (3, -1), 'Helvetica-Bold'),
+        ('ALIGN', (2, 1), (3, -1), 'RIGHT'),
+        ('VALIGN', (0, 0), (-1, -1), 'MIDDLE'),
+        ('BACKGROUND', (0, 1), (0, 5), colors.yellow),
+        ('BACKGROUND', (2, 1), (2, 1), colors.yellow),
+        ('BACKGROUND', (2, 3), (2, 4), colors.yellow),
+    ]),
+    'sales_main_header': TableStyle([
+        ('VALIGN', (0, 0), (-1, -1), 'TOP'),
+        ('ALIGN', (0, 0), (-1, -1), 'LEFT'),
+    ]),
+    'sales_products': TableStyle([
+        ('GRID', (0, 0), (-1, -1), 0.5, colors.black),
+        ('BACKGROUND', (0, 0), (-1, 0), colors.yellow),
+        ('ALIGN', (0, 0), (-1, -1), 'CENTER'),
+        ('FONTNAME', (0, 0), (-1, 0), 'DejaVuSans-Bold'),
+        ('FONTNAME', (0, 1), (-1, -1), 'DejaVuSans'),
+        ('FONTSIZE', (0, 0), (-1, -1), 9),
+        ('TEXTCOLOR', (0, 0), (-1, 0), colors.black),
+    ]),
+    'sales_summary': TableStyle([
+        ('GRID', (0, 0), (-1, -1), 0.5, colors.grey),
+        ('ALIGN', (0, 0), (-1, -1), 'RIGHT'),
+        ('FONTNAME', (0, 0), (-1, -1), 'DejaVuSans'),
+        ('FONTNAME', (0, 0), (0, -1), 'DejaVuSans-Bold'),
+        ('BACKGROUND', (0, 0), (0, 10), colors.yellow),
+        ('FONTSIZE', (0, 0), (-1, -1), 10),
+        ('FONTSIZE', (0, 10), (1, 10), 14),  # Final invoice total
+        ('FONTNAME', (1, 10), (1, 10), 'DejaVuSans-Bold'),
+        ('TEXTCOLOR', (0, -1), (0, -1), colors.black),
+        ('BOTTOMPADDING', (0, -1), (-1, -1), 12),
+    ]),
+    'sales_summary_indent': TableStyle([
+        ('ALIGN', (0, 0), (-1, -1), 'LEFT'),
+        ('LEFTPADDING', (0, 0), (-1, -1), 140),
+    ]),
+    'sales_paid': TableStyle([
+        ('GRID', (0, 0), (-1, -1), 0.5, colors.grey),
+        ('ALIGN', (0, 0), (-1, -1), 'CENTER'),
+        ('FONTNAME', (0, 0), (-1, -1), 'DejaVuSans'),
+        ('BACKGROUND', (0, 0), (1, 0), colors.yellow),
+        ('FONTNAME', (0, -1), (-1, -1), 'DejaVuSans-Bold'),
+        ('TEXTCOLOR', (0, 0), (-1, 0), colors.black),
+        ('FONTSIZE', (0, 0), (-1, -1), 10),
+        ('FONTSIZE', (0, -1), (-1, -1), 12),
+    ]),
+    'sales_payment_summary': TableStyle([
+        ('GRID', (0, 0), (-1, -1), 0.5, colors.grey),
+        ('ALIGN', (0, 0), (-1, -1), 'RIGHT'),
+        ('FONTNAME', (0, 0), (-1, -1), 'DejaVuSans'),
+        ('FONTNAME', (0, -1), (-1, -1), 'DejaVuSans-Bold'),
+        ('BACKGROUND', (0, 0), (-1, 0), colors.yellow),
+        ('TEXTCOLOR', (0, 0), (-1, 0), colors.black),
+        ('FONTSIZE', (0, 0), (-1, -1), 10),
+    ]),
+    # Packaging invoice
+    'packaging_logo': TableStyle([
+        ('VALIGN', (0, 0), (-1, -1), 'LEFT'),
+        ('LEFTPADDING', (0, 0), (-1, -1), -50),
+    ]),
+    'packaging_header': TableStyle([
+        ('FONTNAME', (0, 0), (-1, -1), 'DejaVuSans'),
+        ('FONTSIZE', (0, 0), (-1, 0), 14),
+        ('FONTNAME', (0, 0), (-1, 0), 'DejaVuSans-Bold'),
+        ('ALIGN', (0, 0), (-1, -1), 'LEFT'),
+        ('VALIGN', (0, 0), (-1, -1), 'MIDDLE'),
+    ]),
+    'packaging_details': TableStyle([
+        ('GRID', (0, 0), (-1, -1), 0.5, colors.grey),
+        ('FONTNAME', (0, 0), (-1, 0), 'DejaVuSans-Bold'),
+        ('FONTNAME', (0, 1), (-1, -1), 'DejaVuSans'),
+        ('BACKGROUND', (0, 0), (-1, 0), colors.yellow),
+        ('ALIGN', (0, 0), (-1, -1), 'LEFT'),
+        ('VALIGN', (0, 0), (-1, -1), 'MIDDLE'),
+    ]),
+    # analytics.reports
+    'report': TableStyle([
+        ('BACKGROUND', (0, 0), (-1, 0), colors.lightgreen),
+        ('TEXTCOLOR', (0, 0), (-1, 0), colors.black),
+        ('ALIGN', (0, 0), (-1, -1), 'CENTER'),
+        ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
+        ('BOTTOMPADDING', (0, 0), (-1, 0), 12),
+        ('BACKGROUND', (0, 1), (-1, -1), colors.white),
+        ('GRID', (0, 0), (-1, -1), 1, colors.black),
+    ]),
+}
+
+
+class _Logo:
+    """The bytes of a logo and its decoded pixels"""
+
+    def __init__(self, name, data):
+        self.name = name
+        self.data = data
+        self.reader = ImageReader(BytesIO(data))
+        # Decode now, so every PDF drawing the logo reuses the pixels
+        self.reader.getRGBData()
+
+
+# storage name (or DEFAULT_LOGO): _Logo, or None when it cannot be read
+_logos = {}
+
+
+def _load(name, opener):
+    if name not in _logos:
+        try:
+            with opener() as source:
+                _logos[name] = _Logo(name, source.read())
+        except (OSError, ValueError):
+            _logos[name] = None
+    return _logos[name]
+
+
+def _default_logo():
+    path = finders.find(DEFAULT_LOGO) or os.path.join(settings.STATICFILES_DIRS[0], DEFAULT_LOGO)
+    return _load(DEFAULT_LOGO, lambda: open(path, 'rb'))
+
+
+def tenant_logo_name(tenant_id):
+    """Storage name of the tenant's uploaded logo, or '' when it has none"""
+    from tenants.models import Tenant
+
+    if not tenant_id:
+        return ''
+    return Tenant.objects.filter(pk=tenant_id).values_list('logo', flat=True).first() or ''
+
+
+def logo(tenant_id=None):
+    """The tenant's logo, falling back to the project logo; None when neither can be read"""
+    from django.core.files.storage import default_storage
+
+    name = tenant_logo_name(tenant_id)
+    tenant_logo = _load(name, lambda: default_storage.open(name, 'rb')) if name else None
+    return tenant_logo or _default_logo()
+
+
+class _LogoImage(Flowable):
+    """Flowable drawing a shared ImageReader at a fixed size, like platypus.Image"""
+
+    def __init__(self, reader, width=None, height=None, hAlign='CENTER'):
+        super().__init__()
+        self.reader = reader
+        image_width, image_height = reader.getSize()
+        self.drawWidth = width or image_width
+        self.drawHeight = height or image_height
+        self.hAlign = hAlign
+
+    def wrap(self, availWidth, availHeight):
+        return self.drawWidth, self.drawHeight
+
+    def draw(self):
+        self.canv.drawImage(self.reader, 0, 0, self.drawWidth, self.drawHeight, mask='auto')
+
+
+def logo_image(tenant_id=None, width=None, height=None, hAlign='CENTER'):
+    """Flowable of the logo, or None when there is no logo"""
+    shared = logo(tenant_id)
+    if shared is None:
+        return None
+    return _LogoImage(shared.reader, width=width, height=height, hAlign=hAlign)
+
+
+def logo_data_uri(tenant_id=None):
+    """data: URI of the logo for the xhtml2pdf templates, or '' when there is no logo"""
+    shared = logo(tenant_id)
+    if shared is None:
+        return ''
+    content_type = mimetypes.guess_type(shared.name)[0] or 'image/png'
+    return f"data:{content_type};base64,{base64.b64encode(shared.data).decode('ascii')}"
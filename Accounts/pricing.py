@@ -0,0 +1,132 @@
+"""
+Line total formulas for purchase and sales line items.
+
+Every function takes a whole batch of lines as parallel sequences (one
+value per line) so imports, bulk endpoints and previews can price
+thousands of lines in one call. The ``price_*`` functions return exact
+Decimal results and are what the models store; the ``preview_*``
+functions run the same formulas on NumPy float arrays for fast previews
+and must not be saved.
+"""
+from decimal import Decimal
+
+import numpy as np
+
+LOADING_UNLOADING_RATE = Decimal('0.40')
+MINIMUM_LINE_TOTAL = Decimal('0.01')
+# Lines of this product carry no loading/unloading charge
+NO_LOADING_PRODUCT = 'Rotten'
+
+ZERO = Decimal('0.00')
+HUNDRED = Decimal('100.00')
+
+
+def _decimal(value):
+    if value is None or value == '':
+        return ZERO
+    if isinstance(value, float):
+        return Decimal(str(value))
+    return Decimal(value)
+
+
+def _columns(*columns):
+    columns = [[_decimal(value) for value in column] for column in columns]
+    if len({len(column) for column in columns}) > 1:
+        raise ValueError("All line columns must have the same length")
+    return columns
+
+
+def price_purchase_lines(quantity, price, damage, discount, rotten, product_names=None):
+    """
+    Exact purchase line totals.
+
+    Returns ``(loading_unloading, total)`` as two lists of Decimals:
+    the physical quantity (quantity less damage and rotten, never below
+    zero) times the price, less the discount percentage, less a 0.40 per
+    unit loading/unloading charge on the original quantity. Totals below
+    0.01 are raised to 0.01.
+    """
+    quantity, price, damage, discount, rotten = _columns(quantity, price, damage, discount, rotten)
+    if product_names is None:
+        product_names = [''] * len(quantity)
+    loading_unloading, totals = [], []
+    for qty, unit_price, dmg, disc, rot, name in zip(quantity, price, damage, discount, rotten, product_names):
+        physical_quantity = max(qty - dmg - rot, ZERO)
+        base_price_total = physical_quantity * unit_price
+        price_after_discount = base_price_total - (base_price_total * disc) / 100
+        charge = ZERO if name == NO_LOADING_PRODUCT else qty * LOADING_UNLOADING_RATE
+        total = price_after_discount - charge
+        loading_unloading.append(charge)
+        totals.append(total if total > 0 else MINIMUM_LINE_TOTAL)
+    return loading_unloading, totals
+
+
+def price_sales_lines(gross_weight, discount, rotten, price):
+    """
+    Exact sales line totals.
+
+    Returns ``(net_weight, total)`` as two lists of Decimals: the gross
+    weight less the discount percentage and the rotten weight, times the
+    price.
+    """
+    gross_weight, discount, rotten, price = _columns(gross_weight, discount, rotten, price)
+    net_weights, totals = [], []
+    for gross, disc, rot, unit_price in zip(gross_weight, discount, rotten, price):
+        net_weight = gross - ((gross * disc) / HUNDRED) - rot
+        net_weights.append(net_weight)
+        totals.append(net_weight * unit_price)
+    return net_weights, totals
+
+
+def preview_purchase_lines(quantity, price, damage, discount, rotten, product_names=None):
+    """NumPy version of price_purchase_lines; returns float64 arrays."""
+    quantity, price, damage, discount, rotten = (
+        np.asarray(column, dtype=np.float64) for column in (quantity, price, damage, discount, rotten)
+    )
+    physical_quantity = np.maximum(quantity - damage - rotten, 0.0)
+    base_price_total = physical_quantity * price
+    price_after_discount = base_price_total - base_price_total * discount / 100.0
+    loading_unloading = quantity * float(LOADING_UNLOADING_RATE)
+    if product_names is not None:
+        loading_unloading = np.where(np.asarray(product_names) == NO_LOADING_PRODUCT, 0.0, loading_unloading)
+    total = price_after_discount - loading_unloading
+    return loading_unloading, np.where(total > 0, total, float(MINIMUM_LINE_TOTAL))
+
+
+def preview_sales_lines(gross_weight, discount, rotten, price):
+    """NumPy version of price_sales_lines; returns float64 arrays."""
+    gross_weight, discount, rotten, price = (
+        np.asarray(column, dtype=np.float64) for column in (gross_weight, discount, rotten, price)
+    )
+    net_weight = gross_weight - gross_weight * discount / 100.0 - rotten
+    return net_weight, net_weight * price
+
+
+def price_purchase_products(lines, product_names=None):
+    """Set loading_unloading and total on a batch of PurchaseProduct instances."""
+    loading_unloading, totals = price_purchase_lines(
+        [line.quantity for line in lines],
+        [line.price for line in lines],
+        [line.damage for line in lines],
+        [line.discount for line in lines],
+        [line.rotten for line in lines],
+        product_names,
+    )
+    for line, charge, total in zip(lines, loading_unloading, totals):
+        line.loading_unloading = charge
+        line.total = total
+    return lines
+
+
+def price_sales_products(lines):
+    """Set net_weight and total on a batch of SalesProduct instances."""
+    net_weights, totals = price_sales_lines(
+        [line.gross_weight for line in lines],
+        [line.discount for line in lines],
+        [line.rotten for line in lines],
+        [line.price for line in lines],
+    )
+    for line, net_weight, total in zip(lines, net_weights, totals):
+        line.net_weight = net_weight
+        line.total = total
+    return lines
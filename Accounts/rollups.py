@@ -0,0 +1,145 @@
+"""
+Daily rollups of the trading figures per tenant, day and product.
+
+DailyRollup rows hold the day's purchased and sold quantities, gross
+weight, revenue, cost, payments, expenses and damages. Payments, expenses
+and damages are not tied to a product and go into the row without one.
+Charts and KPIs sum these rows instead of scanning invoices.
+
+The save/delete signals in Accounts/signals.py mark the (tenant, day)
+pairs a change touches; once the transaction commits those days are
+rebuilt from the source rows. ``rebuild`` is also used by the
+``rebuild_rollups`` management command for backfills. Rebuilds of one
+tenant lock its Tenant row, so concurrent rebuilds of the same day run
+one after the other.
+"""
+import threading
+from collections import defaultdict
+from decimal import Decimal
+
+from django.db import transaction
+from django.db.models import Sum
+
+# source model: (day field, tenant field, product field or None, {rollup field: source field})
+SOURCES = {
+    'PurchaseProduct': ('invoice__date', 'invoice__tenant_id', 'product_id', {
+        'purchased_quantity': 'quantity',
+        'cost': 'total',
+    }),
+    'SalesProduct': ('invoice__invoice_date', 'invoice__tenant_id', 'product_id', {
+        'sold_quantity': 'net_weight',
+        'gross_weight': 'gross_weight',
+        'revenue': 'total',
+    }),
+    'Payment': ('date', 'invoice__tenant_id', None, {'payments_made': 'amount'}),
+    'SalesPayment': ('date', 'invoice__tenant_id', None, {'payments_received': 'amount'}),
+    'Expense': ('date', 'tenant_id', None, {'expenses': 'amount'}),
+    'Damages': ('date', 'tenant_id', None, {'damages': 'amount_loss'}),
+}
+
+# (tenant id, day) pairs marked in this thread and not rebuilt yet
+_pending = threading.local()
+
+ROLLUP_FIELDS = (
+    'purchased_quantity', 'sold_quantity', 'gross_weight', 'revenue', 'cost',
+    'payments_received', 'payments_made', 'expenses', 'damages',
+)
+
+
+def _source_rows(model_name, tenant_id, since, until, days):
+    from django.apps import apps
+
+    day_field, tenant_field, product_field, sums = SOURCES[model_name]
+    queryset = _in_range(apps.get_model('Accounts', model_name)._base_manager.all(), day_field, since, until, days)
+    if tenant_id is not None:
+        queryset = queryset.filter(**{tenant_field: tenant_id})
+    keys = [tenant_field, day_field] + ([product_field] if product_field else [])
+    rows = queryset.order_by().values(*keys).annotate(
+        **{f'rollup_{field}': Sum(source) for field, source in sums.items()}
+    )
+    for row in rows:
+        key = (row[tenant_field], row[day_field], row[product_field] if product_field else None)
+        yield key, {field: row[f'rollup_{field}'] or Decimal('0') for field in sums}
+
+
+def _in_range(queryset, day_field, since=None, until=None, days=None):
+    if since:
+        queryset = queryset.filter(**{f'{day_field}__gte': since})
+    if until:
+        queryset = queryset.filter(**{f'{day_field}__lte': until})
+    if days is not None:
+        queryset = queryset.filter(**{f'{day_field}__in': days})
+    return queryset
+
+
+def rebuild(tenant_id=None, since=None, until=None, days=None):
+    """
+    Recompute the rollup rows of one tenant, or of all tenants when
+    ``tenant_id`` is None, for a date range or a list of days. Returns the
+    number of rows written.
+    """
+    from tenants.models import Tenant
+    from .models import DailyRollup
+
+    existing = _in_range(DailyRollup._base_manager.all(), 'date', since, until, days)
+    if tenant_id is not None:
+        existing = existing.filter(tenant_id=tenant_id)
+    with transaction.atomic():
+        if tenant_id is not None:
+            list(Tenant.objects.select_for_update().filter(pk=tenant_id).values_list('pk'))
+        figures = defaultdict(lambda: dict.fromkeys(ROLLUP_FIELDS, Decimal('0')))
+        for model_name in SOURCES:
+            for key, values in _source_rows(model_name, tenant_id, since, until, days):
+                for field, value in values.items():
+                    figures[key][field] += value
+        existing.delete()
+        DailyRollup._base_manager.bulk_create(
+            [
+                DailyRollup(tenant_id=tenant, date=day, product_id=product, **values)
+                for (tenant, day, product), values in figures.items()
+            ],
+            batch_size=500,
+        )
+    return len(figures)
+
+
+def mark_day(tenant_id, day):
+    """Rebuild the tenant's rollups of ``day`` once the current transaction commits."""
+    if day is None:
+        return
+    _pending_days().add((tenant_id, day))
+    # Registered for every mark: Django drops the callbacks of a rolled-back
+    # transaction or savepoint, and the first callback to run flushes them all
+    transaction.on_commit(_flush)
+
+
+def _pending_days():
+    if not hasattr(_pending, 'days'):
+        _pending.days = set()
+    return _pending.days
+
+
+def _flush():
+    """Rebuild the days marked in this thread, including those of rolled-back transactions."""
+    days, _pending.days = _pending_days(), set()
+    by_tenant = defaultdict(set)
+    for tenant_id, day in days:
+        by_tenant[tenant_id].add(day)
+    for tenant_id, tenant_days in by_tenant.items():
+        rebuild(tenant_id, days=sorted(tenant_days))
+
+
+# Invoices whose date is the day of their lines
+INVOICE_DAY_FIELDS = {'PurchaseInvoice': 'date', 'SalesInvoice': 'invoice_date'}
+
+
+def stored_day(model, pk):
+    """(tenant id, day) a stored source row or invoice is rolled up under, or None."""
+    name = model.__name__
+    if pk is None:
+        return None
+    if name in INVOICE_DAY_FIELDS:
+        fields = ('tenant_id', INVOICE_DAY_FIELDS[name])
+    else:
+        fields = SOURCES[name][1], SOURCES[name][0]
+    return model._base_manager.filter(pk=pk).values_list(*fields).first()
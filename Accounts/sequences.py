@@ -0,0 +1,91 @@
+"""
+Per-tenant document number sequences.
+
+Invoice and lot numbers come from a NumberSequence row keyed by
+(tenant, series, year). Numbers are handed out under a row lock, so
+concurrent counters never receive the same number, and a whole block can
+be reserved at once for imports with ``reserve_numbers``.
+"""
+import re
+from datetime import date
+
+from django.db import IntegrityError, transaction
+from django.db.models import F
+
+PURCHASE_INVOICE = 'purchase_invoice'
+LOT = 'lot'
+SALES_INVOICE = 'sales_invoice'
+
+# series: (format, prefix used to seed a new sequence, numbering restarts every year)
+SERIES = {
+    PURCHASE_INVOICE: ('MS{year}R{number:02d}', 'MS{year}R', True),
+    LOT: ('LOT-{number:02d}', 'LOT-', False),
+    SALES_INVOICE: ('SA{year}S{number:02d}', 'SA{year}S', True),
+}
+
+
+def _sequence_year(series, year):
+    if not SERIES[series][2]:
+        return 0
+    return year or date.today().year
+
+
+def format_number(series, number, year=None):
+    return SERIES[series][0].format(year=_sequence_year(series, year), number=number)
+
+
+def reserve(series, tenant_id=None, count=1, year=None):
+    """Reserve ``count`` consecutive numbers and return them as integers."""
+    from .models import NumberSequence
+
+    if count < 1:
+        return []
+    year = _sequence_year(series, year)
+    lookup = {'tenant_id': tenant_id, 'series': series, 'year': year}
+    with transaction.atomic():
+        sequences = NumberSequence.objects.filter(**lookup)
+        # The UPDATE locks the sequence row until the transaction ends, so
+        # concurrent reservations queue up behind each other.
+        if not sequences.update(last_value=F('last_value') + count):
+            try:
+                with transaction.atomic():
+                    NumberSequence.objects.create(
+                        last_value=_highest_existing(series, tenant_id, year), **lookup
+                    )
+            except IntegrityError:
+                # Another transaction created it first
+                pass
+            sequences.update(last_value=F('last_value') + count)
+        last = sequences.values_list('last_value', flat=True).get()
+    return list(range(last - count + 1, last + 1))
+
+
+def reserve_numbers(series, tenant_id=None, count=1, year=None):
+    """Reserve ``count`` numbers and return them formatted for the series."""
+    return [format_number(series, number, year) for number in reserve(series, tenant_id, count, year)]
+
+
+def next_number(series, tenant_id=None, year=None):
+    return reserve_numbers(series, tenant_id, 1, year)[0]
+
+
+def _highest_existing(series, tenant_id, year):
+    """Highest number already issued before the sequence existed, so numbering carries on from it."""
+    from .models import PurchaseInvoice, SalesInvoice
+
+    model, field = {
+        PURCHASE_INVOICE: (PurchaseInvoice, 'invoice_number'),
+        LOT: (PurchaseInvoice, 'lot_number'),
+        SALES_INVOICE: (SalesInvoice, 'invoice_number'),
+    }[series]
+    prefix = SERIES[series][1].format(year=year)
+    numbers = model._base_manager.filter(
+        tenant_id=tenant_id, **{f'{field}__startswith': prefix}
+    ).values_list(field, flat=True)
+    pattern = re.compile(re.escape(prefix) + r'(\d+)$')
+    highest = 0
+    for number in numbers.iterator():
+        match = pattern.match(number)
+        if match:
+            highest = max(highest, int(match.group(1)))
+    return highest
@@ -0,0 +1,122 @@
+from django.db.models.signals import post_delete, post_save, pre_delete, pre_save
+from django.dispatch import receiver
+from .models import (
+    Customer, Damages, Expense, Packaging_Invoice, Payment, PurchaseInvoice, PurchaseProduct, PurchaseVendor,
+    SalesInvoice, SalesLot, SalesPayment, SalesProduct,
+)
+from . import dashboard, ledger, pdf_cache, rollups, totals
+
+
+@receiver(post_delete, sender=PurchaseProduct)
+@receiver(post_delete, sender=Payment)
+@receiver(post_delete, sender=SalesProduct)
+@receiver(post_delete, sender=SalesPayment)
+def remove_from_invoice_totals(sender, instance, **kwargs):
+    """
+    Take a deleted line item or payment out of its invoice's stored totals
+    """
+    totals.apply_change(instance, getattr(instance, '_loaded_totals', None), deleted=True)
+
+
+@receiver(post_delete, sender=SalesInvoice)
+@receiver(post_delete, sender=PurchaseInvoice)
+def remove_from_party_balance(sender, instance, **kwargs):
+    """
+    Drop a deleted invoice's due amount from its customer or vendor balance
+    """
+    kind = 'customer' if sender is SalesInvoice else 'vendor'
+    # The party itself may be part of the same delete, so never create a balance here
+    ledger.refresh_balance(kind, instance.vendor_id, create=False)
+
+
+# Rows the dashboard snapshots are computed from; line items and payments
+# belong to the tenant of their invoice.
+DASHBOARD_SOURCES = (
+    Customer, Damages, Expense, Packaging_Invoice, PurchaseInvoice, PurchaseVendor, SalesInvoice, SalesLot,
+)
+DASHBOARD_LINE_SOURCES = (Payment, PurchaseProduct, SalesPayment, SalesProduct)
+
+
+def invalidate_dashboard(sender, instance, **kwargs):
+    """
+    Make the cached dashboard figures of the row's tenant stale
+    """
+    if sender in DASHBOARD_LINE_SOURCES:
+        invoice_model = sender._meta.get_field('invoice').related_model
+        tenant_id = invoice_model.objects.filter(pk=instance.invoice_id).values_list('tenant_id', flat=True).first()
+    else:
+        tenant_id = instance.tenant_id
+    dashboard.invalidate(tenant_id)
+
+
+for model in DASHBOARD_SOURCES + DASHBOARD_LINE_SOURCES:
+    post_save.connect(invalidate_dashboard, sender=model, dispatch_uid=f'dashboard-{model.__name__}-save')
+    post_delete.connect(invalidate_dashboard, sender=model, dispatch_uid=f'dashboard-{model.__name__}-delete')
+
+
+# Rows the daily rollups are built from, and the invoices that date their lines
+ROLLUP_SOURCES = (Damages, Expense, Payment, PurchaseProduct, SalesPayment, SalesProduct)
+ROLLUP_INVOICES = (PurchaseInvoice, SalesInvoice)
+
+
+def remember_rollup_day(sender, instance, **kwargs):
+    """
+    Note the day a row is rolled up under before it changes or goes away
+    """
+    instance._rollup_day = rollups.stored_day(sender, instance.pk)
+    if kwargs.get('signal') is pre_delete and instance._rollup_day:
+        rollups.mark_day(*instance._rollup_day)
+
+
+def mark_rollup_days(sender, instance, **kwargs):
+    """
+    Rebuild the days a saved row left and entered once the transaction commits
+    """
+    previous = getattr(instance, '_rollup_day', None)
+    if sender in ROLLUP_INVOICES:
+        current = (instance.tenant_id, getattr(instance, rollups.INVOICE_DAY_FIELDS[sender.__name__]))
+        # Only a new date moves the invoice's lines; they mark their own days
+        if previous is None or previous == current:
+            return
+    else:
+        current = rollups.stored_day(sender, instance.pk)
+    for day in {previous, current} - {None}:
+        rollups.mark_day(*day)
+
+
+for model in ROLLUP_SOURCES + ROLLUP_INVOICES:
+    pre_save.connect(remember_rollup_day, sender=model, dispatch_uid=f'rollup-{model.__name__}-pre-save')
+    post_save.connect(mark_rollup_days, sender=model, dispatch_uid=f'rollup-{model.__name__}-save')
+    pre_delete.connect(remember_rollup_day, sender=model, dispatch_uid=f'rollup-{model.__name__}-delete')
+
+
+# Invoices with cached PDFs, and the rows printed on them
+PDF_INVOICES = {
+    PurchaseInvoice: pdf_cache.PURCHASE_INVOICE,
+    SalesInvoice: pdf_cache.SALES_INVOICE,
+    Packaging_Invoice: pdf_cache.PACKAGING_INVOICE,
+}
+# model: (kind, field of the invoice the row is printed on)
+PDF_LINES = {
+    PurchaseProduct: (pdf_cache.PURCHASE_INVOICE, 'invoice_id'),
+    Payment: (pdf_cache.PURCHASE_INVOICE, 'invoice_id'),
+    SalesProduct: (pdf_cache.SALES_INVOICE, 'invoice_id'),
+    SalesPayment: (pdf_cache.SALES_INVOICE, 'invoice_id'),
+    SalesLot: (pdf_cache.SALES_INVOICE, 'sales_invoice_id'),
+}
+
+
+def invalidate_invoice_pdfs(sender, instance, **kwargs):
+    """
+    Remove the cached PDFs of the changed invoice once the transaction commits
+    """
+    if sender in PDF_INVOICES:
+        pdf_cache.invalidate(PDF_INVOICES[sender], instance.pk)
+    else:
+        kind, invoice_field = PDF_LINES[sender]
+        pdf_cache.invalidate(kind, getattr(instance, invoice_field))
+
+
+for model in list(PDF_INVOICES) + list(PDF_LINES):
+    post_save.connect(invalidate_invoice_pdfs, sender=model, dispatch_uid=f'pdf-{model.__name__}-save')
+    post_delete.connect(invalidate_invoice_pdfs, sender=model, dispatch_uid=f'pdf-{model.__name__}-delete')
@@ -0,0 +1,110 @@
+"""
+Per-party purchase and sales summaries with keyset pagination.
+
+The vendor and customer summary pages annotate each party with its totals
+in one grouped query over the stored invoice totals columns, so sorting
+and filtering on the dues happen in SQL. Pages are cut with a keyset
+cursor (the sort value and id of the last row shown) instead of OFFSET,
+which keeps deep pages as cheap as the first one.
+"""
+import base64
+import json
+from decimal import Decimal, InvalidOperation
+
+from django.db.models import F, Q, Sum, Value, DecimalField
+from django.db.models.functions import Coalesce
+
+MONEY = DecimalField(max_digits=14, decimal_places=2)
+PAGE_SIZE = 50
+
+
+def _sum(path, dates):
+    return Coalesce(Sum(path, filter=dates or None), Value(Decimal('0.00')), output_field=MONEY)
+
+
+def _dates(field, from_date, to_date):
+    dates = Q()
+    if from_date:
+        dates &= Q(**{f'{field}__gte': from_date})
+    if to_date:
+        dates &= Q(**{f'{field}__lte': to_date})
+    return dates
+
+
+def vendor_totals(queryset, from_date=None, to_date=None):
+    """Annotate vendors with total_purchases, total_payments, total_cash_cutting and due_amount."""
+    dates = _dates('invoices__date', from_date, to_date)
+    return queryset.annotate(
+        total_purchases=_sum('invoices__net_total', dates),
+        total_payments=_sum('invoices__paid_amount', dates),
+        due_amount=_sum('invoices__due_amount', dates),
+    ).annotate(
+        # The stored due amount is the net total less cash cutting and payments
+        total_cash_cutting=F('total_purchases') - F('total_payments') - F('due_amount'),
+    )
+
+
+def customer_totals(queryset, from_date=None, to_date=None):
+    """Annotate customers with total_sales, total_payments and due_amount."""
+    dates = _dates('sales_invoices__invoice_date', from_date, to_date)
+    return queryset.annotate(
+        total_payments=_sum('sales_invoices__paid_amount', dates),
+        due_amount=_sum('sales_invoices__due_amount', dates),
+    ).annotate(
+        # The stored due amount is the final invoice total less payments
+        total_sales=F('due_amount') + F('total_payments'),
+    )
+
+
+def filter_dues(queryset, min_due=None, max_due=None):
+    if min_due is not None:
+        queryset = queryset.filter(due_amount__gte=min_due)
+    if max_due is not None:
+        queryset = queryset.filter(due_amount__lte=max_due)
+    return queryset
+
+
+def parse_amount(value):
+    try:
+        return Decimal(value) if value not in (None, '') else None
+    except InvalidOperation:
+        return None
+
+
+def encode_cursor(value, pk):
+    return base64.urlsafe_b64encode(json.dumps([str(value), pk]).encode()).decode()
+
+
+def decode_cursor(cursor):
+    try:
+        value, pk = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        return str(value), int(pk)
+    except (ValueError, TypeError):
+        return None
+
+
+def keyset_page(queryset, field, descending=False, cursor=None, page_size=PAGE_SIZE):
+    """
+    One page of ``queryset`` ordered by ``field`` and then id.
+
+    Returns the rows and the cursor of the next page (None on the last
+    page). An invalid cursor starts from the first page.
+    """
+    after = decode_cursor(cursor) if cursor else None
+    if after:
+        value, pk = after
+        if field != 'name':
+            value = parse_amount(value)
+    if after and value is not None:
+        beyond = 'lt' if descending else 'gt'
+        queryset = queryset.filter(
+            Q(**{f'{field}__{beyond}': value}) | Q(**{field: value, f'pk__{beyond}': pk})
+        )
+    ordering = [f'-{field}', '-pk'] if descending else [field, 'pk']
+    rows = list(queryset.order_by(*ordering)[:page_size + 1])
+    next_cursor = None
+    if len(rows) > page_size:
+        rows = rows[:page_size]
+        last = rows[-1]
+        next_cursor = encode_cursor(getattr(last, field), last.pk)
+    return rows, next_cursor
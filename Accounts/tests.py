@@ -1,3 +1,590 @@
-from django.test import TestCase
+import shutil
+import tempfile
+from datetime import date, timedelta
+from decimal import Decimal
+from unittest import mock
 
-# Create your tests here.
+from django.core.exceptions import ValidationError
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.db import transaction
+from django.db.models.signals import post_save
+from django.test import TestCase, override_settings
+from django.utils import timezone
+from tenants.models import Tenant
+
+from . import allocation, import_jobs, imports, ledger, payments, pdf_cache, rollups, sequences, totals
+from .models import (
+    Customer, CustomerBalance, DailyRollup, ImportJob, NumberSequence, Payment, Product, PurchaseInvoice,
+    PurchaseProduct, PurchaseVendor, SalesInvoice, SalesLot, SalesPayment, SalesProduct, VendorBalance,
+)
+
+
+def make_tenant(slug):
+    # Tenant.save() and the tenants post_save signal both create the tenant's settings
+    Tenant.objects.bulk_create([Tenant(name=slug.upper(), slug=slug)])
+    return Tenant.objects.get(slug=slug)
+
+
+class AccountsTestCase(TestCase):
+    """A tenant with a vendor, a customer and a product."""
+
+    def setUp(self):
+        self.tenant = make_tenant('t1')
+        self.vendor = PurchaseVendor.objects.create(tenant=self.tenant, name='Vendor', contact_number='1', area='A')
+        self.customer = Customer.objects.create(tenant=self.tenant, name='Customer')
+        self.product = Product.objects.create(tenant=self.tenant, name='Alphonso')
+
+    def purchase_invoice(self, **fields):
+        return PurchaseInvoice.objects.create(tenant=self.tenant, vendor=self.vendor, **fields)
+
+    def lot(self, quantity, price='10', **fields):
+        invoice = self.purchase_invoice(**fields)
+        PurchaseProduct.objects.create(
+            invoice=invoice, product=self.product, quantity=Decimal(quantity), price=Decimal(price)
+        )
+        return invoice
+
+    def sales_invoice(self, **fields):
+        return SalesInvoice.objects.create(tenant=self.tenant, vendor=self.customer, **fields)
+
+
+class NumberSequenceTests(AccountsTestCase):
+    def test_numbers_follow_on_from_existing_invoices(self):
+        self.purchase_invoice(invoice_number='MS2024R07', lot_number='LOT-12', date=date(2024, 3, 1))
+
+        self.assertEqual(sequences.next_number(sequences.PURCHASE_INVOICE, self.tenant.pk, 2024), 'MS2024R08')
+        self.assertEqual(sequences.next_number(sequences.LOT, self.tenant.pk), 'LOT-13')
+        # Another year's invoice numbers start over
+        self.assertEqual(sequences.next_number(sequences.PURCHASE_INVOICE, self.tenant.pk, 2025), 'MS2025R01')
+
+    def test_seeding_compares_numbers_not_strings(self):
+        self.sales_invoice(invoice_number='SA2024S99', invoice_date=date(2024, 1, 1))
+        self.sales_invoice(invoice_number='SA2024S100', invoice_date=date(2024, 1, 2))
+
+        self.assertEqual(sequences.next_number(sequences.SALES_INVOICE, self.tenant.pk, 2024), 'SA2024S101')
+
+    def test_numbers_grow_past_99(self):
+        NumberSequence.objects.create(tenant=self.tenant, series=sequences.LOT, year=0, last_value=98)
+
+        self.assertEqual(sequences.reserve_numbers(sequences.LOT, self.tenant.pk, 3), ['LOT-99', 'LOT-100', 'LOT-101'])
+        self.assertEqual(sequences.next_number(sequences.LOT, self.tenant.pk), 'LOT-102')
+
+    def test_reserved_blocks_do_not_overlap(self):
+        first = sequences.reserve(sequences.LOT, self.tenant.pk, 5)
+        second = sequences.reserve(sequences.LOT, self.tenant.pk, 2)
+
+        self.assertEqual(first, [1, 2, 3, 4, 5])
+        self.assertEqual(second, [6, 7])
+
+    def test_tenants_have_their_own_sequences(self):
+        other = make_tenant('t2')
+        self.purchase_invoice(lot_number='LOT-40')
+
+        self.assertEqual(sequences.next_number(sequences.LOT, other.pk), 'LOT-01')
+        self.assertEqual(sequences.next_number(sequences.LOT, self.tenant.pk), 'LOT-41')
+
+    def test_new_invoices_take_the_next_numbers(self):
+        first = self.purchase_invoice(date=date(2024, 5, 1))
+        second = self.purchase_invoice(date=date(2024, 5, 2))
+
+        self.assertEqual((first.invoice_number, first.lot_number), ('MS2024R01', 'LOT-01'))
+        self.assertEqual((second.invoice_number, second.lot_number), ('MS2024R02', 'LOT-02'))
+
+
+class AllocationTests(AccountsTestCase):
+    def setUp(self):
+        super().setUp()
+        self.older = self.lot('30', date=date(2024, 4, 1), best_before=date(2024, 4, 20))
+        self.newer = self.lot('50', date=date(2024, 4, 5), best_before=date(2024, 4, 10))
+        self.sale = self.sales_invoice()
+
+    def allocated(self):
+        return dict(SalesLot.objects.filter(sales_invoice=self.sale).values_list('purchase_invoice_id', 'quantity'))
+
+    def test_fifo_takes_the_oldest_lot_first(self):
+        allocation.allocate(self.tenant, self.product, '40', self.sale)
+
+        self.assertEqual(self.allocated(), {self.older.pk: Decimal('30'), self.newer.pk: Decimal('10')})
+
+    def test_fefo_takes_the_earliest_best_before_first(self):
+        allocation.allocate(self.tenant, self.product, '40', self.sale, strategy=allocation.FEFO)
+
+        self.assertEqual(self.allocated(), {self.newer.pk: Decimal('40')})
+
+    def test_refuses_to_oversell(self):
+        with self.assertRaisesMessage(ValidationError, 'Only 80kg available'):
+            allocation.allocate(self.tenant, self.product, '81', self.sale)
+
+        self.assertFalse(SalesLot.objects.exists())
+
+    def test_allocated_quantity_is_no_longer_available(self):
+        allocation.allocate(self.tenant, self.product, '70', self.sale)
+        other_sale = self.sales_invoice()
+
+        with self.assertRaises(ValidationError):
+            allocation.allocate(self.tenant, self.product, '11', other_sale)
+        allocation.allocate(self.tenant, self.product, '10', self.sale)
+
+        self.assertEqual(self.allocated(), {self.older.pk: Decimal('30'), self.newer.pk: Decimal('50')})
+        self.assertFalse(allocation.available_lots(self.tenant, self.product).exists())
+
+    def test_other_tenants_lots_are_not_used(self):
+        other = make_tenant('t2')
+
+        with self.assertRaises(ValidationError):
+            allocation.allocate(other, self.product, '1', self.sale)
+
+
+class PdfFingerprintTests(AccountsTestCase):
+    def test_sales_pdf_follows_its_lots(self):
+        lot = self.lot('30', lot_number='LOT-07')
+        sale = self.sales_invoice()
+        fingerprints = [pdf_cache.fingerprint(pdf_cache.SALES_INVOICE, sale)]
+
+        allocation.allocate(self.tenant, self.product, '10', sale)
+        fingerprints.append(pdf_cache.fingerprint(pdf_cache.SALES_INVOICE, sale))
+        # The PDF prints the lot numbers of the lots sold from
+        PurchaseInvoice.objects.filter(pk=lot.pk).update(lot_number='LOT-08')
+        fingerprints.append(pdf_cache.fingerprint(pdf_cache.SALES_INVOICE, sale))
+        SalesLot.objects.filter(sales_invoice=sale).delete()
+        fingerprints.append(pdf_cache.fingerprint(pdf_cache.SALES_INVOICE, sale))
+
+        self.assertEqual(len(set(fingerprints[:3])), 3)
+        # Without lots the invoice prints as it did before the allocation
+        self.assertEqual(fingerprints[3], fingerprints[0])
+
+
+class RollupTests(AccountsTestCase):
+    day = date(2024, 8, 1)
+
+    def figures(self):
+        return {
+            row.pop('product'): row
+            for row in DailyRollup.objects.filter(tenant=self.tenant, date=self.day).values(
+                'product', 'purchased_quantity', 'cost', 'sold_quantity', 'revenue', 'payments_made',
+                'payments_received',
+            )
+        }
+
+    def test_saves_rebuild_the_days_they_touch(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            lot = self.lot('40', price='20', date=self.day)
+            Payment.objects.create(invoice=lot, amount=Decimal('300'), date=self.day)
+            sale = self.sales_invoice(invoice_date=self.day)
+            SalesProduct.objects.create(
+                invoice=sale, product=self.product, gross_weight=Decimal('10'), price=Decimal('50')
+            )
+            SalesPayment.objects.create(invoice=sale, amount=Decimal('100'), date=self.day)
+        line = lot.purchase_products.get()
+        sold = sale.sales_products.get()
+
+        figures = self.figures()
+        self.assertEqual(
+            (figures[self.product.pk]['purchased_quantity'], figures[self.product.pk]['cost']),
+            (Decimal('40'), line.total),
+        )
+        self.assertEqual(
+            (figures[self.product.pk]['sold_quantity'], figures[self.product.pk]['revenue']),
+            (sold.net_weight, sold.total),
+        )
+        self.assertEqual(
+            (figures[None]['payments_made'], figures[None]['payments_received']), (Decimal('300'), Decimal('100'))
+        )
+
+        # A full rebuild writes the same rows
+        DailyRollup.objects.all().delete()
+        self.assertEqual(rollups.rebuild(self.tenant.pk), 2)
+        self.assertEqual(self.figures(), figures)
+
+    def test_a_rolled_back_savepoint_does_not_drop_later_marks(self):
+        lot = self.lot('40', date=self.day)
+        with self.captureOnCommitCallbacks(execute=True):
+            try:
+                with transaction.atomic():
+                    # The first mark of the day; its callback goes with the savepoint
+                    Payment.objects.create(invoice=lot, amount=Decimal('50'), date=self.day)
+                    raise ValueError
+            except ValueError:
+                pass
+            Payment.objects.create(invoice=lot, amount=Decimal('70'), date=self.day)
+
+        self.assertEqual(self.figures()[None]['payments_made'], Decimal('70'))
+
+
+class AllocatePaymentTests(AccountsTestCase):
+    def setUp(self):
+        super().setUp()
+        # Packaging charges alone make up the due amounts
+        self.middle = self.sales_invoice(invoice_date=date(2024, 6, 2), no_of_crates=2, cost_per_crate=Decimal('100'))
+        self.oldest = self.sales_invoice(invoice_date=date(2024, 6, 1), no_of_crates=1, cost_per_crate=Decimal('100'))
+        self.newest = self.sales_invoice(invoice_date=date(2024, 6, 3), no_of_crates=3, cost_per_crate=Decimal('100'))
+
+    def due_amounts(self):
+        return [
+            SalesInvoice.objects.get(pk=invoice.pk).due_amount
+            for invoice in (self.oldest, self.middle, self.newest)
+        ]
+
+    def balance(self):
+        return CustomerBalance.objects.get(customer=self.customer).total_due
+
+    def test_pays_the_oldest_invoice_first(self):
+        self.assertEqual(self.balance(), Decimal('600'))
+
+        report = payments.allocate_payment(self.customer, '250', payment_date=date(2024, 6, 10))
+
+        self.assertEqual(
+            [(entry['invoice_id'], entry['paid']) for entry in report['invoices']],
+            [(self.oldest.pk, Decimal('100')), (self.middle.pk, Decimal('150'))],
+        )
+        self.assertEqual((report['allocated'], report['unallocated']), (Decimal('250'), Decimal('0')))
+        self.assertEqual(self.due_amounts(), [Decimal('0'), Decimal('50'), Decimal('300')])
+        self.assertEqual(self.balance(), Decimal('350'))
+
+    def test_reports_the_amount_left_over(self):
+        report = payments.allocate_payment(self.customer, '700')
+
+        self.assertEqual((report['allocated'], report['unallocated']), (Decimal('600'), Decimal('100')))
+        self.assertEqual(len(report['payments']), 3)
+        self.assertEqual(self.due_amounts(), [Decimal('0')] * 3)
+        self.assertEqual(self.balance(), Decimal('0'))
+        with self.assertRaisesMessage(ValidationError, 'No outstanding invoices'):
+            payments.allocate_payment(self.customer, '1')
+
+    def test_vendor_payments_send_their_save_signals(self):
+        # The payment notifications are post_save receivers
+        saved = []
+
+        def receiver(sender, instance, created, **kwargs):
+            saved.append((instance.invoice_id, instance.amount, created))
+
+        older = self.lot('10', price='100', date=date(2024, 6, 1))
+        newer = self.lot('10', price='100', date=date(2024, 6, 2))
+        post_save.connect(receiver, sender=Payment)
+        try:
+            report = payments.allocate_payment(self.vendor, '1000000')
+        finally:
+            post_save.disconnect(receiver, sender=Payment)
+
+        self.assertEqual(saved, [(payment.invoice_id, payment.amount, True) for payment in report['payments']])
+        self.assertEqual([invoice_id for invoice_id, _, _ in saved], [older.pk, newer.pk])
+        self.assertEqual(
+            list(PurchaseInvoice.objects.order_by('pk').values_list('due_amount', flat=True)),
+            [Decimal('0'), Decimal('0')],
+        )
+
+    def test_pays_only_the_chosen_invoices(self):
+        report = payments.allocate_payment(self.customer, '500', invoice_ids=[self.newest.pk])
+
+        self.assertEqual(report['unallocated'], Decimal('200'))
+        self.assertEqual(self.due_amounts(), [Decimal('100'), Decimal('200'), Decimal('0')])
+
+
+class StoredTotalsTests(AccountsTestCase):
+    def assertSalesTotalsMatchAnnotations(self, invoice):
+        invoice = SalesInvoice.objects.with_totals().get(pk=invoice.pk)
+        self.assertEqual(
+            (invoice.net_total, invoice.total_gross_weight, invoice.paid_amount, invoice.due_amount,
+             invoice.payment_status),
+            (invoice.annotated_net_total, invoice.annotated_total_gross_weight, invoice.annotated_paid_amount,
+             invoice.annotated_due_amount, invoice.annotated_payment_status),
+        )
+        self.assertEqual(totals.recompute_sales_invoices(SalesInvoice.objects.all()), 0)
+        return invoice
+
+    def assertPurchaseTotalsMatchAnnotations(self, invoice):
+        invoice = PurchaseInvoice.objects.with_financials().get(pk=invoice.pk)
+        self.assertEqual(
+            (invoice.net_total, invoice.total_quantity, invoice.paid_amount, invoice.due_amount),
+            (invoice.annotated_line_total, invoice.annotated_purchased_quantity, invoice.annotated_paid_amount,
+             invoice.annotated_due_amount),
+        )
+        self.assertEqual(totals.recompute_purchase_invoices(PurchaseInvoice.objects.all()), 0)
+        return invoice
+
+    def balances(self):
+        # A party without invoices may have no balance row yet
+        return (
+            CustomerBalance.objects.get_or_create(customer=self.customer, tenant=self.tenant)[0].total_due,
+            VendorBalance.objects.get_or_create(vendor=self.vendor, tenant=self.tenant)[0].total_due,
+        )
+
+    def assertBalancesMatchRebuild(self):
+        stored = self.balances()
+        ledger.rebuild_balances()
+        self.assertEqual(stored, self.balances())
+
+    def test_sales_totals_follow_line_and_payment_changes(self):
+        invoice = self.sales_invoice(no_of_crates=2, cost_per_crate=Decimal('25'))
+        line = SalesProduct.objects.create(
+            invoice=invoice, product=self.product, gross_weight=Decimal('100'), price=Decimal('40')
+        )
+        payment = SalesPayment.objects.create(invoice=invoice, amount=Decimal('500'))
+        self.assertSalesTotalsMatchAnnotations(invoice)
+
+        line.gross_weight = Decimal('120')
+        line.save()
+        payment.amount = Decimal('800')
+        payment.save()
+        invoice.refresh_from_db()
+        invoice.cost_per_crate = Decimal('30')
+        invoice.save()
+        self.assertSalesTotalsMatchAnnotations(invoice)
+
+        payment.delete()
+        self.assertSalesTotalsMatchAnnotations(invoice)
+        line.delete()
+        invoice = self.assertSalesTotalsMatchAnnotations(invoice)
+        self.assertEqual(invoice.due_amount, Decimal('60'))
+        self.assertBalancesMatchRebuild()
+
+    def test_purchase_totals_follow_line_and_payment_changes(self):
+        invoice = self.lot('100', price='50')
+        line = invoice.purchase_products.get()
+        payment = Payment.objects.create(invoice=invoice, amount=Decimal('1000'))
+        self.assertPurchaseTotalsMatchAnnotations(invoice)
+        self.assertBalancesMatchRebuild()
+
+        line.quantity = Decimal('80')
+        line.save()
+        due = self.assertPurchaseTotalsMatchAnnotations(invoice).due_amount
+        payment.amount += due
+        payment.save()
+        invoice = self.assertPurchaseTotalsMatchAnnotations(invoice)
+        self.assertEqual((invoice.due_amount, invoice.payment_status), (Decimal('0'), 'Paid'))
+
+        payment.delete()
+        self.assertPurchaseTotalsMatchAnnotations(invoice)
+        line.delete()
+        invoice = self.assertPurchaseTotalsMatchAnnotations(invoice)
+        self.assertEqual((invoice.net_total, invoice.paid_amount, invoice.due_amount), (0, 0, 0))
+        self.assertBalancesMatchRebuild()
+
+
+class ImportTestCase(AccountsTestCase):
+    headers = ['invoice_number', 'lot_number', 'date', 'vendor_id', 'product_name', 'quantity', 'price', 'paid_amount']
+
+    def purchase_row(self, invoice_number, quantity='100', price='50', paid=''):
+        return [invoice_number, f'L-{invoice_number}', '2024-07-01', str(self.vendor.pk), 'Alphonso', quantity, price, paid]
+
+    def import_purchases(self, *rows, **options):
+        return imports.run(imports.PurchaseInvoiceCSVFormat(self.headers), list(rows), self.tenant.pk, **options)
+
+
+class ImportTests(ImportTestCase):
+    def test_needs_a_tenant(self):
+        with self.assertRaisesMessage(ValueError, 'An import needs a tenant'):
+            imports.run(imports.PurchaseInvoiceCSVFormat(self.headers), [self.purchase_row('P1')], None)
+
+        self.assertFalse(PurchaseInvoice.objects.exists())
+
+    def test_imports_lines_and_payments(self):
+        result = self.import_purchases(self.purchase_row('P1', paid='1000'), self.purchase_row('P1', quantity='20'))
+
+        self.assertEqual(result.as_tuple(), (2, 0, []))
+        invoice = PurchaseInvoice.objects.get(invoice_number='P1')
+        self.assertEqual((invoice.tenant_id, invoice.vendor_id), (self.tenant.pk, self.vendor.pk))
+        self.assertEqual(invoice.purchase_products.count(), 2)
+        self.assertEqual(invoice.payments.get().amount, Decimal('1000'))
+        self.assertEqual(totals.recompute_purchase_invoices(PurchaseInvoice.objects.all()), 0)
+
+    def test_refuses_payments_above_the_net_total(self):
+        result = self.import_purchases(self.purchase_row('P1', paid='5000'))
+
+        self.assertEqual(result.error_count, 1)
+        self.assertIn('Total payment cannot exceed the net total after 2% cash cutting', result.error_messages[0])
+        self.assertFalse(Payment.objects.exists())
+
+    def test_refuses_payments_adding_up_above_the_net_total(self):
+        result = self.import_purchases(
+            self.purchase_row('P1', paid='4000'), self.purchase_row('P1', quantity='0', price='0', paid='1000'),
+            chunk_size=1,
+        )
+
+        self.assertEqual((result.success_count, result.error_count), (1, 1))
+        self.assertTrue(result.error_messages[0].startswith('Row 2: Total payment cannot exceed'))
+        self.assertEqual(list(Payment.objects.values_list('amount', flat=True)), [Decimal('4000')])
+
+    def test_dry_run_validates_without_writing(self):
+        result = self.import_purchases(self.purchase_row('P1', paid='5000'), self.purchase_row('P2'), dry_run=True)
+
+        self.assertEqual((result.success_count, result.error_count), (1, 1))
+        self.assertFalse(PurchaseInvoice.objects.exists())
+
+
+class NamedFormatImportTests(ImportTestCase):
+    """The layouts of the import_purchase_csv and import_sales_csv commands."""
+    purchase_headers = ['invoice_number', 'lot_number', 'vendor_name', 'date', 'net_total', 'paid_amount']
+    sales_headers = ['invoice_number', 'customer_name', 'invoice_date', 'net_total', 'paid_amount']
+
+    def import_purchase_history(self, *rows):
+        return imports.run(imports.PurchaseInvoiceNamedCSVFormat(self.purchase_headers), list(rows), self.tenant.pk)
+
+    def test_purchase_history_keeps_its_net_total(self):
+        self.import_purchase_history(['H1', 'LOT-H1', 'Old Vendor', '2023-01-05', '5000', '1000'])
+
+        invoice = PurchaseInvoice.objects.get(invoice_number='H1')
+        self.assertEqual(invoice.vendor.name, 'Old Vendor')
+        self.assertEqual(
+            (invoice.net_total, invoice.paid_amount, invoice.due_amount, invoice.payment_status),
+            (Decimal('5000'), Decimal('1000'), Decimal('3900'), 'Partial'),
+        )
+        self.assertEqual(totals.recompute_purchase_invoices(PurchaseInvoice.objects.all()), 0)
+
+        # Once the invoice has lines they make up its net total
+        PurchaseProduct.objects.create(
+            invoice=invoice, product=self.product, quantity=Decimal('10'), price=Decimal('10')
+        )
+        invoice.refresh_from_db()
+        self.assertEqual(invoice.net_total, invoice.purchase_products.get().total)
+        self.assertEqual(totals.recompute_purchase_invoices(PurchaseInvoice.objects.all()), 0)
+
+    def test_purchase_history_payments_are_limited_by_its_net_total(self):
+        result = self.import_purchase_history(['H1', 'LOT-H1', 'Old Vendor', '2023-01-05', '1000', '990'])
+
+        self.assertIn('Total payment cannot exceed', result.error_messages[0])
+        self.assertFalse(PurchaseInvoice.objects.exists())
+
+    def test_sales_history_finds_its_customer_by_name(self):
+        rows = [['S1', 'Customer', '2023-02-01', '0', '0'], ['S2', 'New Customer', '2023-02-02', '0', '0']]
+        imports.run(imports.SalesInvoiceNamedCSVFormat(self.sales_headers), rows, self.tenant.pk)
+
+        self.assertEqual(
+            dict(SalesInvoice.objects.values_list('invoice_number', 'vendor__name')),
+            {'S1': 'Customer', 'S2': 'New Customer'},
+        )
+        self.assertEqual(SalesInvoice.objects.get(invoice_number='S1').vendor, self.customer)
+
+
+class ImportJobTests(ImportTestCase):
+    def setUp(self):
+        super().setUp()
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root)
+        media = override_settings(MEDIA_ROOT=media_root)
+        media.enable()
+        self.addCleanup(media.disable)
+
+    def enqueue(self, *rows):
+        content = '\n'.join(','.join(row) for row in [self.headers, *rows]).encode()
+        return import_jobs.enqueue(SimpleUploadedFile('purchases.csv', content), 'purchase_csv', self.tenant.pk)
+
+    def test_an_interrupted_job_resumes_from_its_checkpoint(self):
+        job = self.enqueue(self.purchase_row('P1'), self.purchase_row('P1', quantity='20'), self.purchase_row('P2'))
+        import_rows = imports.import_rows
+
+        def interrupted(*args, **kwargs):
+            # The worker dies while writing the second chunk
+            if interrupted.calls:
+                raise KeyboardInterrupt
+            interrupted.calls += 1
+            return import_rows(*args, **kwargs)
+
+        interrupted.calls = 0
+        with mock.patch.object(imports, 'import_rows', interrupted), self.assertRaises(KeyboardInterrupt):
+            import_jobs.process(import_jobs.claim(), chunk_size=1)
+
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.rows_done, job.success_count), (ImportJob.RUNNING, 1, 1))
+        # Not taken over while its heartbeat is fresh
+        self.assertIsNone(import_jobs.claim())
+
+        ImportJob._base_manager.filter(pk=job.pk).update(heartbeat_at=timezone.now() - import_jobs.STALE_AFTER * 2)
+        resumed = import_jobs.claim()
+        self.assertEqual(resumed.pk, job.pk)
+        import_jobs.process(resumed, chunk_size=1)
+
+        self.assertEqual((resumed.status, resumed.rows_done, resumed.success_count), (ImportJob.DONE, 3, 3))
+        self.assertEqual(
+            list(PurchaseProduct.objects.order_by('pk').values_list('invoice__invoice_number', 'serial_number')),
+            [('P1', 1), ('P1', 2), ('P2', 1)],
+        )
+
+    def test_a_chunk_outlasting_its_lease_is_rolled_back(self):
+        job = self.enqueue(self.purchase_row('P1'), self.purchase_row('P2'))
+        first = import_jobs.claim()
+        # The first worker's chunk runs past STALE_AFTER, and another worker takes the job meanwhile
+        ImportJob._base_manager.filter(pk=job.pk).update(heartbeat_at=timezone.now() - import_jobs.STALE_AFTER * 2)
+        second = import_jobs.claim()
+        self.assertEqual(second.pk, job.pk)
+
+        import_jobs.process(first, chunk_size=1)
+
+        self.assertEqual((first.status, first.rows_done), (ImportJob.RUNNING, 0))
+        self.assertFalse(PurchaseInvoice.objects.exists())
+
+        import_jobs.process(second, chunk_size=1)
+
+        self.assertEqual((second.status, second.rows_done, second.success_count), (ImportJob.DONE, 2, 2))
+        self.assertEqual(
+            list(PurchaseInvoice.objects.order_by('pk').values_list('invoice_number', flat=True)), ['P1', 'P2']
+        )
+
+
+class ReimportTests(ImportTestCase):
+    def lines(self):
+        return list(PurchaseProduct.objects.order_by('serial_number').values_list('serial_number', 'quantity'))
+
+    def test_reimporting_the_same_file_changes_nothing(self):
+        rows = [self.purchase_row('P1', paid='1000'), self.purchase_row('P1', quantity='20'), self.purchase_row('P2')]
+        self.import_purchases(*rows)
+        lines = self.lines()
+
+        result = self.import_purchases(*rows)
+
+        self.assertEqual((result.unchanged, result.error_count), (3, 0))
+        self.assertEqual(self.lines(), lines)
+        self.assertEqual(Payment.objects.count(), 1)
+
+    def test_identical_rows_are_kept_apart(self):
+        rows = [self.purchase_row('P1'), self.purchase_row('P1')]
+        self.import_purchases(*rows)
+        self.import_purchases(*rows)
+
+        self.assertEqual(self.lines(), [(1, Decimal('100')), (2, Decimal('100'))])
+
+    def test_a_corrected_row_replaces_its_line_and_payment(self):
+        self.import_purchases(self.purchase_row('P1', paid='1000'), self.purchase_row('P1', quantity='20'))
+
+        result = self.import_purchases(
+            self.purchase_row('P1', quantity='90', paid='1200'), self.purchase_row('P1', quantity='20')
+        )
+
+        self.assertEqual(result.unchanged, 1)
+        self.assertEqual(self.lines(), [(1, Decimal('90')), (2, Decimal('20'))])
+        self.assertEqual(list(Payment.objects.values_list('amount', flat=True)), [Decimal('1200')])
+        self.assertEqual(totals.recompute_purchase_invoices(PurchaseInvoice.objects.all()), 0)
+
+    def test_resuming_keeps_the_rows_in_place(self):
+        rows = [self.purchase_row('P1'), self.purchase_row('P1', quantity='20')]
+        self.import_purchases(*rows[:1])
+        self.import_purchases(*rows, skip=1)
+        self.import_purchases(*rows)
+
+        self.assertEqual(self.lines(), [(1, Decimal('100')), (2, Decimal('20'))])
+
+    def test_formats_keep_their_own_records(self):
+        self.import_purchases(self.purchase_row('P1', paid='1000'))
+        export_row = ['P1', 'L-P1', 'Vendor', '2024-07-01', '0', '500', '0']
+        imports.run(imports.PurchaseInvoiceExportFormat([]), [export_row], self.tenant.pk)
+
+        result = self.import_purchases(self.purchase_row('P1', paid='1000'))
+
+        self.assertEqual(result.unchanged, 1)
+        self.assertEqual(sorted(Payment.objects.values_list('amount', flat=True)), [Decimal('500'), Decimal('1000')])
+
+    def test_an_export_with_a_new_paid_amount_replaces_its_payment(self):
+        def export_row(paid):
+            return ['S1', 'Customer', '2024-07-01', '0', '0', '0', '0', paid, '0']
+
+        self.sales_invoice(invoice_number='S1', no_of_crates=10, cost_per_crate=Decimal('50'))
+        imports.run(imports.SalesInvoiceExportFormat([]), [export_row('100')], self.tenant.pk)
+        result = imports.run(imports.SalesInvoiceExportFormat([]), [export_row('100')], self.tenant.pk)
+        self.assertEqual(result.unchanged, 1)
+
+        imports.run(imports.SalesInvoiceExportFormat([]), [export_row('300')], self.tenant.pk)
+
+        invoice = SalesInvoice.objects.get(invoice_number='S1')
+        self.assertEqual(list(invoice.payments.values_list('amount', flat=True)), [Decimal('300')])
+        self.assertEqual((invoice.paid_amount, invoice.due_amount), (Decimal('300'), Decimal('200')))
+        self.assertEqual(totals.recompute_sales_invoices(SalesInvoice.objects.all()), 0)
@@ -0,0 +1,381 @@
+"""
+Maintenance of the stored invoice totals columns.
+
+SalesInvoice and PurchaseInvoice keep their net total, weight/quantity,
+paid amount, due amount and payment status in real columns. Line item and
+payment hooks call the ``apply_*`` helpers with the change they made, which
+updates the invoice in a single UPDATE built from F-expressions so
+concurrent saves never overwrite each other. The ``recompute_*`` helpers
+rebuild the columns from the underlying rows and are used by the
+``recompute_invoice_totals`` management command. Bulk writers run inside
+``deferred()`` and refresh each touched invoice once afterwards.
+
+Every change to an invoice's due amount also refreshes the running
+balance of its customer or vendor (see Accounts/ledger.py).
+
+A purchase invoice without lines keeps the net total it was given, as the
+invoices of imported history files have none; its first line replaces it.
+"""
+import threading
+from contextlib import contextmanager
+from decimal import Decimal, ROUND_HALF_UP
+
+from django.db import transaction
+from django.db.models import F, Exists, OuterRef, Subquery, Sum, Value, Case, When, CharField, DecimalField
+from django.db.models.functions import Coalesce, Round
+from django.db.models.lookups import Exact
+
+from . import ledger
+
+ZERO = Decimal('0.00')
+CASH_CUTTING_RATE = Decimal('0.02')
+
+SALES_TOTAL_FIELDS = ('net_total', 'total_gross_weight', 'paid_amount', 'due_amount', 'payment_status')
+PURCHASE_TOTAL_FIELDS = ('net_total', 'total_quantity', 'paid_amount', 'due_amount', 'payment_status')
+
+PAYMENT_STATUS_CHOICES = [
+    ('Paid', 'Paid'),
+    ('Unpaid', 'Unpaid'),
+    ('Partial', 'Partial'),
+]
+
+MONEY = DecimalField(max_digits=12, decimal_places=2)
+
+_state = threading.local()
+
+
+def _amount(value):
+    return Value(Decimal(value or 0), output_field=MONEY)
+
+
+def _status_expression(due, paid):
+    return Case(
+        When(Exact(due, _amount(0)), then=Value("Paid")),
+        When(Exact(paid, _amount(0)), then=Value("Unpaid")),
+        default=Value("Partial"),
+        output_field=CharField(),
+    )
+
+
+def payment_status(due, paid):
+    """Python counterpart of the payment status expression."""
+    if due == 0:
+        return "Paid"
+    elif paid == 0:
+        return "Unpaid"
+    return "Partial"
+
+
+# Sales invoice fields the due amount is charged from, besides the lines and payments
+SALES_CHARGE_FIELDS = ('no_of_crates', 'cost_per_crate', 'purchased_crates_quantity', 'purchased_crates_unit_price')
+
+
+def sales_extras_expression():
+    """Packaging and purchased crates charges taken from the invoice row."""
+    packaging = Coalesce(F('no_of_crates') * F('cost_per_crate'), _amount(0), output_field=MONEY)
+    crates = Coalesce(
+        Round(F('purchased_crates_quantity') * F('purchased_crates_unit_price'), 2),
+        _amount(0),
+        output_field=MONEY,
+    )
+    return packaging + crates
+
+
+def purchase_cash_cutting_expression(net_total):
+    return Round(net_total - net_total * Value(CASH_CUTTING_RATE), 2, output_field=MONEY)
+
+
+def apply_sales_invoice_delta(invoice_id, net_total=ZERO, gross_weight=ZERO, paid=ZERO):
+    """Add the given differences to a sales invoice and refresh due and status."""
+    from .models import SalesInvoice
+
+    if not invoice_id:
+        return
+    customer_id = SalesInvoice.objects.filter(pk=invoice_id).values_list('vendor_id', flat=True).first()
+    ledger.lock_balance('customer', customer_id)
+    new_net = F('net_total') + _amount(net_total)
+    new_gross = F('total_gross_weight') + _amount(gross_weight)
+    new_paid = F('paid_amount') + _amount(paid)
+    # Rounded so that float arithmetic on SQLite still compares equal to zero.
+    new_due = Round(new_net + new_gross + sales_extras_expression() - new_paid, 2, output_field=MONEY)
+    SalesInvoice.objects.filter(pk=invoice_id).update(
+        net_total=new_net,
+        total_gross_weight=new_gross,
+        paid_amount=new_paid,
+        due_amount=new_due,
+        payment_status=_status_expression(new_due, new_paid),
+    )
+    ledger.refresh_balance('customer', customer_id)
+
+
+def apply_purchase_invoice_delta(invoice_id, net_total=ZERO, quantity=ZERO, paid=ZERO):
+    """Add the given differences to a purchase invoice and refresh due and status."""
+    from .models import PurchaseInvoice
+
+    if not invoice_id:
+        return
+    vendor_id = PurchaseInvoice.objects.filter(pk=invoice_id).values_list('vendor_id', flat=True).first()
+    ledger.lock_balance('vendor', vendor_id)
+    new_net = F('net_total') + _amount(net_total)
+    new_quantity = F('total_quantity') + _amount(quantity)
+    new_paid = F('paid_amount') + _amount(paid)
+    new_due = Round(purchase_cash_cutting_expression(new_net) - new_paid, 2, output_field=MONEY)
+    PurchaseInvoice.objects.filter(pk=invoice_id).update(
+        net_total=new_net,
+        total_quantity=new_quantity,
+        paid_amount=new_paid,
+        due_amount=new_due,
+        payment_status=_status_expression(new_due, new_paid),
+    )
+    ledger.refresh_balance('vendor', vendor_id)
+
+
+def apply_paid_amounts(kind, party_id, amounts):
+    """
+    Add payments to many invoices of one customer or vendor in one UPDATE.
+
+    ``kind`` is 'customer' or 'vendor' and ``amounts`` maps invoice ids to
+    the amount paid. The caller holds the party's balance lock.
+    """
+    from .models import PurchaseInvoice, SalesInvoice
+
+    if not amounts:
+        return
+    model = SalesInvoice if kind == 'customer' else PurchaseInvoice
+    new_paid = F('paid_amount') + Case(
+        *[When(pk=invoice_id, then=_amount(amount)) for invoice_id, amount in amounts.items()],
+        default=_amount(0),
+        output_field=MONEY,
+    )
+    if kind == 'customer':
+        total = F('net_total') + F('total_gross_weight') + sales_extras_expression()
+    else:
+        total = purchase_cash_cutting_expression(F('net_total'))
+    new_due = Round(total - new_paid, 2, output_field=MONEY)
+    model.objects.filter(pk__in=list(amounts)).update(
+        paid_amount=new_paid,
+        due_amount=new_due,
+        payment_status=_status_expression(new_due, new_paid),
+    )
+    ledger.refresh_balance(kind, party_id)
+
+
+def _line_sum(model, field):
+    sums = (
+        model.objects.filter(invoice=OuterRef('pk'))
+        .order_by()
+        .values('invoice')
+        .annotate(total=Sum(field))
+        .values('total')
+    )
+    return Coalesce(Subquery(sums, output_field=MONEY), _amount(0), output_field=MONEY)
+
+
+def refresh_purchase_invoice_lines(invoice_id):
+    """Set a purchase invoice's net total and quantity from its lines in one UPDATE."""
+    from .models import PurchaseInvoice, PurchaseProduct
+
+    if not invoice_id:
+        return
+    vendor_id = PurchaseInvoice.objects.filter(pk=invoice_id).values_list('vendor_id', flat=True).first()
+    ledger.lock_balance('vendor', vendor_id)
+    new_net = _line_sum(PurchaseProduct, 'total')
+    new_due = Round(purchase_cash_cutting_expression(new_net) - F('paid_amount'), 2, output_field=MONEY)
+    PurchaseInvoice.objects.filter(pk=invoice_id).update(
+        net_total=new_net,
+        total_quantity=_line_sum(PurchaseProduct, 'quantity'),
+        due_amount=new_due,
+        payment_status=_status_expression(new_due, F('paid_amount')),
+    )
+    ledger.refresh_balance('vendor', vendor_id)
+
+
+@contextmanager
+def deferred():
+    """
+    Skip the per-row invoice updates of the line item and payment hooks.
+
+    For bulk writers that refresh every invoice they touch once at the end.
+    """
+    depth = getattr(_state, 'deferred', 0)
+    _state.deferred = depth + 1
+    try:
+        yield
+    finally:
+        _state.deferred = depth
+
+
+def protect_stored_totals(invoice, fields, save_kwargs):
+    """
+    Keep Model.save() from writing the totals columns from memory.
+
+    A new invoice starts from the field defaults since it has no lines yet;
+    an existing one saves every other loaded field so the stored totals,
+    which may have moved since the instance was loaded, stay untouched.
+    """
+    if invoice._state.adding:
+        for field in fields:
+            setattr(invoice, field, invoice._meta.get_field(field).get_default())
+    elif save_kwargs.get('update_fields') is None:
+        deferred = invoice.get_deferred_fields()
+        save_kwargs['update_fields'] = [
+            field.name for field in invoice._meta.concrete_fields
+            if not field.primary_key and field.name not in fields and field.attname not in deferred
+        ]
+
+
+# Line items and payments that feed the invoice totals: the invoice updater
+# and which of their fields map onto which delta argument.
+CONTRIBUTIONS = {
+    'SalesProduct': ('sales', {'total': 'net_total', 'gross_weight': 'gross_weight'}),
+    'SalesPayment': ('sales', {'amount': 'paid'}),
+    'PurchaseProduct': ('purchase', {'total': 'net_total', 'quantity': 'quantity'}),
+    'Payment': ('purchase', {'amount': 'paid'}),
+}
+
+
+def _tracked_fields(instance):
+    # A sales invoice's own contribution: its customer and charges
+    if type(instance).__name__ == 'SalesInvoice':
+        return ('vendor_id',) + SALES_CHARGE_FIELDS
+    return ('invoice_id',) + tuple(CONTRIBUTIONS[type(instance).__name__][1])
+
+
+def remember(instance):
+    """Store the values the invoice totals currently include for this row."""
+    if instance.pk is None:
+        instance._loaded_totals = None
+        return
+    # Read from __dict__ so deferred fields are not loaded one query at a time.
+    values = {field: instance.__dict__.get(field) for field in _tracked_fields(instance)}
+    instance._loaded_totals = values if all(f in instance.__dict__ for f in values) else None
+
+
+def previous_values(instance):
+    """Values the invoice totals include for this row, fetched if they were not loaded."""
+    if instance.pk is None:
+        return None
+    values = getattr(instance, '_loaded_totals', None)
+    if values is None:
+        fields = _tracked_fields(instance)
+        values = type(instance)._base_manager.filter(pk=instance.pk).values(*fields).first()
+    return values
+
+
+def apply_change(instance, previous, deleted=False, refresh=False):
+    """
+    Apply the difference between ``previous`` and the instance to its invoice totals.
+
+    With ``refresh`` a new purchase line sets its invoice's totals from the
+    lines instead: the first line of an invoice replaces the net total it
+    had without lines.
+    """
+    if getattr(_state, 'deferred', 0):
+        if not deleted:
+            remember(instance)
+        return
+    if refresh:
+        refresh_purchase_invoice_lines(instance.invoice_id)
+        remember(instance)
+        return
+    kind, mapping = CONTRIBUTIONS[type(instance).__name__]
+    apply_delta = apply_sales_invoice_delta if kind == 'sales' else apply_purchase_invoice_delta
+
+    current = {field: getattr(instance, field) for field in _tracked_fields(instance)}
+    if deleted:
+        # A row deleted without having been loaded still holds its stored values.
+        previous, current = previous or current, None
+    if previous and current and previous['invoice_id'] == current['invoice_id']:
+        deltas = {
+            argument: _money(current[field]) - _money(previous[field])
+            for field, argument in mapping.items()
+        }
+        if any(deltas.values()):
+            apply_delta(current['invoice_id'], **deltas)
+    else:
+        if previous:
+            apply_delta(previous['invoice_id'], **{
+                argument: -_money(previous[field]) for field, argument in mapping.items()
+            })
+        if current:
+            apply_delta(current['invoice_id'], **{
+                argument: _money(current[field]) for field, argument in mapping.items()
+            })
+    if not deleted:
+        remember(instance)
+
+
+def recompute_sales_invoices(queryset, batch_size=500):
+    """Rebuild the stored totals of the given sales invoices from their lines and payments."""
+    from .models import SalesInvoice
+
+    changed = 0
+    pending = []
+    for invoice in queryset.with_totals().order_by('pk').iterator(chunk_size=batch_size):
+        paid = _money(invoice.annotated_paid_amount)
+        due = _money(invoice.annotated_due_amount)
+        values = {
+            'net_total': _money(invoice.annotated_net_total),
+            'total_gross_weight': _money(invoice.annotated_total_gross_weight),
+            'paid_amount': paid,
+            'due_amount': due,
+            'payment_status': payment_status(due, paid),
+        }
+        if _differs(invoice, values):
+            pending.append(invoice)
+        if len(pending) >= batch_size:
+            changed += _flush(SalesInvoice, pending, SALES_TOTAL_FIELDS)
+            pending = []
+    changed += _flush(SalesInvoice, pending, SALES_TOTAL_FIELDS)
+    return changed
+
+
+def recompute_purchase_invoices(queryset, batch_size=500):
+    """Rebuild the stored totals of the given purchase invoices from their lines and payments."""
+    from .models import PurchaseInvoice, PurchaseProduct
+
+    changed = 0
+    pending = []
+    invoices = queryset.with_financials().annotate(
+        has_lines=Exists(PurchaseProduct.objects.filter(invoice=OuterRef('pk')))
+    )
+    for invoice in invoices.order_by('pk').iterator(chunk_size=batch_size):
+        net_total = _money(invoice.annotated_line_total if invoice.has_lines else invoice.net_total)
+        paid = _money(invoice.annotated_paid_amount)
+        due = _money(net_total - net_total * CASH_CUTTING_RATE) - paid
+        values = {
+            'net_total': net_total,
+            'total_quantity': _money(invoice.annotated_purchased_quantity),
+            'paid_amount': paid,
+            'due_amount': due,
+            'payment_status': payment_status(due, paid),
+        }
+        if _differs(invoice, values):
+            pending.append(invoice)
+        if len(pending) >= batch_size:
+            changed += _flush(PurchaseInvoice, pending, PURCHASE_TOTAL_FIELDS)
+            pending = []
+    changed += _flush(PurchaseInvoice, pending, PURCHASE_TOTAL_FIELDS)
+    return changed
+
+
+def _money(value):
+    return Decimal(value or 0).quantize(Decimal('0.01'), rounding=ROUND_HALF_UP)
+
+
+def _differs(invoice, values):
+    """Copy the recomputed values onto the instance; return True if any changed."""
+    changed = False
+    for field, value in values.items():
+        if getattr(invoice, field) != value:
+            setattr(invoice, field, value)
+            changed = True
+    return changed
+
+
+def _flush(model, invoices, fields):
+    if not invoices:
+        return 0
+    with transaction.atomic():
+        model.objects.bulk_update(invoices, fields)
+    return len(invoices)
@@ -1,34 +1,42 @@
+import hashlib
 from datetime import date
+from django_multitenant.utils import get_current_tenant
+from . import sequences
 
-def generate_invoice_number():
-    """
-    Generate an invoice number in the format MS2025Rxx where xx is a sequential number
-    """
-    from .models import PurchaseInvoice
-    
-    last_invoice = PurchaseInvoice.objects.order_by("-id").first()
-    if last_invoice and last_invoice.invoice_number:
-        try:
-            # Extract the last two digits and increment
-            last_number = int(last_invoice.invoice_number[-2:])
-        except ValueError:
-            last_number = 0
-        return f"MS2025R{last_number + 1:02d}"
-    else:
-        return "MS2025R01"  # Default starting number
+def generate_invoice_number(tenant_id=None, year=None):
+    """
+    Reserve the next purchase invoice number in the format MS<year>Rxx for the tenant
+    """
+    return sequences.next_number(sequences.PURCHASE_INVOICE, tenant_id, year or date.today().year)
+
+def generate_lot_number(tenant_id=None):
+    """
+    Reserve the next lot number in the format LOT-xx for the tenant
+    """
+    return sequences.next_number(sequences.LOT, tenant_id)
+
+def current_tenant_id(request=None):
+    """
+    Id of the request's tenant, or of the current tenant, or None
+    """
+    tenant = getattr(request, 'tenant', None) or get_current_tenant()
+    return getattr(tenant, 'pk', None)
+
+def user_tenant_id(request):
+    """
+    Id of the tenant of the request user's profile, falling back to current_tenant_id()
 
-def generate_lot_number():
-    """
-    Generate a lot number in the format LOT-xx where xx is a sequential number
-    """
-    from .models import PurchaseInvoice
-    
-    last_lot = PurchaseInvoice.objects.order_by("-id").first()
-    if last_lot and last_lot.lot_number:
-        try:
-            last_lot_number = int(last_lot.lot_number.split("-")[-1])
-        except ValueError:
-            last_lot_number = 0
-        return f"LOT-{last_lot_number + 1:02d}"
-    else:
-        return "LOT-01"  # Default starting lot number
+    TenantMiddleware sets no tenant for /admin/, so admin views go by the user's profile
+    """
+    # A user without a profile raises RelatedObjectDoesNotExist, an AttributeError
+    profile = getattr(getattr(request, 'user', None), 'profile', None)
+    if profile is not None and profile.tenant_id:
+        return profile.tenant_id
+    return current_tenant_id(request)
+
+def tenant_cache_key(name, tenant_id, *parts):
+    """
+    Cache key for a value of one tenant; free-form parts are hashed so the key stays valid
+    """
+    digest = hashlib.md5('\x1f'.join(str(part) for part in parts).encode()).hexdigest() if parts else ''
+    return f"accounts:{name}:{tenant_id or 'all'}:{digest}"
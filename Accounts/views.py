@@ -4,15 +4,12 @@ from io import BytesIO
 from rest_framework.decorators import api_view, permission_classes
 from rest_framework.permissions import AllowAny
 from rest_framework.response import Response
-from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer, Table, TableStyle, Image, LongTable
+from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer, Table, LongTable
 from reportlab.lib.pagesizes import letter
 from reportlab.lib import colors
 from django.conf import settings
 from .models import PurchaseInvoice
 from decimal import Decimal, ROUND_HALF_UP
-from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
-from reportlab.pdfbase.ttfonts import TTFont
-from reportlab.pdfbase import pdfmetrics
 import os
 from reportlab.lib.units import inch
 from reportlab.platypus import Frame
@@ -22,8 +19,6 @@ from .models import PurchaseVendor, PurchaseInvoice, SalesInvoice, Expense, Dama
 from django.http import JsonResponse
 from django.template.loader import get_template
 from xhtml2pdf import pisa
-from django.contrib.staticfiles.finders import find
-import base64
 from django.contrib.admin.views.decorators import staff_member_required
 from django.contrib.auth.mixins import LoginRequiredMixin
 from django.contrib.auth.decorators import login_required
@@ -36,18 +31,12 @@ from rest_framework.response import Response
 from rest_framework.decorators import api_view, permission_classes
 from rest_framework.permissions import AllowAny
 from django.contrib import messages
+from django.core.exceptions import ValidationError
 from django.utils.dateparse import parse_date
-
-
-# Font and Logo Setup
-FONT_PATH = os.path.join(os.path.dirname(__file__), 'Font', 'DejaVuSans.ttf')
-BOLD_FONT_PATH = os.path.join(os.path.dirname(__file__), 'Font', 'DejaVuSans-Bold.ttf')
-FONT_PATH = os.path.join(os.path.dirname(__file__), 'Font', 'NotoSans.ttf')
-BOLD_FONT_PATH = os.path.join(os.path.dirname(__file__), 'Font', 'NotoSans-Bold.ttf')
-pdfmetrics.registerFont(TTFont('DejaVuSans', FONT_PATH))
-pdfmetrics.registerFont(TTFont('DejaVuSans-Bold', BOLD_FONT_PATH))
-pdfmetrics.registerFont(TTFont('NotoSans', FONT_PATH))
-pdfmetrics.registerFont(TTFont('NotoSans-Bold', BOLD_FONT_PATH))
+from . import dashboard as dashboard_kpis
+from . import payments, pdf_cache, summaries
+from .pdf_resources import PARAGRAPH_STYLES, TABLE_STYLES, font_uri, logo_data_uri, logo_image
+from .utils import current_tenant_id
 
 @staff_member_required
 def admin_dashboard(request):
@@ -69,87 +58,35 @@ def admin_dashboard(request):
         from_date_str = from_date.strftime('%Y-%m-%d')
         to_date_str = to_date.strftime('%Y-%m-%d')
 
-    # Filter purchase invoices by date if provided
-    purchase_invoices = PurchaseInvoice.objects.all()
-    if from_date:
-        purchase_invoices = purchase_invoices.filter(date__gte=from_date)
-    if to_date:
-        purchase_invoices = purchase_invoices.filter(date__lte=to_date)
+    # Aggregated figures, cached per tenant until one of the underlying rows changes
+    kpis = dashboard_kpis.snapshot(current_tenant_id(request), from_date, to_date)
 
     # Calculate total purchases (using net_total directly - not subtracting commission)
-    total_purchase_before_commission = purchase_invoices.aggregate(total=Sum('net_total'))['total'] or Decimal('0')
+    total_purchase_before_commission = kpis['purchase_net_total']
     commission_rate = Decimal('0.02')  # 2% commission
     # Calculate net amount after cash cutting (2% commission)
     vendor_commission_total = total_purchase_before_commission * commission_rate
     total_purchase = total_purchase_before_commission - vendor_commission_total
 
-    # Filter sales invoices by date if provided
-    sales_invoices = SalesInvoice.objects.all()
-    if from_date:
-        sales_invoices = sales_invoices.filter(invoice_date__gte=from_date)
-    if to_date:
-        sales_invoices = sales_invoices.filter(invoice_date__lte=to_date)
-
-    # Calculate total sales using net_total_after_packaging (final invoice total including crates)
-    total_sales_before_commission = sum(invoice.net_total or Decimal('0') for invoice in sales_invoices)
     # Customer commission is equal to the total gross weight (₹1 per kg)
-    customer_commission_total = sum(invoice.total_gross_weight or Decimal('0') for invoice in sales_invoices)
-    total_sales = sum(invoice.net_total_after_packaging or Decimal('0') for invoice in sales_invoices)
+    customer_commission_total = kpis['sales_gross_weight']
+    # Total sales use the final invoice totals including packaging and crates
+    total_sales = kpis['sales_final_total']
 
-    # Filter expenses by date if provided
-    expenses = Expense.objects.all()
-    if from_date:
-        expenses = expenses.filter(date__gte=from_date)
-    if to_date:
-        expenses = expenses.filter(date__lte=to_date)
-
-    # Calculate total expenses - expenses are not affected by commission
-    total_expenses = expenses.aggregate(total=Sum('amount'))['total'] or Decimal('0')
-
-    # Filter damages by date if provided
-    damages = Damages.objects.all()
-    if from_date:
-        damages = damages.filter(date__gte=from_date)
-    if to_date:
-        damages = damages.filter(date__lte=to_date)
-
-    # Calculate total damages - damages are not affected by commission
-    total_damages = damages.aggregate(total=Sum('amount_loss'))['total'] or Decimal('0')
-
-    # Get all packaging invoices - Packaging_Invoice doesn't have a date field to filter
-    packaging_invoices = Packaging_Invoice.objects.all()
-
-    # Calculate total packaging cost - packaging is not affected by commission
-    total_packaging_cost = sum([pi.packaging_total for pi in packaging_invoices])
+    # Expenses, damages and packaging are not affected by commission
+    total_expenses = kpis['total_expenses']
+    total_damages = kpis['total_damages']
+    total_packaging_cost = kpis['total_packaging_cost']
 
     # Profit and Loss Calculation - using the full values
     profit_loss = total_sales - (total_purchase + total_expenses + total_damages)
 
-    # Highest Due Customers - no changes needed if these already account for commission
-    highest_due_customers = Customer.objects.annotate(
-        total_sales_amount=Sum('sales_invoices__sales_products__total'),
-        total_paid_amount=Sum('sales_invoices__payments__amount')
-    ).annotate(
-        due=ExpressionWrapper(
-            F('total_sales_amount') - F('total_paid_amount'),
-            output_field=DecimalField()
-        )
-    ).order_by('-due')[:3]  # Show only top 3 customers with highest dues
-
-    # Highest Due Vendors - use full amount
-    highest_due_vendors = PurchaseVendor.objects.annotate(
-        total_purchase_amount=Sum('invoices__net_total'),
-        total_paid_amount=Sum('invoices__payments__amount')
-    ).annotate(
-        due=ExpressionWrapper(
-            F('total_purchase_amount') - F('total_paid_amount'),
-            output_field=DecimalField()
-        )
-    ).order_by('-due')[:3]  # Show only top 3 vendors with highest dues
+    # Highest due customers and vendors from their running balances
+    highest_due_customers = kpis['highest_due_customers'][:3]
+    highest_due_vendors = kpis['highest_due_vendors'][:3]
 
-    # Available lots - fetch all and filter in Python since available_quantity is a property
-    all_lots = PurchaseInvoice.objects.prefetch_related('purchase_products', 'sales_lots').order_by('-date')[:50]  # Fetch recent ones
-    available_lots = [lot for lot in all_lots if lot.available_quantity > 0][:10]
+    # Available lots - most recent lots with quantity left to sell
+    available_lots = kpis['available_lots']
 
     context = {
         'total_purchase': total_purchase,
@@ -170,57 +107,26 @@ def admin_dashboard(request):
 
 @staff_member_required
 def dashboard(request):
+    kpis = dashboard_kpis.snapshot(current_tenant_id(request))
+
     # Total Purchases
-    total_purchase_before_commission = PurchaseInvoice.objects.aggregate(total=Sum('net_total'))['total'] or Decimal('0')
+    total_purchase_before_commission = kpis['purchase_net_total']
     commission_rate = Decimal('0.02')  # 2% commission
     total_purchase = total_purchase_before_commission - (total_purchase_before_commission * commission_rate)
 
     # Total Sales
-    sales_with_totals = SalesInvoice.objects.annotate(
-    computed_total=Sum('sales_products__total'))
-    total_sales = sum(s.computed_total or 0 for s in sales_with_totals)
-
-    # Total Expenses
-    total_expenses = Expense.objects.aggregate(total=Sum('amount'))['total'] or Decimal('0')
+    total_sales = kpis['sales_net_total']
 
-    # Total Damages
-    total_damages = Damages.objects.aggregate(total=Sum('amount_loss'))['total'] or Decimal('0')
-
-    # Total Packaging Cost
-    packaging_invoices = Packaging_Invoice.objects.all()
-    total_packaging_cost = sum([pi.packaging_total for pi in packaging_invoices])
+    total_expenses = kpis['total_expenses']
+    total_damages = kpis['total_damages']
+    total_packaging_cost = kpis['total_packaging_cost']
 
     # Profit and Loss Calculation
     profit_loss = total_sales - (total_purchase + total_expenses + total_packaging_cost + total_damages)
 
-    highest_due_customers = Customer.objects.annotate(
-    total_sales_amount=Sum('sales_invoices__sales_products__total'),
-    total_paid_amount=Sum('sales_invoices__payments__amount')
-).annotate(
-    due=ExpressionWrapper(
-        F('total_sales_amount') - F('total_paid_amount'),
-        output_field=DecimalField()
-    )
-).order_by('-due')[:5]
-
-    # Highest Due Customers
-    highest_due_vendors = PurchaseVendor.objects.annotate(
-    total_purchase_amount=Sum('invoices__net_total'),
-    total_paid_amount=Sum('invoices__payments__amount')
-).annotate(
-    due=ExpressionWrapper(
-        F('total_purchase_amount') - F('total_paid_amount'),
-        output_field=DecimalField()
-    )
-).order_by('-due')[:5]
-    available_lots = PurchaseProduct.objects.annotate(
-    sold_quantity=Sum('invoice__sales_lots__quantity')
-).annotate(
-    remaining_quantity=ExpressionWrapper(
-        F('quantity') - (F('sold_quantity') or Decimal('0')),
-        output_field=DecimalField()
-    )
-).filter(remaining_quantity__gt=0)
+    highest_due_customers = kpis['highest_due_customers']
+    highest_due_vendors = kpis['highest_due_vendors']
+    available_lots = kpis['available_lots']
 
     context = {
         'total_purchase': total_purchase,
@@ -235,23 +141,6 @@ def dashboard(request):
     }
     return render(request, 'admin/dashboard.html', context)
 
-def get_base64_image(image_path):
-    try:
-        with open(image_path, "rb") as img_file:
-            return base64.b64encode(img_file.read()).decode('utf-8')
-    except FileNotFoundError:
-        print(f"Warning: Image file not found at {image_path}")
-        return None
-
-def find(path):
-    result = finders.find(path)
-    if result:
-        if isinstance(result, (list, tuple)):
-            # Return the first path if it's a list/tuple
-            return result[0]
-        return result
-    return None
-
 @staff_member_required
 def create_invoice(request):
     if request.method == 'POST':
@@ -278,29 +167,24 @@ def generate_invoice_pdf(request, invoice_id):
     invoice = get_object_or_404(PurchaseInvoice, id=invoice_id)
     # Check if "hide_payments" parameter exists in the URL
     hide_payments = request.GET.get('hide_payments', False)
+    # Served from the PDF cache while the invoice is unchanged
+    return pdf_cache.serve(
+        request, pdf_cache.PURCHASE_INVOICE, invoice, hide_payments,
+        render_invoice_pdf, f"{invoice.invoice_number}.pdf",
+    )
 
-    # Set up PDF response
-    response = HttpResponse(content_type='application/pdf')
-    response['Content-Disposition'] = f'inline; filename="{invoice.invoice_number}.pdf"'
-
+def render_invoice_pdf(invoice, hide_payments):
+    """PDF of a purchase invoice, as bytes"""
     buffer = BytesIO()
     doc = SimpleDocTemplate(buffer, pagesize=letter, rightMargin=30, leftMargin=30, topMargin=20, bottomMargin=30)
 
     elements = []  # Correct indentation here
 
-    styles = getSampleStyleSheet()
-    title_style = ParagraphStyle('Title', parent=styles['Title'], fontSize=16, alignment=1, textColor=colors.black)
-
     # Add Title
-    elements.append(Paragraph("PURCHASE INVOICE", title_style))
+    elements.append(Paragraph("PURCHASE INVOICE", PARAGRAPH_STYLES['invoice_title']))
 
-    # Add logo
-    logo_path = os.path.join(settings.STATICFILES_DIRS[0], 'LOGO.png')  # Ensure the path is correct
-    if os.path.exists(logo_path):
-        logo = Image(logo_path, width=2*inch, height=1.5*inch)  # Adjust size as needed
-        logo.hAlign = 'CENTER'  # Align the logo to the center of its cell
-    else:
-        print(f"Logo file not found at {logo_path}")
+    # Add logo; the cell stays empty when there is none
+    logo = logo_image(invoice.tenant_id, width=2*inch, height=1.5*inch) or ''
 
     # Add Vendor Info Table with yellow highlights
     vendor_data = [
@@ -310,19 +194,7 @@ def generate_invoice_pdf(request, invoice_id):
 
     ]
     vendor_table = Table(vendor_data, colWidths=[1*inch, 2*inch, 1*inch, 1.15*inch])
-    vendor_table.setStyle(TableStyle([
-        ('GRID', (0, 0), (-1, -1), 0.5, colors.grey),  # Grid lines for table
-        ('ALIGN', (0, 0), (-1, -1), 'LEFT'),  # Align text to the left
-        ('FONTNAME', (0, 0), (-1, -1), 'DejaVuSans'),  # Font for the table
-        ('FONTSIZE', (0, 0), (-1, -1), 10),  # Font size
-        ('BACKGROUND', (0, 0), (0, 0), colors.yellow),  # Highlight "Name:" in yellow
-        ('BACKGROUND', (0, 1), (0, 1), colors.yellow),  # Highlight "Contact No:" in yellow
-        ('BACKGROUND', (0, 2), (0, 2), colors.yellow),  # Highlight "Area:" in yellow
-        ('BACKGROUND', (2, 0), (2, 0), colors.yellow),  # Highlight "DATE" in yellow
-        ('BACKGROUND', (2, 1), (2, 1), colors.yellow),  # Highlight "INVOICE NO." in yellow
-        ('BACKGROUND', (2, 2), (2, 2), colors.yellow),  # Highlight "LOT NO." in yellow
-        ('TEXTCOLOR', (0, 0), (-1, 0), colors.black),  # Black text for headers
-    ]))
+    vendor_table.setStyle(TABLE_STYLES['purchase_vendor'])
 
     # Create a new table to place the logo and vendor info side by side
     side_by_side_table = Table([[logo, vendor_table]], colWidths=[2.5*inch, 5*inch])  # Adjust widths as needed
@@ -346,15 +218,7 @@ def generate_invoice_pdf(request, invoice_id):
             f"₹{product.loading_unloading:.2f}", f"₹{product.total:.2f}"
         ])
     product_table = LongTable(product_data, colWidths=[0.4*inch, 1.5*inch, 0.8*inch, 0.8*inch, 1*inch, 0.8*inch, 0.8*inch, 1*inch, 0.9*inch])
-    product_table.setStyle(TableStyle([
-        ('GRID', (0, 0), (-1, -1), 0.5, colors.black),
-        ('BACKGROUND', (0, 0), (-1, 0), colors.yellow),  # Yellow background for header
-        ('ALIGN', (0, 0), (-1, -1), 'CENTER'),
-        ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
-        ('FONTNAME', (0, 1), (-1, -1), 'DejaVuSans'),
-        ('FONTSIZE', (0, 0), (-1, -1), 8),
-        ('TEXTCOLOR', (0, 0), (-1, 0), colors.black),  # Black text for header
-    ]))
+    product_table.setStyle(TABLE_STYLES['purchase_products'])
     elements.append(product_table)
     elements.append(Spacer(1, 20))
 
@@ -368,16 +232,7 @@ def generate_invoice_pdf(request, invoice_id):
         paid_data.append(["Total Paid:", f"₹{invoice.paid_amount:.2f}"])
 
         paid_table = Table(paid_data, colWidths=[2*inch, 1.8*inch])
-        paid_table.setStyle(TableStyle([
-            ('GRID', (0, 0), (-1, -1), 0.5, colors.grey),
-            ('ALIGN', (0, 0), (-1, -1), 'CENTER'),
-            ('FONTNAME', (0, 0), (-1, -1), 'DejaVuSans'),
-            ('BACKGROUND', (0, 0), (0, 0), colors.yellow),  # Yellow header for "Paid Amount" and "Date"
-            ('FONTNAME', (0, -1), (-1, -1), 'DejaVuSans-Bold'),  # Bold for Total Paid row
-            ('TEXTCOLOR', (0, 0), (-1, 0), colors.black),  # Black text for header
-            ('FONTSIZE', (0, 0), (-1, -1), 10),
-            ('FONTSIZE', (0, -1), (-1, -1), 12),  # Larger font for Total Paid
-        ]))
+        paid_table.setStyle(TABLE_STYLES['purchase_paid'])
 
         # Payment Summary with yellow highlighting
         payment_data = [
@@ -390,17 +245,7 @@ def generate_invoice_pdf(request, invoice_id):
 
 
         payment_table = Table(payment_data, colWidths=[2.5*inch, 1.4*inch])
-        payment_table.setStyle(TableStyle([
-            ('GRID', (0, 0), (-1, -1), 0.5, colors.grey),
-            ('ALIGN', (0, 0), (-1, -1), 'RIGHT'),
-            ('FONTNAME', (0, 0), (-1, -1), 'DejaVuSans'),
-            ('FONTNAME', (0, -1), (-1, -1), 'DejaVuSans-Bold'),
-
-
-            ('BACKGROUND', (0, 0), (-1, 0), colors.yellow),  # Yellow background for the header
-            ('TEXTCOLOR', (0, 0), (-1, 0), colors.black),  # Black text for header
-            ('FONTSIZE', (0, 0), (-1, -1), 10),
-        ]))
+        payment_table.setStyle(TABLE_STYLES['purchase_payment_summary'])
 
         #elements.append(payment_table)
         paid_and_payment_table = Table(
@@ -416,9 +261,7 @@ def generate_invoice_pdf(request, invoice_id):
 
     # Build PDF
     doc.build(elements)
-    buffer.seek(0)
-    response.write(buffer.read())
-    return response
+    return buffer.getvalue()
 
 def vendor_summary(request):
     vendors = PurchaseVendor.objects.all()
@@ -446,10 +289,14 @@ def generate_sales_invoice_pdf(request, invoice_id):
     invoice = get_object_or_404(SalesInvoice, id=invoice_id)
     # Check if "hide_payments" parameter exists in the URL
     hide_payments = request.GET.get('hide_payments', False)
-    # Set up PDF response
-    response = HttpResponse(content_type='application/pdf')
-    response['Content-Disposition'] = f'inline; filename="sales_invoice_{invoice.invoice_number}.pdf"'
+    # Served from the PDF cache while the invoice is unchanged
+    return pdf_cache.serve(
+        request, pdf_cache.SALES_INVOICE, invoice, hide_payments,
+        render_sales_invoice_pdf, f"sales_invoice_{invoice.invoice_number}.pdf",
+    )
 
+def render_sales_invoice_pdf(invoice, hide_payments):
+    """PDF of a sales invoice, as bytes"""
     buffer = BytesIO()
     doc = SimpleDocTemplate(
         buffer,
@@ -461,14 +308,9 @@ def generate_sales_invoice_pdf(request, invoice_id):
     )
 
     elements = []
-    styles = getSampleStyleSheet()
-    title_style = ParagraphStyle('Title', parent=styles['Title'], fontSize=16,
-                                 alignment=1, textColor=colors.black)
-
-
 
     # Add Title
-    elements.append(Paragraph("SALES INVOICE", title_style))
+    elements.append(Paragraph("SALES INVOICE", PARAGRAPH_STYLES['invoice_title']))
     elements.append(Spacer(1, 12))
 
     # Add logo
@@ -476,23 +318,12 @@ def generate_sales_invoice_pdf(request, invoice_id):
     logo_header_table = []
 
     # Add Logo (if available)
-    logo_path = os.path.join(settings.STATICFILES_DIRS[0], 'LOGO.png')  # Updated path
-    if os.path.exists(logo_path):
-        try:
-            logo = Image(logo_path, width=2*inch, height=1.5*inch)
-            logo.hAlign = 'CENTER'
-            # Create a logo cell with proper padding
-            logo_cell = [[logo]]
-            logo_table = Table(logo_cell, hAlign='LEFT')
-            logo_table.setStyle(TableStyle([
-                ('VALIGN', (0,0), (-1,-1), 'MIDDLE'),
-                ('LEFTPADDING', (0,0), (-1,-1), 10),
-            ]))
-            logo_header_table.append(logo_table)
-        except Exception as e:
-            print(f"Error loading logo: {str(e)}")
-    else:
-        print(f"Logo file not found at {logo_path}")
+    logo = logo_image(invoice.tenant_id, width=2*inch, height=1.5*inch)
+    if logo:
+        # Create a logo cell with proper padding
+        logo_table = Table([[logo]], hAlign='LEFT')
+        logo_table.setStyle(TABLE_STYLES['sales_logo'])
+        logo_header_table.append(logo_table)
 
     # Create header table
     header_data = [
@@ -505,28 +336,7 @@ def generate_sales_invoice_pdf(request, invoice_id):
     ]
 
     header_table = Table(header_data, colWidths=[1.25*inch, 1.5*inch, 1.75*inch, 1.5*inch])
-    header_table.setStyle(TableStyle([
-
-
-        ('SPAN', (1, 5), (3, 5)),  # (col_start, row_start), (col_end, row_end)
-        ('SPAN', (1, 2), (3, 2)),  # (col_start, row_start), (col_end, row_end)
-    # Align LOT NO text to the left
-        ('ALIGN', (1, 5), (3, 5), 'LEFT'),
-        ('GRID', (0,1), (-1,-1), 0.5, colors.grey),
-        ('FONTNAME', (2,1), (3,-1), 'Helvetica-Bold'),
-        ('FONTNAME', (0,1), (3,-1), 'Helvetica-Bold'),
-        ('ALIGN', (2,1), (3,-1), 'RIGHT'),
-        ('VALIGN', (0,0), (-1,-1), 'MIDDLE'),
-        ('BACKGROUND', (0, 1), (0, 1), colors.yellow),
-        ('BACKGROUND', (0, 2), (0, 2), colors.yellow),
-        ('BACKGROUND', (0, 3), (0, 3), colors.yellow),
-        ('BACKGROUND', (0, 4), (0, 4), colors.yellow),
-        ('BACKGROUND', (2, 1), (2, 1), colors.yellow),
-        ('BACKGROUND', (2, 3), (2, 3), colors.yellow),
-
-        ('BACKGROUND', (2, 4), (2, 4), colors.yellow),
-        ('BACKGROUND', (0, 5), (0, 5), colors.yellow),
-    ]))
+    header_table.setStyle(TABLE_STYLES['sales_header'])
 
     # Combine logo and header into a single row
     if logo_header_table:
@@ -537,10 +347,7 @@ def generate_sales_invoice_pdf(request, invoice_id):
         col_widths = [8.5*inch]
 
     main_header = Table(final_header, colWidths=col_widths)
-    main_header.setStyle(TableStyle([
-        ('VALIGN', (0,0), (-1,-1), 'TOP'),
-        ('ALIGN', (0,0), (-1,-1), 'LEFT'),
-    ]))
+    main_header.setStyle(TABLE_STYLES['sales_main_header'])
 
     elements.append(main_header)
     elements.append(Spacer(1, 20))
@@ -568,15 +375,7 @@ def generate_sales_invoice_pdf(request, invoice_id):
                          colWidths=[0.4*inch, 1.8*inch, 1*inch, 1*inch,
                                    0.9*inch, 0.8*inch, 0.9*inch, 1.2*inch])
 
-    product_table.setStyle(TableStyle([
-        ('GRID', (0, 0), (-1, -1), 0.5, colors.black),
-        ('BACKGROUND', (0, 0), (-1, 0), colors.yellow),
-        ('ALIGN', (0, 0), (-1, -1), 'CENTER'),
-        ('FONTNAME', (0, 0), (-1, 0), 'DejaVuSans-Bold'),
-        ('FONTNAME', (0, 1), (-1, -1), 'DejaVuSans'),
-        ('FONTSIZE', (0, 0), (-1, -1), 9),
-        ('TEXTCOLOR', (0, 0), (-1, 0), colors.black),
-    ]))
+    product_table.setStyle(TABLE_STYLES['sales_products'])
 
     elements.append(product_table)
     elements.append(Spacer(1, 20))
@@ -597,35 +396,10 @@ def generate_sales_invoice_pdf(request, invoice_id):
     ]
 
     summary_table = Table(summary_data, colWidths=[2.5*inch, 1.5*inch])
-    summary_table.setStyle(TableStyle([
-        ('GRID', (0, 0), (-1, -1), 0.5, colors.grey),
-        ('ALIGN', (0, 0), (-1, -1), 'RIGHT'),
-        ('FONTNAME', (0, 0), (-1, -1), 'DejaVuSans'),
-        ('FONTNAME', (0, 0), (0, -1), 'DejaVuSans-Bold'),
-        ('BACKGROUND', (0, 0), (0, 0), colors.yellow),
-        ('BACKGROUND', (0, 1), (0, 1), colors.yellow),
-        ('BACKGROUND', (0, 2), (0, 2), colors.yellow),
-        ('BACKGROUND', (0, 3), (0, 3), colors.yellow),
-        ('BACKGROUND', (0, 4), (0, 4), colors.yellow),
-        ('BACKGROUND', (0, 5), (0, 5), colors.yellow),
-        ('BACKGROUND', (0, 6), (0, 6), colors.yellow),
-        ('BACKGROUND', (0, 7), (0, 7), colors.yellow),
-        ('BACKGROUND', (0, 8), (0, 8), colors.yellow),
-        ('BACKGROUND', (0, 9), (0, 9), colors.yellow),
-        ('BACKGROUND', (0, 10), (0, 10), colors.yellow),
-        ('FONTSIZE', (0, 0), (-1, -1), 10),
-        ('FONTSIZE', (0, 10), (0, 10), 14),
-        ('FONTSIZE', (1, 10), (1, 10), 14),
-        ('FONTNAME', (1, 10), (1, 10), 'DejaVuSans-Bold'),
-        ('TEXTCOLOR', (0, -1), (0, -1), colors.black),
-        ('BOTTOMPADDING', (0, -1), (-1, -1), 12),
-    ]))
+    summary_table.setStyle(TABLE_STYLES['sales_summary'])
 
     left_aligned_summary = Table([[summary_table]], colWidths=[4*inch])
-    left_aligned_summary.setStyle(TableStyle([
-        ('ALIGN', (0, 0), (-1, -1), 'LEFT'),
-        ('LEFTPADDING', (0, 0), (-1, -1), 140),
-    ]))
+    left_aligned_summary.setStyle(TABLE_STYLES['sales_summary_indent'])
 
     elements.append(left_aligned_summary)
     elements.append(Spacer(1, 25))
@@ -638,17 +412,7 @@ def generate_sales_invoice_pdf(request, invoice_id):
         paid_data.append(["Total Paid:", f"₹{invoice.paid_amount:.2f}"])
 
         paid_table = Table(paid_data, colWidths=[2*inch, 1.8*inch])
-        paid_table.setStyle(TableStyle([
-            ('GRID', (0, 0), (-1, -1), 0.5, colors.grey),
-            ('ALIGN', (0, 0), (-1, -1), 'CENTER'),
-            ('FONTNAME', (0, 0), (-1, -1), 'DejaVuSans'),
-            ('BACKGROUND', (0, 0), (0, 0), colors.yellow),
-            ('BACKGROUND', (1, 0), (1, 0), colors.yellow),
-            ('FONTNAME', (0, -1), (-1, -1), 'DejaVuSans-Bold'),
-            ('TEXTCOLOR', (0, 0), (-1, 0), colors.black),
-            ('FONTSIZE', (0, 0), (-1, -1), 10),
-            ('FONTSIZE', (0, -1), (-1, -1), 12),
-        ]))
+        paid_table.setStyle(TABLE_STYLES['sales_paid'])
 
         # Payment Summary Table with yellow highlights
         payment_summary_data = [
@@ -658,15 +422,7 @@ def generate_sales_invoice_pdf(request, invoice_id):
         ]
 
         payment_summary_table = Table(payment_summary_data, colWidths=[2.5*inch, 1.4*inch])
-        payment_summary_table.setStyle(TableStyle([
-            ('GRID', (0, 0), (-1, -1), 0.5, colors.grey),
-            ('ALIGN', (0, 0), (-1, -1), 'RIGHT'),
-            ('FONTNAME', (0, 0), (-1, -1), 'DejaVuSans'),
-            ('FONTNAME', (0, -1), (-1, -1), 'DejaVuSans-Bold'),
-            ('BACKGROUND', (0, 0), (-1, 0), colors.yellow),
-            ('TEXTCOLOR', (0, 0), (-1, 0), colors.black),
-            ('FONTSIZE', (0, 0), (-1, -1), 10),
-        ]))
+        payment_summary_table.setStyle(TABLE_STYLES['sales_payment_summary'])
 
         # Combine payment tables side by side
         combined_payments = Table([[paid_table, payment_summary_table]],
@@ -677,35 +433,16 @@ def generate_sales_invoice_pdf(request, invoice_id):
 
     # Build PDF
     doc.build(elements)
-    buffer.seek(0)
-    response.write(buffer.read())
-    return response
+    return buffer.getvalue()
 
 def generate_expense_pdf(request, pk):
     expense = Expense.objects.get(pk=pk)
 
-    # Get static files paths for fonts
-    font_normal = find('NotoSans.ttf')
-    font_bold = find('NotoSans-Bold.ttf')
-
-    # Get the logo path (ensure it exists!)
-    logo_file_path = find('LOGO.png')
-
-    if not logo_file_path:
-        raise FileNotFoundError("LOGO.png not found in static files!")
-
-    # Base64 encode the logo
-    logo_base64 = get_base64_image(logo_file_path)
-
-    # Fix path for fonts
-    def fix_path(path):
-        return path.replace('\\', '/') if os.name == 'nt' else path
-
     context = {
         'expense': expense,
-        'logo_path': logo_base64,  # Base64 encoded image for embedding
-        'noto_sans_path': f"file://{fix_path(font_normal)}" if font_normal else '',
-        'noto_sans_bold_path': f"file://{fix_path(font_bold)}" if font_bold else ''
+        'logo_path': logo_data_uri(expense.tenant_id),  # Embedded as a data: URI
+        'noto_sans_path': font_uri('NotoSans'),
+        'noto_sans_bold_path': font_uri('NotoSans-Bold'),
     }
 
     return render_to_pdf('expense_pdf.html', context)
@@ -714,28 +451,11 @@ def generate_expense_pdf(request, pk):
 def generate_damage_pdf(request, pk):
     damage = Damages.objects.get(pk=pk)
 
-    # Get static files paths for fonts
-    font_normal = find('NotoSans.ttf')
-    font_bold = find('NotoSans-Bold.ttf')
-
-    # Get the logo path (ensure it exists!)
-    logo_file_path = find('LOGO.png')
-
-    if not logo_file_path:
-        raise FileNotFoundError("LOGO.png not found in static files!")
-
-    # Base64 encode the logo
-    logo_base64 = get_base64_image(logo_file_path)
-
-    # Fix path for fonts
-    def fix_path(path):
-        return path.replace('\\', '/') if os.name == 'nt' else path
-
     context = {
         'damage': damage,
-        'logo_path': logo_base64,  # Base64 encoded image for embedding
-        'noto_sans_path': f"file://{fix_path(font_normal)}" if font_normal else '',
-        'noto_sans_bold_path': f"file://{fix_path(font_bold)}" if font_bold else ''
+        'logo_path': logo_data_uri(damage.tenant_id),  # Embedded as a data: URI
+        'noto_sans_path': font_uri('NotoSans'),
+        'noto_sans_bold_path': font_uri('NotoSans-Bold'),
     }
 
     return render_to_pdf('damage_pdf.html', context)
@@ -759,44 +479,28 @@ def render_to_pdf(template_path, context):
 
 def generate_packaging_invoice_pdf(request, invoice_id):
     invoice = get_object_or_404(Packaging_Invoice, id=invoice_id)
+    # Served from the PDF cache while the invoice is unchanged
+    return pdf_cache.serve(
+        request, pdf_cache.PACKAGING_INVOICE, invoice, False,
+        render_packaging_invoice_pdf, f"packaging_invoice_{invoice.id}.pdf",
+    )
 
-    response = HttpResponse(content_type='application/pdf')
-    response['Content-Disposition'] = f'inline; filename="packaging_invoice_{invoice.id}.pdf"'
-
+def render_packaging_invoice_pdf(invoice, hide_payments=False):
+    """PDF of a packaging invoice, as bytes"""
     buffer = BytesIO()
     doc = SimpleDocTemplate(buffer, pagesize=letter,
                           rightMargin=20, leftMargin=20,
                           topMargin=20, bottomMargin=30)
 
     elements = []
-    styles = getSampleStyleSheet()
-
-    # Custom style with DejaVu font
-    title_style = ParagraphStyle(
-        'Title',
-        parent=styles['Title'],
-        fontSize=16,
-        alignment=1,
-        textColor=colors.black,
-        fontName='DejaVuSans-Bold'
-    )
 
     # Add Logo and Header
     logo_header = []
-    logo_path = os.path.join(settings.STATICFILES_DIRS[0], 'LOGO.png')
-
-    if os.path.exists(logo_path):
-        try:
-            logo = Image(logo_path, width=2*inch, height=1.5*inch)
-            logo.hAlign = 'LEFT'
-            logo_table = Table([[logo]], colWidths=[2*inch])
-            logo_table.setStyle(TableStyle([
-                ('VALIGN', (0,0), (-1,-1), 'LEFT'),
-                ('LEFTPADDING', (0,0), (-1,-1), -50),
-            ]))
-            logo_header.append(logo_table)
-        except Exception as e:
-            print(f"Error loading logo: {str(e)}")
+    logo = logo_image(invoice.tenant_id, width=2*inch, height=1.5*inch, hAlign='LEFT')
+    if logo:
+        logo_table = Table([[logo]], colWidths=[2*inch])
+        logo_table.setStyle(TABLE_STYLES['packaging_logo'])
+        logo_header.append(logo_table)
 
     # Create header table
     header_data = [
@@ -805,13 +509,7 @@ def generate_packaging_invoice_pdf(request, invoice_id):
     ]
 
     header_table = Table(header_data, colWidths=[3*inch, 3*inch])
-    header_table.setStyle(TableStyle([
-        ('FONTNAME', (0,0), (-1,-1), 'DejaVuSans'),
-        ('FONTSIZE', (0,0), (-1,0), 14),
-        ('FONTNAME', (0,0), (-1,0), 'DejaVuSans-Bold'),
-        ('ALIGN', (0,0), (-1,-1), 'LEFT'),
-        ('VALIGN', (0,0), (-1,-1), 'MIDDLE'),
-    ]))
+    header_table.setStyle(TABLE_STYLES['packaging_header'])
 
     # Combine logo and header
     if logo_header:
@@ -830,35 +528,12 @@ def generate_packaging_invoice_pdf(request, invoice_id):
     ]
 
     invoice_table = Table(invoice_data, colWidths=[2*inch, 4*inch])
-    invoice_table.setStyle(TableStyle([
-        ('GRID', (0,0), (-1,-1), 0.5, colors.grey),
-        ('FONTNAME', (0,0), (-1,0), 'DejaVuSans-Bold'),
-        ('FONTNAME', (0,1), (-1,-1), 'DejaVuSans'),
-        ('BACKGROUND', (0,0), (-1,0), colors.yellow),
-        ('ALIGN', (0,0), (-1,-1), 'LEFT'),
-        ('VALIGN', (0,0), (-1,-1), 'MIDDLE'),
-    ]))
+    invoice_table.setStyle(TABLE_STYLES['packaging_details'])
 
     elements.append(invoice_table)
     elements.append(Spacer(1, 20))
 
-    # Footer with custom font
-    footer_style = ParagraphStyle(
-        'Footer',
-        parent=styles['Normal'],
-        fontSize=10,
-        leading=12,
-        textColor=colors.darkgrey,
-        fontName='DejaVuSans'
-    )
     # Footer
-    footer_style = ParagraphStyle(
-        'Footer',
-        parent=styles['Normal'],
-        fontSize=10,
-        leading=12,
-        textColor=colors.darkgrey
-    )
     footer_text = '''<para>
     Prepared By: _______________________ &nbsp;&nbsp;&nbsp;&nbsp;
     Approved By: _______________________<br/>
@@ -866,13 +541,12 @@ def generate_packaging_invoice_pdf(request, invoice_id):
     Signature: _______________________
     </para>'''
 
-    elements.append(Paragraph(footer_text, footer_style))
+    elements.append(Paragraph(footer_text, PARAGRAPH_STYLES['footer']))
 
     doc.build(elements)
-    buffer.seek(0)
-    response.write(buffer.read())
+    pdf = buffer.getvalue()
     buffer.close()
-    return response
+    return pdf
 
 
 def homepage(request):
@@ -897,19 +571,48 @@ def homepage(request):
     '''
     return HttpResponse(html_content)
 
+def _summary_page(request, queryset, sort_fields):
+    """
+    Due filters, grand totals and one keyset page of an annotated party summary
+    """
+    sort_by = request.GET.get('sort', 'name') # Default sort by name
+    if sort_by.lstrip('-') not in sort_fields:
+        sort_by = 'name'
+    min_due = summaries.parse_amount(request.GET.get('min_due'))
+    max_due = summaries.parse_amount(request.GET.get('max_due'))
+    queryset = summaries.filter_dues(queryset, min_due, max_due)
+
+    # Totals over every matching party, not just the page shown
+    sums = queryset.aggregate(**{
+        f'sum_{field}': Sum(field) for field in sort_fields if field != 'name'
+    })
+    totals = {name[len('sum_'):]: value or Decimal('0') for name, value in sums.items()}
+    cursor = request.GET.get('after')
+    rows, next_cursor = summaries.keyset_page(
+        queryset, sort_by.lstrip('-'), descending=sort_by.startswith('-'), cursor=cursor
+    )
+    return {
+        'rows': rows,
+        'totals': totals,
+        'next_cursor': next_cursor,
+        'is_first_page': not cursor,
+        'min_due': request.GET.get('min_due', ''),
+        'max_due': request.GET.get('max_due', ''),
+        'sort_by': sort_by,
+    }
+
 def vendor_purchase_summary(request):
     # Get filter parameters
     from_date_str = request.GET.get('from_date')
     to_date_str = request.GET.get('to_date')
     search_query = request.GET.get('search', '')
-    sort_by = request.GET.get('sort', 'name') # Default sort by name
 
     # Parse dates
     from_date = parse_date(from_date_str) if from_date_str else None
     to_date = parse_date(to_date_str) if to_date_str else None
 
-    # Base queryset - get unique vendors
-    vendor_qs = PurchaseVendor.objects.all().distinct()
+    # Base queryset - every vendor annotated with its totals in one grouped query
+    vendor_qs = PurchaseVendor.objects.all()
 
     # Apply search filter
     if search_query:
@@ -919,57 +622,20 @@ def vendor_purchase_summary(request):
             Q(area__icontains=search_query)
         )
 
-    # Get all vendors first, then we'll calculate totals manually
-    vendors = list(vendor_qs)
-    vendor_data = []
-
-    for vendor in vendors:
-        # Get all purchase invoices for this vendor
-        purchase_invoices = vendor.invoices.all()
-
-        # Apply date filters
-        if from_date:
-            purchase_invoices = purchase_invoices.filter(date__gte=from_date)
-        if to_date:
-            purchase_invoices = purchase_invoices.filter(date__lte=to_date)
-
-        # Calculate totals
-        total_purchases = sum(invoice.net_total for invoice in purchase_invoices)
-        total_cash_cutting = sum(invoice.net_total * Decimal('0.02') for invoice in purchase_invoices)
-        total_payments = sum(invoice.paid_amount for invoice in purchase_invoices)
-        due_amount = total_purchases - total_cash_cutting - total_payments
-
-        # Add calculated data
-        vendor.total_purchases = total_purchases
-        vendor.total_payments = total_payments
-        vendor.due_amount = due_amount
-        vendor_data.append(vendor)
-
-    # Apply sorting
-    valid_sort_fields = ['name', 'total_purchases', 'total_payments', 'due_amount']
-    sort_field = sort_by
-    reverse_sort = False
-
-    if sort_by.startswith('-'):
-        sort_field = sort_by[1:]
-        reverse_sort = True
-
-    if sort_field in valid_sort_fields:
-        if sort_field == 'name':
-            vendor_data.sort(key=lambda v: v.name, reverse=reverse_sort)
-        elif sort_field == 'total_purchases':
-            vendor_data.sort(key=lambda v: v.total_purchases, reverse=reverse_sort)
-        elif sort_field == 'total_payments':
-            vendor_data.sort(key=lambda v: v.total_payments, reverse=reverse_sort)
-        elif sort_field == 'due_amount':
-            vendor_data.sort(key=lambda v: v.due_amount, reverse=reverse_sort)
+    vendor_qs = summaries.vendor_totals(vendor_qs, from_date, to_date)
+    page = _summary_page(request, vendor_qs, ['name', 'total_purchases', 'total_payments', 'due_amount'])
 
     context = {
-        'vendors': vendor_data,
+        'vendors': page['rows'],
+        'totals': page['totals'],
+        'next_cursor': page['next_cursor'],
+        'is_first_page': page['is_first_page'],
+        'min_due': page['min_due'],
+        'max_due': page['max_due'],
         'from_date': from_date_str,
         'to_date': to_date_str,
         'search_query': search_query,
-        'sort_by': sort_by,
+        'sort_by': page['sort_by'],
     }
     return render(request, 'Accounts/vendor_purchase_summary.html', context)
 
@@ -978,14 +644,13 @@ def customer_purchase_summary(request):
     from_date_str = request.GET.get('from_date')
     to_date_str = request.GET.get('to_date')
     search_query = request.GET.get('search', '')
-    sort_by = request.GET.get('sort', 'name') # Default sort by name
 
     # Parse dates
     from_date = parse_date(from_date_str) if from_date_str else None
     to_date = parse_date(to_date_str) if to_date_str else None
 
-    # Base queryset - get unique customers
-    customer_qs = Customer.objects.all().distinct()
+    # Base queryset - every customer annotated with its totals in one grouped query
+    customer_qs = Customer.objects.with_credit()
 
     # Apply search filter
     if search_query:
@@ -995,63 +660,20 @@ def customer_purchase_summary(request):
             Q(address__icontains=search_query)
         )
 
-    # Create base invoice filter for dates
-    invoice_date_filter = Q()
-    if from_date:
-        invoice_date_filter &= Q(sales_invoices__invoice_date__gte=from_date)
-    if to_date:
-        invoice_date_filter &= Q(sales_invoices__invoice_date__lte=to_date)
-
-    # Get all customers first, then we'll calculate totals manually
-    customers = list(customer_qs)
-    customer_data = []
-
-    for customer in customers:
-        # Get all sales invoices for this customer
-        sales_invoices = customer.sales_invoices.all()
-
-        # Apply date filters
-        if from_date:
-            sales_invoices = sales_invoices.filter(invoice_date__gte=from_date)
-        if to_date:
-            sales_invoices = sales_invoices.filter(invoice_date__lte=to_date)
-
-        # Calculate totals
-        total_sales = sum(invoice.net_total_after_packaging for invoice in sales_invoices)
-        total_payments = sum(invoice.paid_amount for invoice in sales_invoices)
-        due_amount = total_sales - total_payments
-
-        # Add calculated data
-        customer.total_sales = total_sales
-        customer.total_payments = total_payments
-        customer.due_amount = due_amount
-        customer_data.append(customer)
-
-    # Apply sorting
-    valid_sort_fields = ['name', 'total_sales', 'total_payments', 'due_amount']
-    sort_field = sort_by
-    reverse_sort = False
-
-    if sort_by.startswith('-'):
-        sort_field = sort_by[1:]
-        reverse_sort = True
-
-    if sort_field in valid_sort_fields:
-        if sort_field == 'name':
-            customer_data.sort(key=lambda c: c.name, reverse=reverse_sort)
-        elif sort_field == 'total_sales':
-            customer_data.sort(key=lambda c: c.total_sales, reverse=reverse_sort)
-        elif sort_field == 'total_payments':
-            customer_data.sort(key=lambda c: c.total_payments, reverse=reverse_sort)
-        elif sort_field == 'due_amount':
-            customer_data.sort(key=lambda c: c.due_amount, reverse=reverse_sort)
+    customer_qs = summaries.customer_totals(customer_qs, from_date, to_date)
+    page = _summary_page(request, customer_qs, ['name', 'total_sales', 'total_payments', 'due_amount'])
 
     context = {
-        'customers': customer_data,
+        'customers': page['rows'],
+        'totals': page['totals'],
+        'next_cursor': page['next_cursor'],
+        'is_first_page': page['is_first_page'],
+        'min_due': page['min_due'],
+        'max_due': page['max_due'],
         'from_date': from_date_str,
         'to_date': to_date_str,
         'search_query': search_query,
-        'sort_by': sort_by,
+        'sort_by': page['sort_by'],
     }
     return render(request, 'Accounts/customer_purchase_summary.html', context)
 
@@ -1123,9 +745,7 @@ def vendor_outstanding_invoices_api(request):
     outstanding_invoices = PurchaseInvoice.objects.filter(
         vendor=vendor,
         net_total__gt=0
-    ).exclude(
-        net_total_after_cash_cutting=F('paid_amount')
-    ).order_by('date')
+    ).outstanding().order_by('date')
     
     invoices_data = []
     for invoice in outstanding_invoices:
@@ -1394,6 +1014,18 @@ def direct_login(request):
         logger.error(f"Direct login error: {str(e)}")
         return Response({"error": str(e)}, status=500)
 
+def _report_allocation(request, report):
+    """Flash the outcome of a bulk payment allocation"""
+    messages.success(
+        request,
+        f"Allocated ₹{report['allocated']:.2f} over {len(report['invoices'])} invoice(s)."
+    )
+    if report['unallocated']:
+        messages.warning(
+            request,
+            f"₹{report['unallocated']:.2f} was not allocated: it exceeds the selected invoices' due amount."
+        )
+
 @staff_member_required
 def vendor_bulk_payment(request):
     """
@@ -1410,7 +1042,7 @@ def vendor_bulk_payment(request):
     to_date = parse_date(to_date_str) if to_date_str else None
     
     # Get vendors with outstanding balances
-    vendors = PurchaseVendor.objects.all().distinct()
+    vendors = PurchaseVendor.objects.all()
     
     if search_query:
         vendors = vendors.filter(
@@ -1422,108 +1054,29 @@ def vendor_bulk_payment(request):
     # Process form submission for bulk payment
     if request.method == 'POST':
         selected_vendor_id = request.POST.get('vendor_id')
-        payment_amount = Decimal(request.POST.get('payment_amount', 0))
-        payment_date = parse_date(request.POST.get('payment_date')) or date.today()
+        payment_amount = summaries.parse_amount(request.POST.get('payment_amount')) or Decimal('0')
+        payment_date = parse_date(request.POST.get('payment_date') or '') or date.today()
         selected_invoice_ids = request.POST.getlist('invoice_ids')
-        payment_method = request.POST.get('payment_method', 'Cash')
+        payment_method = request.POST.get('payment_method', 'cash')
         reference_number = request.POST.get('reference_number', '')
         notes = request.POST.get('notes', '')
         
         if selected_vendor_id and payment_amount > 0:
-            vendor = PurchaseVendor.objects.get(id=selected_vendor_id)
-            
-            # If specific invoices are selected, allocate payment to them
-            if selected_invoice_ids:
-                remaining_amount = payment_amount
-                invoices = SalesInvoice.objects.filter(id__in=selected_invoice_ids).order_by('invoice_date')
-                
-                if invoices.exists():
-                    # Create payment and associate with the first invoice
-                    first_invoice = invoices.first()
-                    payment = SalesPayment.objects.create(
-                        invoice=first_invoice,  # Associate with first invoice initially
-                        amount=payment_amount,
-                        date=payment_date,
-                        payment_mode=payment_method,
-                        attachment=None
-                    )
-                    
-                    for invoice in invoices:
-                        if remaining_amount <= 0:
-                            break
-                            
-                        # Calculate how much can be allocated to this invoice
-                        invoice_due = invoice.due_amount
-                        allocation = min(invoice_due, remaining_amount)
-                        
-                        if allocation > 0 and invoice.id != first_invoice.id:
-                            # Link payment to other invoices (first one is already linked)
-                            invoice.payments.add(payment)
-                            remaining_amount -= allocation
-                else:
-                    messages.error(request, "No valid invoices selected.")
-                    return redirect('vendor_bulk_payment')
-            # If no specific invoices selected, apply to oldest outstanding invoice
-            else:
-                outstanding_invoices = PurchaseInvoice.objects.filter(
-                    vendor=vendor
-                ).exclude(
-                    net_total_after_cash_cutting=F('paid_amount')
-                ).order_by('date')
-                
-                if outstanding_invoices.exists():
-                    # Create payment and associate with the first outstanding invoice
-                    first_invoice = outstanding_invoices.first()
-                    payment = SalesPayment.objects.create(
-                        invoice=first_invoice,  # Associate with first invoice initially
-                        amount=payment_amount,
-                        date=payment_date,
-                        payment_mode=payment_method,
-                        attachment=None
-                    )
-                    
-                    remaining = payment_amount
-                    for invoice in outstanding_invoices:
-                        if remaining <= 0:
-                            break
-                            
-                        invoice_due = invoice.due_amount
-                        allocation = min(invoice_due, remaining)
-                        
-                        if allocation > 0 and invoice.id != first_invoice.id:
-                            # Link payment to other invoices (first one is already linked)
-                            invoice.payments.add(payment)
-                            remaining -= allocation
-                else:
-                    messages.error(request, "No outstanding invoices found for this vendor.")
-                    return redirect('vendor_bulk_payment')
-            
+            vendor = get_object_or_404(PurchaseVendor, id=selected_vendor_id)
+            try:
+                report = payments.allocate_payment(
+                    vendor, payment_amount, selected_invoice_ids or None, payment_date, payment_method
+                )
+            except ValidationError as e:
+                messages.error(request, "; ".join(e.messages))
+                return redirect('vendor_bulk_payment')
+            _report_allocation(request, report)
             return redirect('vendor_purchase_summary')
     
-    # Get list of vendors with their due amounts
-    vendor_data = []
-    for vendor in vendors:
-        # Get all invoices for this vendor
-        invoices = vendor.invoices.all()
-        
-        # Apply date filters if provided
-        if from_date:
-            invoices = invoices.filter(date__gte=from_date)
-        if to_date:
-            invoices = invoices.filter(date__lte=to_date)
-        
-        # Calculate total and due amounts
-        total_purchases = sum(invoice.net_total for invoice in invoices)
-        total_cash_cutting = sum(invoice.net_total * Decimal('0.02') for invoice in invoices)
-        total_payments = sum(invoice.paid_amount for invoice in invoices)
-        due_amount = total_purchases - total_cash_cutting - total_payments
-        
-        # Only include vendors with outstanding balances
-        if due_amount > 0:
-            vendor.total_purchases = total_purchases
-            vendor.total_payments = total_payments
-            vendor.due_amount = due_amount
-            vendor_data.append(vendor)
+    # Get list of vendors with their due amounts, in one grouped query
+    vendor_data = list(
+        summaries.vendor_totals(vendors, from_date, to_date).filter(due_amount__gt=0).order_by('name')
+    )
     
     # Get outstanding invoices for a specific vendor if selected
     outstanding_invoices = []
@@ -1540,10 +1093,7 @@ def vendor_bulk_payment(request):
             invoices = invoices.filter(date__lte=to_date)
         
         # Get only invoices with outstanding balances
-        outstanding_invoices = [
-            invoice for invoice in invoices
-            if invoice.due_amount > 0
-        ]
+        outstanding_invoices = list(invoices.outstanding())
     
     context = {
         'vendors': vendor_data,
@@ -1573,7 +1123,7 @@ def customer_bulk_payment(request):
     to_date = parse_date(to_date_str) if to_date_str else None
     
     # Get customers with outstanding balances
-    customers = Customer.objects.all().distinct()
+    customers = Customer.objects.all()
     
     if search_query:
         customers = customers.filter(
@@ -1585,105 +1135,29 @@ def customer_bulk_payment(request):
     # Process form submission for bulk payment
     if request.method == 'POST':
         selected_customer_id = request.POST.get('customer_id')
-        payment_amount = Decimal(request.POST.get('payment_amount', 0))
-        payment_date = parse_date(request.POST.get('payment_date')) or date.today()
+        payment_amount = summaries.parse_amount(request.POST.get('payment_amount')) or Decimal('0')
+        payment_date = parse_date(request.POST.get('payment_date') or '') or date.today()
         selected_invoice_ids = request.POST.getlist('invoice_ids')
-        payment_method = request.POST.get('payment_method', 'Cash')
+        payment_method = request.POST.get('payment_method', 'cash')
         reference_number = request.POST.get('reference_number', '')
         notes = request.POST.get('notes', '')
         
         if selected_customer_id and payment_amount > 0:
-            customer = Customer.objects.get(id=selected_customer_id)
-            
-            # If specific invoices are selected, allocate payment to them
-            if selected_invoice_ids:
-                remaining_amount = payment_amount
-                invoices = SalesInvoice.objects.filter(id__in=selected_invoice_ids).order_by('invoice_date')
-                
-                if invoices.exists():
-                    # Create payment and associate with the first invoice
-                    first_invoice = invoices.first()
-                    payment = SalesPayment.objects.create(
-                        invoice=first_invoice,  # Associate with first invoice initially
-                        amount=payment_amount,
-                        date=payment_date,
-                        payment_mode=payment_method,
-                        attachment=None
-                    )
-                    
-                    for invoice in invoices:
-                        if remaining_amount <= 0:
-                            break
-                            
-                        # Calculate how much can be allocated to this invoice
-                        invoice_due = invoice.due_amount
-                        allocation = min(invoice_due, remaining_amount)
-                        
-                        if allocation > 0 and invoice.id != first_invoice.id:
-                            # Link payment to other invoices (first one is already linked)
-                            SalesPayment.objects.create(
-                                invoice=invoice,
-                                amount=allocation,
-                                date=payment_date,
-                                payment_mode=payment_method,
-                                attachment=None
-                            )
-                            remaining_amount -= allocation
-                else:
-                    messages.error(request, "No valid invoices selected.")
-                    return redirect('customer_bulk_payment')
-            # If no specific invoices selected, apply to oldest outstanding invoice
-            else:
-                outstanding_invoices = SalesInvoice.objects.filter(
-                    vendor=customer
-                ).exclude(
-                    net_total_after_packaging=F('paid_amount')
-                ).order_by('invoice_date')
-                
-                if outstanding_invoices.exists():
-                    remaining = payment_amount
-                    for invoice in outstanding_invoices:
-                        if remaining <= 0:
-                            break
-                            
-                        invoice_due = invoice.due_amount
-                        allocation = min(invoice_due, remaining)
-                        
-                        if allocation > 0:
-                            SalesPayment.objects.create(
-                                invoice=invoice,
-                                amount=allocation,
-                                date=payment_date,
-                                payment_mode=payment_method,
-                                attachment=None
-                            )
-                            remaining -= allocation
-                else:
-                    messages.error(request, "No outstanding invoices found for this customer.")
-                    return redirect('customer_bulk_payment')
-            
+            customer = get_object_or_404(Customer, id=selected_customer_id)
+            try:
+                report = payments.allocate_payment(
+                    customer, payment_amount, selected_invoice_ids or None, payment_date, payment_method
+                )
+            except ValidationError as e:
+                messages.error(request, "; ".join(e.messages))
+                return redirect('customer_bulk_payment')
+            _report_allocation(request, report)
             return redirect('customer_purchase_summary')
     
-    # Get list of customers with their due amounts
-    customer_data = []
-    for customer in customers:
-        invoices = SalesInvoice.objects.filter(vendor=customer)
-        
-        # Apply date filters if provided
-        if from_date:
-            invoices = invoices.filter(invoice_date__gte=from_date)
-        if to_date:
-            invoices = invoices.filter(invoice_date__lte=to_date)
-        
-        # Calculate total due amount
-        due_amount = sum(invoice.due_amount for invoice in invoices)
-        
-        # Only include customers with outstanding balances
-        if due_amount > 0:
-            customer.total_sales = sum(invoice.net_total_after_packaging for invoice in invoices)
-            customer.total_payments = sum(invoice.paid_amount for invoice in invoices)
-            customer.due_amount = due_amount
-            customer_data.append(customer)
+    # Get list of customers with their due amounts, in one grouped query
+    customer_data = list(
+        summaries.customer_totals(customers, from_date, to_date).filter(due_amount__gt=0).order_by('name')
+    )
     
     # Get outstanding invoices for a specific customer if selected
     outstanding_invoices = []
@@ -1700,10 +1174,7 @@ def customer_bulk_payment(request):
             invoices = invoices.filter(invoice_date__lte=to_date)
         
         # Get only invoices with outstanding balances
-        outstanding_invoices = [
-            invoice for invoice in invoices
-            if invoice.due_amount > 0
-        ]
+        outstanding_invoices = list(invoices.filter(due_amount__gt=0))
     
     context = {
         'customers': customer_data,
@@ -1734,59 +1205,25 @@ def inventory_management(request):
             Q(name__icontains=search_query)
         )
     
-    # Get all purchase invoices (lots) with available quantity
-    purchase_lots = PurchaseInvoice.objects.annotate(
-        sold_quantity=Coalesce(Sum('sales_lots__quantity'), Decimal('0')),
-        remaining_quantity=ExpressionWrapper(
-            Sum('purchase_products__quantity') - F('sold_quantity'),
-            output_field=DecimalField()
-        )
-    ).filter(remaining_quantity__gt=0).order_by('-date')
-    
-    # Get inventory summary by product
-    inventory_summary = []
-    for product in products:
-        # Get available quantity for this product across all lots
-        product_lots = PurchaseProduct.objects.filter(product=product)
-        
-        # Calculate total purchased quantity
-        total_purchased = product_lots.aggregate(
-            total=Sum('quantity')
-        )['total'] or Decimal('0')
-        
-        # Calculate total sold quantity
-        total_sold = SalesLot.objects.filter(
-            purchase_invoice__purchase_products__product=product
-        ).aggregate(
-            total=Sum('quantity')
-        )['total'] or Decimal('0')
-        
-        # Calculate available quantity
-        available = total_purchased - total_sold
-        
-        # Calculate average purchase price
-        avg_price = Decimal('0')
-        if total_purchased > 0:
-            avg_price = product_lots.aggregate(
-                total_value=Sum(F('quantity') * F('price'))
-            )['total_value'] or Decimal('0')
-            
-            if total_purchased > 0:
-                avg_price = avg_price / total_purchased
-        
-        # Only include products with available quantity
-        if available > 0:
-            inventory_summary.append({
-                'product': product,
-                'total_purchased': total_purchased,
-                'total_sold': total_sold,
-                'available': available,
-                'avg_price': avg_price,
-                'total_value': available * avg_price
-            })
+    # Lots with quantity left to sell
+    purchase_lots = (
+        PurchaseInvoice.objects.available()
+        .select_related('vendor')
+        .order_by('-date')
+    )
     
-    # Sort inventory summary by available quantity (descending)
-    inventory_summary.sort(key=lambda x: x['available'], reverse=True)
+    # Stock of every product from one grouped query
+    inventory_summary = [
+        {
+            'product': product,
+            'total_purchased': product.stock_purchased,
+            'total_sold': product.stock_sold,
+            'available': product.stock_available,
+            'avg_price': product.stock_average_cost,
+            'total_value': product.stock_value,
+        }
+        for product in products.in_stock().order_by('-stock_available', 'name')
+    ]
     
     # Get inventory details for a specific product if selected
     product_lots = []
@@ -1794,19 +1231,12 @@ def inventory_management(request):
     
     if product_id:
         selected_product = get_object_or_404(Product, id=product_id)
-        product_lots = PurchaseProduct.objects.filter(
-            product=selected_product
-        ).select_related('invoice').annotate(
-            sold_quantity=Coalesce(
-                Sum('invoice__sales_lots__quantity', 
-                    filter=Q(invoice__sales_lots__purchase_product__product=selected_product)),
-                Decimal('0')
-            ),
-            remaining_quantity=ExpressionWrapper(
-                F('quantity') - F('sold_quantity'),
-                output_field=DecimalField()
-            )
-        ).filter(remaining_quantity__gt=0).order_by('-invoice__date')
+        product_lots = (
+            selected_product.lots()
+            .filter(stock_available__gt=0)
+            .select_related('vendor')
+            .order_by('-date')
+        )
     
     context = {
         'inventory_summary': inventory_summary,
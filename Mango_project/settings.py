@@ -138,6 +138,16 @@ WSGI_APPLICATION = 'Mango_project.wsgi.application'
 # }
 
 
+# Cache shared by all worker processes on the host; the dashboard snapshots
+# and their version counters must be seen by every worker (see Accounts/dashboard.py)
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': os.path.join(BASE_DIR, 'django_cache'),
+    }
+}
+
+
 # Database
 # https://docs.djangoproject.com/en/5.1/ref/settings/#databases
 DATABASES = {
@@ -188,6 +198,9 @@ STATIC_ROOT = os.path.join(BASE_DIR, 'staticfiles')
 MEDIA_URL = '/media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
 
+# Rendered invoice PDFs, see Accounts/pdf_cache.py
+INVOICE_PDF_CACHE_DIR = os.path.join(BASE_DIR, 'pdf_cache')
+
 
 # Default primary key field type
 # https://docs.djangoproject.com/en/5.1/ref/settings/#default-auto-field
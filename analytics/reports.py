@@ -3,13 +3,12 @@ import numpy as np
 from datetime import datetime, timedelta
 from django.db.models import Sum, Avg, Count, F, Q, ExpressionWrapper, DecimalField
 from django.utils import timezone
-from Accounts.models import PurchaseInvoice, PurchaseProduct, Payment, Product, PurchaseVendor
+from Accounts.models import DailyRollup, PurchaseInvoice, PurchaseProduct, Payment, Product, PurchaseVendor
 from io import BytesIO
 import matplotlib.pyplot as plt
 from reportlab.lib.pagesizes import letter, landscape
-from reportlab.platypus import SimpleDocTemplate, Table, TableStyle, Paragraph, Spacer, Image
-from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
-from reportlab.lib import colors
+from reportlab.platypus import SimpleDocTemplate, Table, Paragraph, Spacer, Image
+from Accounts.pdf_resources import SAMPLE_STYLES, TABLE_STYLES
 import xlsxwriter
 
 class ReportGenerator:
@@ -33,16 +32,15 @@ class ReportGenerator:
         
         buffer = output or BytesIO()
         doc = SimpleDocTemplate(buffer, pagesize=letter)
-        styles = getSampleStyleSheet()
         elements = []
         
         # Title
-        title_style = styles['Heading1']
+        title_style = SAMPLE_STYLES['Heading1']
         title = Paragraph(f"{self.__class__.__name__.replace('Report', ' Report')}", title_style)
         elements.append(title)
         
         # Date range
-        date_style = styles['Normal']
+        date_style = SAMPLE_STYLES['Normal']
         date_range = Paragraph(f"Period: {self.start_date} to {self.end_date}", date_style)
         elements.append(date_range)
         elements.append(Spacer(1, 12))
@@ -51,15 +49,7 @@ class ReportGenerator:
         if isinstance(self.data, pd.DataFrame):
             data_list = [self.data.columns.tolist()] + self.data.values.tolist()
             table = Table(data_list)
-            table.setStyle(TableStyle([
-                ('BACKGROUND', (0, 0), (-1, 0), colors.lightgreen),
-                ('TEXTCOLOR', (0, 0), (-1, 0), colors.black),
-                ('ALIGN', (0, 0), (-1, -1), 'CENTER'),
-                ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
-                ('BOTTOMPADDING', (0, 0), (-1, 0), 12),
-                ('BACKGROUND', (0, 1), (-1, -1), colors.white),
-                ('GRID', (0, 0), (-1, -1), 1, colors.black),
-            ]))
+            table.setStyle(TABLE_STYLES['report'])
             elements.append(table)
         
         # Build the PDF
@@ -177,18 +167,22 @@ class InventoryReport(ReportGenerator):
         # Get all products for this tenant
         products = Product.objects.filter(tenant=self.tenant)
         
+        # Purchased quantity per product up to the end date from the daily rollups
+        purchased = dict(
+            DailyRollup.objects.filter(tenant=self.tenant, date__lte=self.end_date, product__isnull=False)
+            .values('product').annotate(total=Sum('purchased_quantity')).values_list('product', 'total')
+        )
+        # Average purchase price per product up to the end date; products never purchased have none
+        average_prices = dict(
+            PurchaseProduct.objects.filter(invoice__tenant=self.tenant, invoice__date__lte=self.end_date)
+            .order_by().values('product').annotate(avg=Avg('price')).values_list('product', 'avg')
+        )
+        
         # Create a DataFrame for inventory status
         data = []
         for product in products:
-            # Get all purchase products for this product
-            purchase_products = PurchaseProduct.objects.filter(
-                product=product,
-                invoice__date__lte=self.end_date
-            )
-            
-            total_purchased = purchase_products.aggregate(
-                total=Sum('quantity')
-            )['total'] or 0
+            average_price = average_prices.get(product.pk)
+            total_purchased = purchased.get(product.pk) or 0
             
             # In a real implementation, you would subtract sales
             # For now, we'll use a placeholder for available quantity
@@ -198,7 +192,7 @@ class InventoryReport(ReportGenerator):
                 'Product': product.name,
                 'Total Purchased': total_purchased,
                 'Available Quantity': available,
-                'Value': available * purchase_products.aggregate(avg=Avg('price'))['avg'] if purchase_products.exists() else 0
+                'Value': available * average_price if average_price is not None else 0
             })
         
         self.data = pd.DataFrame(data)
@@ -3,7 +3,7 @@ import numpy as np
 from datetime import datetime, timedelta
 from django.db.models import Sum, Avg, Count, F, Q
 from django.utils import timezone
-from Accounts.models import PurchaseInvoice, PurchaseProduct, Product
+from Accounts.models import DailyRollup, Product
 from .models import ForecastModel, ProductForecast, InventoryAlert
 
 class BaseForecaster:
@@ -20,20 +20,15 @@ class BaseForecaster:
     
     def prepare_data(self):
         """Prepare historical data for forecasting"""
-        # Get all purchase products for this product
-        purchase_products = PurchaseProduct.objects.filter(
+        # Daily purchased quantities for this product from the daily rollups
+        daily = DailyRollup.objects.filter(
             product=self.product,
-            invoice__date__gte=self.start_date,
-            invoice__date__lte=self.end_date
-        ).select_related('invoice')
+            date__gte=self.start_date,
+            date__lte=self.end_date
+        ).values('date').annotate(quantity=Sum('purchased_quantity')).order_by()
         
         # Create a DataFrame with daily quantities
-        data = []
-        for pp in purchase_products:
-            data.append({
-                'date': pp.invoice.date,
-                'quantity': pp.quantity
-            })
+        data = [{'date': row['date'], 'quantity': row['quantity']} for row in daily]
         
         if not data:
             # No data available
@@ -41,9 +36,6 @@ class BaseForecaster:
         
         df = pd.DataFrame(data)
         
-        # Aggregate by date
-        df = df.groupby('date')['quantity'].sum().reset_index()
-        
         # Sort by date
         df = df.sort_values('date')
         